@@ -9,6 +9,7 @@ from flask_login import LoginManager
 from flask_babel import _, Babel # Импортируем Babel
 from config import Config
 from werkzeug.security import generate_password_hash
+import click
 import os
 import json
 
@@ -107,6 +108,79 @@ def create_app(config_class=Config):
         except (TypeError, ValueError):
             return []
 
+    # === Кэш разобранных аннотаций ===
+    from app.utils.annotation_cache import annotation_cache
+    annotation_cache.max_bytes = app.config.get('ANNOTATION_CACHE_MAX_BYTES', annotation_cache.max_bytes)
+
+    # === Общее mmap-хранилище эталонных контуров ===
+    from app.utils.contour_store import contour_store
+    contour_store.folder = app.config.get('CONTOUR_STORE_FOLDER')
+
+    # === Хранилище загруженных файлов (локальное или S3-совместимое) ===
+    from app.utils.storage import storage
+    storage.configure(app.config)
+
+    # === Пул фоновых воркеров (приём загрузок и другие задачи) ===
+    from app.utils.background_jobs import init_background_jobs
+    init_background_jobs(app)
+    # Регистрация обработчиков фоновых задач
+    from app.utils import (ingest_pipeline, dataset_import, upload_gc, variant_generation,  # noqa: F401
+                           similarity_report)
+
+    @app.cli.command('rebuild-contour-store')
+    def rebuild_contour_store_command():
+        """Перестройка mmap-хранилища контуров из таблицы annotation_contours"""
+        from app.utils.reference_geometry import rebuild_contour_store
+        count = rebuild_contour_store()
+        print(f"Хранилище контуров перестроено: {count} аннотаций")
+
+    @app.cli.command('build-phash-index')
+    def build_phash_index_command():
+        """Вычисление перцептивных хешей для аннотаций, загруженных до появления индекса"""
+        from app.models.annotation import ImageAnnotation, ImagePerceptualHash
+        from app.utils.image_hashing import record_image_phash
+        from app.utils.storage import storage_key
+        missing = ImageAnnotation.query.outerjoin(ImagePerceptualHash) \
+            .filter(ImagePerceptualHash.id.is_(None)).all()
+        count = 0
+        for annotation in missing:
+            image_path = storage.fetch(storage_key('images', annotation.image_file))
+            if image_path and record_image_phash(annotation, image_path) is not None:
+                count += 1
+        db.session.commit()
+        print(f"Перцептивные хеши вычислены: {count} из {len(missing)} аннотаций")
+
+    @app.cli.command('gc-uploads')
+    @click.option('--delete', is_flag=True, help='Удалить найденные файлы (по умолчанию — только отчёт)')
+    @click.option('--grace-hours', type=float, default=None, help='Период отсрочки, ч')
+    def gc_uploads_command(delete, grace_hours):
+        """Сборка мусора в хранилище загрузок: файлы, на которые не ссылаются аннотации"""
+        from app.utils.upload_gc import start_upload_gc
+        app.config['BACKGROUND_JOBS_ASYNC'] = False  # Задача выполняется в процессе команды
+        job = start_upload_gc(dry_run=not delete, grace_hours=grace_hours)
+        if job.status != 'done':
+            print(f"Сборка мусора завершилась ошибкой: {job.message}")
+            return
+        report = job.result
+        print(f"Неиспользуемых объектов: {report['orphans']}, {report['bytes']} байт, удалено: {report['deleted']}")
+        for key in report['sample']:
+            print(f"  {key}")
+
+    @app.cli.command('rebuild-question-stats')
+    def rebuild_question_stats_command():
+        """Пересчёт счётчиков вопросов конструктора тестов по таблице questions"""
+        from app.utils.question_stats import rebuild_question_counts
+        count = rebuild_question_counts()
+        db.session.commit()
+        print(f"Счётчики вопросов пересчитаны: {count} групп")
+
+    @app.cli.command('build-label-index')
+    def build_label_index_command():
+        """Заполнение индекса меток по контурам аннотаций, загруженных до его появления"""
+        from app.utils.label_index import rebuild_label_index
+        count = rebuild_label_index()
+        print(f"Индекс меток построен: {count} аннотаций")
+
     # === Создание папок загрузки ===
     upload_folder = app.config['UPLOAD_FOLDER']
     os.makedirs(upload_folder, exist_ok=True)
@@ -118,11 +192,35 @@ def create_app(config_class=Config):
         # Импорт моделей (чтобы SQLAlchemy их увидел)
         from app.models.user import User
         from app.models.test_topics import TestTopic
-        from app.models.question import Question
-        from app.models.annotation import ImageAnnotation, TestResult
-        from app.models.test_variant import Test, Variant
+        from app.models.question import Question, QuestionCount, QuestionCountVersion
+        from app.models.annotation import (ImageAnnotation, AnnotationContour, AnnotationLabel, AnnotationLabelStat,
+                                           ImagePerceptualHash, TestResult)
+        from app.models.test_variant import Test, Variant, VariantQuestion
+        from app.models.background_job import BackgroundJob
+        from app.models.upload_session import UploadSession
 
         db.create_all()
+        # create_all не добавляет столбцы и индексы в уже существующие таблицы
+        from sqlalchemy import inspect
+        if 'label_id' not in {c['name'] for c in inspect(db.engine).get_columns('annotation_contours')}:
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql('ALTER TABLE annotation_contours ADD COLUMN label_id INTEGER '
+                                           'REFERENCES annotation_labels(id) ON DELETE SET NULL')
+        for index in (*ImageAnnotation.__table__.indexes, *AnnotationContour.__table__.indexes):
+            index.create(db.engine, checkfirst=True)
+        # Позиции вопросов вариантов, созданных до появления таблицы variant_questions
+        from app.utils.variant_generation import backfill_variant_questions
+        backfill_variant_questions()
+
+        # Задачи, прерванные остановкой процесса, переводятся в failed (их можно возобновить)
+        from app.utils.background_jobs import fail_stale_jobs
+        fail_stale_jobs()
+
+        # Первичное заполнение счётчиков вопросов для баз, созданных до их появления
+        if db.session.query(QuestionCount.id).first() is None and db.session.query(Question.id).first():
+            from app.utils.question_stats import rebuild_question_counts
+            rebuild_question_counts()
+            db.session.commit()
 
         # === Создание администратора по умолчанию ===
         # Используем хэшированный пароль 'admin'
@@ -9,7 +9,9 @@ from flask_sqlalchemy import SQLAlchemy
 from .user import User
 from .test_topics import TestTopic
 from .question import Question
-from .annotation import ImageAnnotation, TestResult
+from .annotation import ImageAnnotation, AnnotationContour, AnnotationLabel, AnnotationLabelStat, ImagePerceptualHash, TestResult
 from .test_variant import Test, Variant
+from .background_job import BackgroundJob
+from .upload_session import UploadSession
 
-__all__ = ['User', 'Question', 'ImageAnnotation', 'TestResult', 'TestTopic', 'Test', 'Variant']
\ No newline at end of file
+__all__ = ['User', 'Question', 'ImageAnnotation', 'AnnotationContour', 'AnnotationLabel', 'AnnotationLabelStat', 'ImagePerceptualHash', 'TestResult', 'TestTopic', 'Test', 'Variant', 'BackgroundJob', 'UploadSession']
\ No newline at end of file
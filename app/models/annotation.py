@@ -6,7 +6,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from app import db
 from datetime import datetime
-from sqlalchemy import String, Integer, DateTime, Float, Text, ForeignKey
+from sqlalchemy import String, Integer, BigInteger, DateTime, Float, Text, ForeignKey, LargeBinary
+import numpy as np
 
 class ImageAnnotation(db.Model):
     """
@@ -25,13 +26,23 @@ class ImageAnnotation(db.Model):
 
     # Основные поля
     id = db.Column(Integer, primary_key=True)
-    image_file = db.Column(String(200), nullable=False)
+    image_file = db.Column(String(200), nullable=False, index=True)  # Для хранения по хешу: ab/cd/<sha256>.<ext>
     annotation_file = db.Column(String(200))  # Путь к файлу аннотации (COCO/JSON или YOLO/TXT)
     format_type = db.Column(String(10), default='coco')  # 'coco' или 'yolo'
     created_at = db.Column(DateTime, default=datetime.utcnow)
 
     # НОВОЕ: Связь с вопросами
     questions = db.relationship('Question', back_populates='image_annotation', lazy=True)
+    # Разобранные эталонные контуры (заполняются при загрузке)
+    contours = db.relationship('AnnotationContour', back_populates='annotation', lazy=True,
+                               cascade='all, delete-orphan', passive_deletes=True,
+                               order_by='AnnotationContour.position')
+    # Перцептивный хеш изображения (поиск почти-дубликатов)
+    perceptual_hash = db.relationship('ImagePerceptualHash', back_populates='annotation', uselist=False,
+                                      cascade='all, delete-orphan', passive_deletes=True)
+    # Инвертированный индекс меток: статистика контуров каждой метки на изображении
+    label_stats = db.relationship('AnnotationLabelStat', back_populates='annotation', lazy=True,
+                                  cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         """
@@ -42,6 +53,167 @@ class ImageAnnotation(db.Model):
         """
         return f'<ImageAnnotation {self.filename} ({self.format_type}>)'
 
+class AnnotationContour(db.Model):
+    """
+    Модель эталонного контура аннотации (разобранная геометрия)
+
+    Attributes:
+        id (int): Уникальный идентификатор контура
+        annotation_id (int): ID аннотации изображения
+        position (int): Порядковый номер контура в файле аннотации
+        label (str): Метка (название категории COCO)
+        label_id (int): ID метки в нормализованной таблице меток
+        bbox_x, bbox_y, bbox_w, bbox_h (float): Ограничивающий прямоугольник
+        area (float): Площадь контура
+        vertex_count (int): Количество вершин
+        points (bytes): Вершины, упакованные как float32 [x0, y0, x1, y1, ...]
+        rle (str): Маска в формате COCO RLE (JSON), если эталон задан маской
+        annotation (relationship): Связь с аннотацией изображения
+    """
+
+    __tablename__ = 'annotation_contours'
+
+    id = db.Column(Integer, primary_key=True)
+    annotation_id = db.Column(Integer, ForeignKey('image_annotations.id', ondelete='CASCADE'),
+                              nullable=False, index=True)
+    position = db.Column(Integer, nullable=False, default=0)
+    label = db.Column(String(200))
+    label_id = db.Column(Integer, ForeignKey('annotation_labels.id', ondelete='SET NULL'), index=True)
+    bbox_x = db.Column(Float)
+    bbox_y = db.Column(Float)
+    bbox_w = db.Column(Float)
+    bbox_h = db.Column(Float)
+    area = db.Column(Float)
+    vertex_count = db.Column(Integer, nullable=False)
+    points = db.Column(LargeBinary, nullable=False)
+    rle = db.Column(Text)
+
+    annotation = db.relationship('ImageAnnotation', back_populates='contours')
+    label_ref = db.relationship('AnnotationLabel')
+
+    @staticmethod
+    def pack_points(contour):
+        """
+        Упаковка вершин контура в байты float32
+
+        Args:
+            contour (list | np.ndarray): Контур [[x, y], ...]
+
+        Returns:
+            bytes: Упакованные вершины (little-endian float32)
+        """
+        return np.ascontiguousarray(contour, dtype='<f4').reshape(-1, 2).tobytes()
+
+    @staticmethod
+    def unpack_points(blob):
+        """
+        Распаковка вершин контура из байтов float32
+
+        Args:
+            blob (bytes): Упакованные вершины
+
+        Returns:
+            np.ndarray: Read-only массив формы (N, 2), dtype float32
+        """
+        return np.frombuffer(blob, dtype='<f4').reshape(-1, 2)
+
+    @property
+    def bbox(self):
+        """Ограничивающий прямоугольник в формате COCO [x, y, w, h] или None"""
+        if self.bbox_x is None:
+            return None
+        return [self.bbox_x, self.bbox_y, self.bbox_w, self.bbox_h]
+
+    def __repr__(self):
+        return f'<AnnotationContour annotation_id={self.annotation_id} #{self.position} {self.label}>'
+
+class AnnotationLabel(db.Model):
+    """
+    Модель метки (категории COCO) в нормализованной таблице меток
+
+    Attributes:
+        id (int): Уникальный идентификатор метки
+        name (str): Название метки в том виде, в каком оно впервые встретилось
+        key (str): Ключ поиска — название без лишних пробелов в нижнем регистре
+    """
+
+    __tablename__ = 'annotation_labels'
+
+    id = db.Column(Integer, primary_key=True)
+    name = db.Column(String(200), nullable=False)
+    key = db.Column(String(200), nullable=False, unique=True)
+
+    @staticmethod
+    def normalize(name):
+        """Ключ метки: пробелы схлопываются, регистр не учитывается"""
+        return ' '.join(str(name).split()).casefold()
+
+    def __repr__(self):
+        return f'<AnnotationLabel {self.id} {self.name}>'
+
+class AnnotationLabelStat(db.Model):
+    """
+    Модель статистики метки на изображении (запись инвертированного индекса
+    метка → аннотации)
+
+    Attributes:
+        label_id (int): ID метки
+        annotation_id (int): ID аннотации изображения
+        contour_count (int): Количество контуров метки
+        area_total (float): Суммарная площадь контуров
+        area_min (float): Минимальная площадь контура
+        area_max (float): Максимальная площадь контура
+    """
+
+    __tablename__ = 'annotation_label_stats'
+
+    label_id = db.Column(Integer, ForeignKey('annotation_labels.id', ondelete='CASCADE'), primary_key=True)
+    annotation_id = db.Column(Integer, ForeignKey('image_annotations.id', ondelete='CASCADE'),
+                              primary_key=True, index=True)
+    contour_count = db.Column(Integer, nullable=False, default=0)
+    area_total = db.Column(Float, nullable=False, default=0.0)
+    area_min = db.Column(Float)
+    area_max = db.Column(Float)
+
+    label = db.relationship('AnnotationLabel')
+    annotation = db.relationship('ImageAnnotation', back_populates='label_stats')
+
+    def __repr__(self):
+        return f'<AnnotationLabelStat label_id={self.label_id} annotation_id={self.annotation_id}>'
+
+class ImagePerceptualHash(db.Model):
+    """
+    Модель перцептивного хеша изображения аннотации
+
+    Attributes:
+        id (int): Уникальный идентификатор записи
+        annotation_id (int): ID аннотации изображения
+        phash (int): 64-битный DCT-хеш (хранится как знаковое целое)
+        annotation (relationship): Связь с аннотацией изображения
+    """
+
+    __tablename__ = 'image_perceptual_hashes'
+
+    id = db.Column(Integer, primary_key=True)
+    annotation_id = db.Column(Integer, ForeignKey('image_annotations.id', ondelete='CASCADE'),
+                              nullable=False, unique=True)
+    phash = db.Column(BigInteger, nullable=False)
+
+    annotation = db.relationship('ImageAnnotation', back_populates='perceptual_hash')
+
+    @staticmethod
+    def to_signed(value):
+        """Беззнаковый 64-битный хеш → знаковое целое для хранения в БД"""
+        return value - (1 << 64) if value >= (1 << 63) else value
+
+    @staticmethod
+    def to_unsigned(value):
+        """Знаковое целое из БД → беззнаковый 64-битный хеш"""
+        return value + (1 << 64) if value < 0 else value
+
+    def __repr__(self):
+        return f'<ImagePerceptualHash annotation_id={self.annotation_id} {self.to_unsigned(self.phash):016x}>'
+
 class TestResult(db.Model):
     """
     Модель результата теста
@@ -0,0 +1,98 @@
+# app/models/background_job.py
+"""
+Модель фоновой задачи приложения медицинского тестирования
+Содержит состояние задач, выполняемых пулом фоновых воркеров
+(приём загрузок, импорт, обслуживание хранилища)
+"""
+from app import db
+from datetime import datetime
+from sqlalchemy import Integer, String, Text, DateTime, ForeignKey
+import json
+
+
+class BackgroundJob(db.Model):
+    """
+    Модель фоновой задачи
+
+    Attributes:
+        id (int): Уникальный идентификатор задачи
+        kind (str): Тип задачи ('ingest', ...)
+        status (str): Состояние ('pending', 'running', 'done', 'failed')
+        stage (str): Текущий этап выполнения
+        processed (int): Количество обработанных элементов
+        total (int): Общее количество элементов (если известно)
+        message (str): Последнее сообщение или текст ошибки
+        params_json (str): JSON параметров задачи
+        result_json (str): JSON результата задачи
+        creator_id (int): ID пользователя, создавшего задачу
+        created_at (datetime): Дата создания
+        updated_at (datetime): Дата последнего обновления
+        finished_at (datetime): Дата завершения
+    """
+    __tablename__ = 'background_jobs'
+
+    id = db.Column(Integer, primary_key=True)
+    kind = db.Column(String(50), nullable=False, index=True)
+    status = db.Column(String(20), nullable=False, default='pending', index=True)
+    stage = db.Column(String(50))
+    processed = db.Column(Integer, default=0)
+    total = db.Column(Integer)
+    message = db.Column(Text)
+    params_json = db.Column(Text, default='{}')
+    result_json = db.Column(Text)
+    creator_id = db.Column(Integer, ForeignKey('users.id', ondelete='SET NULL'))
+    created_at = db.Column(DateTime, default=datetime.utcnow)
+    updated_at = db.Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(DateTime)
+
+    @property
+    def params(self):
+        """Параметры задачи (dict)"""
+        try:
+            return json.loads(self.params_json or '{}')
+        except (json.JSONDecodeError, TypeError):
+            return {}
+
+    @params.setter
+    def params(self, value):
+        self.params_json = json.dumps(value or {}, ensure_ascii=False)
+
+    @property
+    def result(self):
+        """Результат задачи (dict) или None"""
+        try:
+            return json.loads(self.result_json) if self.result_json else None
+        except (json.JSONDecodeError, TypeError):
+            return None
+
+    @result.setter
+    def result(self, value):
+        self.result_json = json.dumps(value, ensure_ascii=False) if value is not None else None
+
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self):
+        """
+        Представление задачи для JSON-ответа эндпоинта статуса
+
+        Returns:
+            dict: Состояние, этап, прогресс и результат задачи
+        """
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'stage': self.stage,
+            'processed': self.processed or 0,
+            'total': self.total,
+            'message': self.message,
+            'result': self.result,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+    def __repr__(self):
+        return f'<BackgroundJob {self.id} {self.kind} {self.status}>'
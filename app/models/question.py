@@ -6,7 +6,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from app import db
 from datetime import datetime
-from sqlalchemy import String, Integer, Text, DateTime, ForeignKey
+from sqlalchemy import String, Integer, Text, DateTime, ForeignKey, UniqueConstraint
 
 class Question(db.Model):
     """
@@ -61,4 +61,52 @@ class Question(db.Model):
         Returns:
             bool: True если вопрос имеет изображение и аннотацию, иначе False
         """
-        return self.question_type == 'graphic' and self.image_annotation_id is not None
\ No newline at end of file
+        return self.question_type == 'graphic' and self.image_annotation_id is not None
+
+
+class QuestionCount(db.Model):
+    """
+    Материализованный счётчик вопросов по паре (тема, тип) и создателю
+    Обновляется в той же транзакции, что и изменение вопросов (app.utils.question_stats)
+
+    Attributes:
+        id (int): Уникальный идентификатор строки
+        topic_id (int): ID темы
+        question_type (str): Тип вопроса ('open', 'graphic')
+        creator_id (int): ID создателя вопросов (None — создатель удалён)
+        count (int): Количество вопросов
+        version (int): Номер последнего изменения (общая возрастающая последовательность)
+    """
+
+    __tablename__ = 'question_counts'
+    __table_args__ = (UniqueConstraint('topic_id', 'question_type', 'creator_id', name='uq_question_counts_key'),)
+
+    id = db.Column(Integer, primary_key=True)
+    topic_id = db.Column(Integer, nullable=False)
+    question_type = db.Column(String(20), nullable=False)
+    creator_id = db.Column(Integer, index=True)
+    count = db.Column(Integer, nullable=False, default=0)
+    version = db.Column(Integer, nullable=False, default=0, index=True)
+
+    def __repr__(self):
+        return f'<QuestionCount {self.topic_id},{self.question_type} creator={self.creator_id}: {self.count}>'
+
+
+class QuestionCountVersion(db.Model):
+    """
+    Счётчик последовательности изменений question_counts (единственная строка)
+    Увеличивается одним UPDATE в транзакции изменения счётчиков: блокировка
+    строки упорядочивает транзакции, и номера не повторяются
+
+    Attributes:
+        id (int): Идентификатор строки (всегда 1)
+        version (int): Последний выданный номер изменения
+    """
+
+    __tablename__ = 'question_count_version'
+
+    id = db.Column(Integer, primary_key=True)
+    version = db.Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<QuestionCountVersion {self.version}>'
@@ -5,7 +5,7 @@
 """
 from app import db
 from datetime import datetime
-from sqlalchemy import Integer, String, Text, DateTime, ForeignKey, JSON
+from sqlalchemy import Integer, String, Text, DateTime, ForeignKey, Index, JSON
 from sqlalchemy.orm import relationship
 import json
 
@@ -51,6 +51,7 @@ class Variant(db.Model):
         question_id_list (str): JSON-список ID вопросов, соответствующий структуре теста
         created_at (datetime): Дата создания
         test (relationship): Связь с тестом
+        items (relationship): Вопросы варианта по позициям (VariantQuestion)
     """
     __tablename__ = 'variants'
 
@@ -64,5 +65,29 @@ class Variant(db.Model):
     question_id_list = db.Column(Text, default='[]')
     created_at = db.Column(DateTime, default=datetime.utcnow)
 
-    # Связь
-    test = relationship('Test', back_populates='variants')
\ No newline at end of file
+    # Связи
+    test = relationship('Test', back_populates='variants')
+    items = relationship('VariantQuestion', back_populates='variant', order_by='VariantQuestion.position',
+                         cascade='all, delete-orphan', passive_deletes=True)
+
+
+class VariantQuestion(db.Model):
+    """
+    Вопрос варианта на заданной позиции (нормализованная копия question_id_list)
+
+    Attributes:
+        variant_id (int): ID варианта (внешний ключ с ON DELETE CASCADE)
+        position (int): Позиция вопроса в варианте (с нуля, соответствует структуре теста)
+        question_id (int): ID вопроса
+        variant (relationship): Связь с вариантом
+        question (relationship): Связь с вопросом
+    """
+    __tablename__ = 'variant_questions'
+    __table_args__ = (Index('ix_variant_questions_question', 'question_id', 'variant_id'),)
+
+    variant_id = db.Column(Integer, ForeignKey('variants.id', ondelete='CASCADE'), primary_key=True)
+    position = db.Column(Integer, primary_key=True)
+    question_id = db.Column(Integer, ForeignKey('questions.id'), nullable=False)
+
+    variant = relationship('Variant', back_populates='items')
+    question = relationship('Question')
\ No newline at end of file
@@ -0,0 +1,62 @@
+# app/models/upload_session.py
+"""
+Модель сессии поблочной (возобновляемой) загрузки файла
+Хранит ожидаемый размер, число принятых байтов и итоговое имя файла
+"""
+from app import db
+from datetime import datetime
+from sqlalchemy import Integer, BigInteger, String, DateTime, ForeignKey
+
+
+class UploadSession(db.Model):
+    """
+    Модель сессии поблочной загрузки
+
+    Attributes:
+        id (str): Токен сессии (используется в URL)
+        user_id (int): ID пользователя, открывшего сессию
+        kind (str): Тип файла ('image', 'annotation', 'archive')
+        filename (str): Исходное имя файла (после secure_filename)
+        total_size (int): Ожидаемый размер файла в байтах
+        chunk_size (int): Максимальный размер блока
+        received_size (int): Число принятых байтов (смещение следующего блока)
+        sha256 (str): Ожидаемый SHA-256 всего файла (необязательно)
+        status (str): Состояние ('open', 'complete')
+        stored_file (str): Имя собранного файла в папке загрузок
+        created_at (datetime): Дата создания
+        updated_at (datetime): Дата приёма последнего блока
+    """
+    __tablename__ = 'upload_sessions'
+
+    id = db.Column(String(32), primary_key=True)
+    user_id = db.Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    kind = db.Column(String(20), nullable=False)
+    filename = db.Column(String(255), nullable=False)
+    total_size = db.Column(BigInteger, nullable=False)
+    chunk_size = db.Column(Integer, nullable=False)
+    received_size = db.Column(BigInteger, nullable=False, default=0)
+    sha256 = db.Column(String(64))
+    status = db.Column(String(20), nullable=False, default='open')
+    stored_file = db.Column(String(255))
+    created_at = db.Column(DateTime, default=datetime.utcnow)
+    updated_at = db.Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    def to_dict(self):
+        """
+        Представление сессии для JSON-ответов протокола загрузки
+
+        Returns:
+            dict: Токен, смещение следующего блока, размеры и состояние
+        """
+        return {
+            'upload_id': self.id,
+            'kind': self.kind,
+            'filename': self.filename,
+            'size': self.total_size,
+            'chunk_size': self.chunk_size,
+            'offset': self.received_size or 0,
+            'status': self.status
+        }
+
+    def __repr__(self):
+        return f'<UploadSession {self.id} {self.kind} {self.received_size}/{self.total_size}>'
@@ -11,9 +11,10 @@ from app.models.annotation import ImageAnnotation
 from werkzeug.utils import secure_filename
 import os
 import json
-import cv2
-import numpy as np
-from app.utils.image_processing import process_coco_annotations  # убедитесь, что process_yolo_annotations тоже есть
+from app.utils.annotation_cache import annotation_cache
+from app.utils.ingest_pipeline import start_ingest, stage_chunked_upload, enqueue_ingest, IngestError
+from app.utils.upload_gc import start_upload_gc
+from app.utils.question_stats import rebuild_question_counts
 from flask_babel import _
 from sqlalchemy import asc, desc
 
@@ -42,10 +43,23 @@ def index():
 @bp.route('/upload_image', methods=['POST'])
 @login_required
 def upload_image():
-    """Загрузка изображения и аннотации (для админа и преподавателя)"""
+    """
+    Загрузка изображения и аннотации (для админа и преподавателя)
+    Вместо файлов можно передать image_upload_id и annotation_upload_id
+    завершённых поблочных загрузок (main.create_upload)
+    """
     if current_user.role not in ['admin', 'teacher']:
         return jsonify({'error': _('Доступ запрещён')}), 403
 
+    if request.form.get('image_upload_id'):
+        try:
+            job = enqueue_ingest(stage_chunked_upload(request.form.get('image_upload_id'),
+                                                      request.form.get('annotation_upload_id'), current_user.id),
+                                 creator_id=current_user.id)
+        except IngestError as e:
+            return jsonify({'error': str(e)}), 400
+        return _ingest_accepted(job)
+
     if 'image' not in request.files or 'annotation' not in request.files:
         return jsonify({'error': _('Требуются оба файла: изображение и аннотация')}), 400
 
@@ -63,86 +77,65 @@ def upload_image():
        not allowed_file(annotation_file.filename, allowed_ann_ext):
         return jsonify({'error': _('Неверный формат файла')}), 400
 
-    try:
-        upload_folder = current_app.config.get('UPLOAD_FOLDER')
-        if not upload_folder:
-            current_app.logger.error("UPLOAD_FOLDER not configured")
-            return jsonify({'error': _('Серверная ошибка: папка загрузки не настроена')}), 500
-
-        # Безопасные имена
-        image_filename = secure_filename(image_file.filename)
-        annotation_filename = secure_filename(annotation_file.filename)
-
-        image_path = os.path.join(upload_folder, 'images', image_filename)
-        annotation_path = os.path.join(upload_folder, 'annotations', annotation_filename)
-
-        os.makedirs(os.path.dirname(image_path), exist_ok=True)
-        os.makedirs(os.path.dirname(annotation_path), exist_ok=True)
-
-        # Сохранение
-        image_file.save(image_path)
-        annotation_file.save(annotation_path)
-
-        # Определение формата
-        format_type = 'coco' if annotation_filename.endswith('.json') else 'yolo'
-
-        # Обработка аннотаций
-        if format_type == 'coco':
-            processed_data = process_coco_annotations(annotation_path)
-        else:
-            # Для YOLO — нужно изображение для получения размеров
-            img = cv2.imread(image_path)
-            if img is None:
-                # Удаляем временные файлы
-                for p in [image_path, annotation_path]:
-                    if os.path.exists(p):
-                        os.remove(p)
-                return jsonify({'error': _('Не удалось загрузить изображение для обработки YOLO')}), 500
-
-            # Предполагается, что у вас есть process_yolo_annotations
-            try:
-                from app.utils.image_processing import process_yolo_annotations
-                processed_data = process_yolo_annotations(annotation_path, img.shape)
-            except ImportError:
-                current_app.logger.warning("process_yolo_annotations not implemented")
-                processed_data = {'labels': []}
-
-        if processed_data is None:
-            # Очистка при ошибке
-            for p in [image_path, annotation_path]:
-                if os.path.exists(p):
-                    os.remove(p)
-            return jsonify({'error': _('Не удалось обработать файл аннотации')}), 500
-
-        # Создание записи в БД
-        new_annotation = ImageAnnotation(
-            image_file=image_filename,          # ← исправлено: у вас в модели, скорее всего, `image_file`, а не `filename`
-            annotation_file=annotation_filename,
-            format_type=format_type,
-            labels=json.dumps(processed_data.get('labels', []))
-        )
-
-        db.session.add(new_annotation)
-        db.session.commit()
-
-        return jsonify({
-            'success': True,
-            'message': _('Файлы успешно загружены'),
-            'id': new_annotation.id
-        })
+    if not current_app.config.get('UPLOAD_FOLDER'):
+        current_app.logger.error("UPLOAD_FOLDER not configured")
+        return jsonify({'error': _('Серверная ошибка: папка загрузки не настроена')}), 500
 
+    # Файлы сохраняются в запросе, разбор и индексация — в фоновой задаче
+    try:
+        job = start_ingest(image_file, annotation_file, creator_id=current_user.id)
+    except IngestError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         current_app.logger.exception("Error in upload_image")
-        # Пытаемся удалить временные файлы при ошибке
-        try:
-            for p in [image_path, annotation_path]:
-                if os.path.exists(p):
-                    os.remove(p)
-        except Exception:
-            pass
         return jsonify({'error': str(e)}), 500
 
+    return _ingest_accepted(job)
+
+
+def _ingest_accepted(job):
+    """Ответ 202 со ссылкой на статус задачи приёма"""
+    return jsonify({
+        'success': True,
+        'message': _('Файлы загружены и поставлены в обработку'),
+        'job_id': job.id,
+        'status_url': url_for('main.job_status', job_id=job.id)
+    }), 202
+
+
+@bp.route('/annotation_cache_stats')
+@login_required
+def annotation_cache_stats():
+    """Статистика кэша разобранных аннотаций текущего процесса — только для админа"""
+    if current_user.role != 'admin':
+        return jsonify({'error': _('Доступ запрещён')}), 403
+
+    return jsonify(annotation_cache.stats())
+
+
+@bp.route('/upload_gc', methods=['POST'])
+@login_required
+def upload_gc():
+    """
+    Запуск сборки мусора в хранилище загрузок — только для админа
+    Тело JSON: {dry_run: true (по умолчанию — только отчёт), grace_hours?}
+    """
+    if current_user.role != 'admin':
+        return jsonify({'error': _('Доступ запрещён')}), 403
+
+    data = request.get_json(silent=True) or {}
+    grace_hours = data.get('grace_hours')
+    if grace_hours is not None and (not isinstance(grace_hours, (int, float)) or grace_hours < 0):
+        return jsonify({'error': _('Некорректный период отсрочки')}), 400
+    job = start_upload_gc(dry_run=data.get('dry_run', True) is not False, grace_hours=grace_hours,
+                          creator_id=current_user.id)
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': url_for('main.job_status', job_id=job.id)
+    }), 202
+
 
 @bp.route('/teachers')
 @login_required
@@ -367,6 +360,7 @@ def delete_topic(topic_id):
 
     try:
         db.session.delete(topic)
+        rebuild_question_counts()  # Вопросы темы остаются без темы
         db.session.commit()
         flash(_('Тема удалена успешно'))
     except Exception as e:
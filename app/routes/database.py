@@ -11,6 +11,12 @@ from app.models.user import User
 from app.models.test_topics import TestTopic
 from app.models.question import Question
 from app.models.annotation import ImageAnnotation, TestResult
+from app.utils.reference_geometry import unpublish_reference_geometry
+from app.utils.upload_gc import enqueue_file_release
+from app.utils.variant_generation import question_impact
+from app.utils.eager_loading import question_list_options, result_list_options
+from app.utils.question_stats import (adjust_question_counts, record_question_change, question_count_key,
+                                      rebuild_question_counts)
 from sqlalchemy import asc, desc
 from urllib.parse import urlparse, urljoin
 from flask_babel import _ # Импортируем _ для перевода flash-сообщений
@@ -87,7 +93,8 @@ def questions():
         'date': Question.created_at,
     }
 
-    query = Question.query.join(TestTopic, Question.topic_id == TestTopic.id)
+    query = Question.query.join(TestTopic, Question.topic_id == TestTopic.id) \
+        .options(*question_list_options(topic_joined=True))
     query = _apply_sorting(query, Question, sort_by, sort_fields, order, Question.created_at)
 
     if per_page is None:
@@ -175,7 +182,7 @@ def results():
         flash(_('Доступ запрещён'))
         return redirect(url_for('main.index'))
 
-    results_list = TestResult.query.all()
+    results_list = TestResult.query.options(*result_list_options()).all()
     return render_template('database/results.html', results=results_list)
 
 
@@ -198,25 +205,31 @@ def delete_record(table, id):
             record = TestTopic.query.get_or_404(id)
         elif table == 'annotations':
             record = ImageAnnotation.query.get_or_404(id)
-            # Удаляем связанные файлы
-            upload_folder = current_app.config.get('UPLOAD_FOLDER')
-            if upload_folder:
-                img_path = os.path.join(upload_folder, 'images', record.image_file)
-                ann_path = os.path.join(upload_folder, 'annotations', record.annotation_file)
-                for path in [img_path, ann_path]:
-                    if os.path.isfile(path):
-                        try:
-                            os.remove(path)
-                        except OSError as e:
-                            current_app.logger.warning(f"Failed to delete file {path}: {e}")
+            released_files = (record.image_file, record.annotation_file)
         elif table == 'results':
             record = TestResult.query.get_or_404(id)
         else:
             flash(_('Недопустимая таблица: %(table)s', table=table))
             return redirect(url_for('database.index'))
 
+        if table == 'questions':
+            variant_count, test_count = question_impact(record.id)
+            if variant_count:
+                flash(_('Вопрос используется в %(variants)d вариантах (тестов: %(tests)d) — '
+                        'сначала удалите эти варианты', variants=variant_count, tests=test_count))
+                return redirect(request.args.get('next') if is_safe_url(request.args.get('next'))
+                                else url_for('database.index'))
+            adjust_question_counts({question_count_key(record): -1})
         db.session.delete(record)
+        if table in ('users', 'topics'):
+            # Вопросы остаются без темы или создателя — счётчики пересчитываются
+            rebuild_question_counts()
         db.session.commit()
+        if table == 'annotations':
+            unpublish_reference_geometry(id)
+            # Связанные файлы удаляются фоновой задачей; изображение — только если
+            # на него не ссылаются другие аннотации
+            enqueue_file_release([released_files], creator_id=current_user.id)
         flash(_('Запись из таблицы "%(table)s" удалена', table=table))
 
     except Exception as e:
@@ -269,10 +282,12 @@ def edit_record(table, id):
                 record.group_number = request.form.get('group_number', '').strip()
 
             elif table == 'questions':
+                old_count_key = question_count_key(record)
                 record.topic_id = int(request.form['topic_id'])
                 record.question_type = request.form['question_type']
                 record.question_text = request.form['question_text'].strip()
                 record.correct_answer = request.form.get('correct_answer', '').strip()
+                record_question_change(old_count_key, record)
 
             elif table == 'topics':
                 name = request.form['name'].strip()
@@ -2,11 +2,19 @@
 Основные маршруты приложения медицинского тестирования
 Содержит главную страницу и общие маршруты
 """
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_from_directory, abort, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_from_directory, abort, current_app, jsonify
 from flask_login import login_required, current_user
 from app.models.user import User
+from app.models.background_job import BackgroundJob
 from flask_babel import _, get_locale
 from app import db
+from app.utils.image_derivatives import ensure_image_derivative, derivative_key
+from app.utils.image_tiles import ensure_image_tiles, tile_key
+from app.utils.chunked_upload import (create_upload_session, get_upload_session, write_chunk,
+                                      complete_upload, abort_upload, ChunkedUploadError)
+from app.utils.upload_storage import is_content_addressed
+from app.utils.storage import storage, storage_key
+from werkzeug.exceptions import HTTPException
 import os
 import logging
 
@@ -118,11 +126,87 @@ def profile():
     return render_template('main/profile.html', user=current_user)
 
 
-@bp.route('/uploads/<folder>/<filename>')
+@bp.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    """
+    Статус фоновой задачи (приём загрузки и др.) в формате JSON
+    Доступен создателю задачи и администратору
+    """
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None:
+        abort(404)
+    if job.creator_id != current_user.id and current_user.role != 'admin':
+        abort(403)
+    return jsonify(job.to_dict())
+
+
+@bp.route('/upload_sessions', methods=['POST'])
+@login_required
+def create_upload():
+    """
+    Открытие сессии поблочной загрузки (для админа и преподавателя)
+    Тело JSON: {filename, size, kind: 'image'|'annotation'|'archive', sha256?}
+    """
+    if current_user.role not in ['admin', 'teacher']:
+        return jsonify({'error': _('Доступ запрещён')}), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = create_upload_session(current_user.id, data.get('filename'), data.get('size'),
+                                       data.get('kind'), data.get('sha256'))
+    except ChunkedUploadError as e:
+        return jsonify({'error': _(str(e))}), e.status
+    return jsonify(upload.to_dict()), 201
+
+
+@bp.route('/upload_sessions/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+@login_required
+def upload_session(upload_id):
+    """
+    Сессия поблочной загрузки
+    GET — текущее смещение (для возобновления), DELETE — отмена,
+    PUT ?offset=N — блок в теле запроса, SHA-256 блока в заголовке X-Chunk-SHA256
+    """
+    upload = get_upload_session(upload_id, current_user.id)
+    if upload is None:
+        return jsonify({'error': _('Сессия загрузки не найдена')}), 404
+
+    if request.method == 'DELETE':
+        abort_upload(upload)
+        return '', 204
+    if request.method == 'PUT':
+        offset = request.args.get('offset', type=int)
+        try:
+            write_chunk(upload, offset, request.stream, request.content_length,
+                        request.headers.get('X-Chunk-SHA256'))
+        except ChunkedUploadError as e:
+            return jsonify(dict(upload.to_dict(), error=_(str(e)))), e.status
+    return jsonify(upload.to_dict())
+
+
+@bp.route('/upload_sessions/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload_session(upload_id):
+    """Сборка файла после приёма всех блоков"""
+    upload = get_upload_session(upload_id, current_user.id)
+    if upload is None:
+        return jsonify({'error': _('Сессия загрузки не найдена')}), 404
+    try:
+        complete_upload(upload)
+    except ChunkedUploadError as e:
+        return jsonify(dict(upload.to_dict(), error=_(str(e)))), e.status
+    return jsonify(upload.to_dict())
+
+
+@bp.route('/uploads/<folder>/<path:filename>')
 @login_required
 def uploaded_file(folder, filename):
     """
     Маршрут для обслуживания загруженных файлов
+    Для изображений параметр ?size=<имя> (canvas, canvas2x, thumb) отдаёт
+    уменьшенную производную вместо оригинала. Изображения, хранящиеся по хешу
+    содержимого (ab/cd/<sha256>.<ext>), неизменяемы и кэшируются браузером надолго.
+    Файлы удалённого хранилища отдаются перенаправлением на подписанную ссылку
     Внимание: если файлы должны быть приватными — добавьте проверку прав!
     """
     allowed_folders = {'images', 'annotations'}
@@ -145,20 +229,107 @@ def uploaded_file(folder, filename):
     # Защита от path traversal: убеждаемся, что target_dir внутри upload_folder
     upload_folder_abs = os.path.abspath(upload_folder)
     target_dir_abs = os.path.abspath(target_dir)
-    if not target_dir_abs.startswith(upload_folder_abs):
+    file_abs = os.path.abspath(os.path.join(target_dir_abs, filename))
+    if not target_dir_abs.startswith(upload_folder_abs) or \
+       not file_abs.startswith(target_dir_abs + os.sep):
         current_app.logger.warning(f"Path traversal attempt: {folder}/{filename}")
         abort(403)
 
+    # Производная версия изображения (создаётся при загрузке или при первом запросе)
+    size = request.args.get('size')
+    if size:
+        if folder != 'images' or size not in current_app.config.get('IMAGE_DERIVATIVES', {}):
+            abort(404)
+        if ensure_image_derivative(upload_folder, filename, size):
+            return _send_stored(derivative_key(filename, size),
+                                current_app.config.get('IMAGE_DERIVATIVE_CACHE_SECONDS'))
+        # Производную получить не удалось — отдаём оригинал
+
     # Логирование (в debug-режиме)
     if current_app.debug:
-        current_app.logger.debug(f"Serving file from: {target_dir_abs}/{filename}")
+        current_app.logger.debug(f"Serving file: {folder}/{filename}")
 
     # Отдаём файл
+    max_age = None
+    if folder == 'images' and is_content_addressed(filename):
+        max_age = current_app.config.get('IMAGE_DERIVATIVE_CACHE_SECONDS')
     try:
-        return send_from_directory(target_dir, filename)
-    except FileNotFoundError:
-        current_app.logger.warning(f"File not found: {os.path.join(target_dir_abs, filename)}")
-        abort(404)
+        return _send_stored(storage_key(folder, filename), max_age)
+    except HTTPException:
+        raise
     except Exception as e:
         current_app.logger.error(f"Error serving file {folder}/{filename}: {e}")
-        abort(500)
\ No newline at end of file
+        abort(500)
+
+
+def _send_stored(key, max_age=None):
+    """
+    Ответ с файлом из хранилища загрузок: перенаправление на прямую
+    (подписанную) ссылку удалённого хранилища или отдача локальной копии
+    """
+    url = storage.url(key)
+    if url:
+        return redirect(url)
+    path = storage.fetch(key)
+    if path is None:
+        current_app.logger.warning(f"File not found: {key}")
+        abort(404)
+    return send_from_directory(os.path.dirname(path), os.path.basename(path), max_age=max_age)
+
+def _tile_source(filename):
+    """
+    Корневая папка загрузок для тайлов изображения images/<filename>
+    с защитой от path traversal (аналогично uploaded_file)
+    """
+    upload_folder = current_app.config.get('UPLOAD_FOLDER')
+    if not upload_folder:
+        current_app.logger.error("UPLOAD_FOLDER not set in config")
+        abort(500)
+    if not os.path.isabs(upload_folder):
+        upload_folder = os.path.join(current_app.root_path, upload_folder)
+
+    images_dir = os.path.abspath(os.path.join(upload_folder, 'images'))
+    if not os.path.abspath(os.path.join(images_dir, filename)).startswith(images_dir + os.sep):
+        current_app.logger.warning(f"Path traversal attempt: tiles/{filename}")
+        abort(403)
+    return upload_folder
+
+
+def _tile_max_age(filename):
+    """Срок кэширования тайлов: надолго для неизменяемых изображений по хешу"""
+    if is_content_addressed(filename):
+        return current_app.config.get('IMAGE_TILE_CACHE_SECONDS')
+    return current_app.config.get('IMAGE_DERIVATIVE_CACHE_SECONDS')
+
+
+@bp.route('/tiles/info/<path:filename>')
+@login_required
+def image_tiles_info(filename):
+    """
+    Описание тайловой пирамиды изображения (размеры уровней, размер тайла)
+    Пирамида создаётся при загрузке или при первом запросе
+    """
+    upload_folder = _tile_source(filename)
+    info = ensure_image_tiles(upload_folder, filename)
+    if info is None:
+        abort(404)
+    response = jsonify(info)
+    response.cache_control.public = True
+    response.cache_control.max_age = _tile_max_age(filename)
+    return response
+
+
+@bp.route('/tiles/<int:level>/<int:col>/<int:row>/<path:filename>')
+@login_required
+def image_tile(level, col, row, filename):
+    """Тайл уровня level (0 — оригинал) в столбце col и строке row"""
+    upload_folder = _tile_source(filename)
+    # Наличие тайла проверяется по описанию пирамиды (локальная копия info.json),
+    # без отдельного запроса к хранилищу на каждый тайл
+    info = ensure_image_tiles(upload_folder, filename)
+    if info is None or level >= len(info['levels']):
+        abort(404)
+    tile_size = info['tile_size']
+    if col * tile_size >= info['levels'][level]['width'] or row * tile_size >= info['levels'][level]['height']:
+        abort(404)
+    return _send_stored(tile_key(filename, level, col, row, info['format']), _tile_max_age(filename))
@@ -2,20 +2,40 @@
 Маршруты преподавателя приложения медицинского тестирования
 Содержит логику управления тестами, просмотра результатов и конструктора
 """
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, jsonify
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, session, current_app, jsonify,
+                   Response, stream_with_context)
 from flask_login import login_required, current_user
 from app import db
 from app.models.test_topics import TestTopic
 from app.models.question import Question
 from app.models.annotation import ImageAnnotation, TestResult
 from app.models.test_variant import Test, Variant
+from app.models.user import User
+from app.models.background_job import BackgroundJob
 from werkzeug.utils import secure_filename
 import os
 import uuid
 import json
-import random
-from app.utils.image_processing import parse_coco_for_image
-from sqlalchemy import asc, desc, func
+from datetime import datetime
+from app.utils.upload_gc import enqueue_file_release
+from app.utils.variant_generation import (load_question_pools, load_variant_index, pool_demand, pool_shortages,
+                                          variant_capacity, generate_unique_variants, start_variant_generation,
+                                          latest_variant_generation, variant_generation_resumable,
+                                          resume_variant_generation, VariantGenerationError, build_variant,
+                                          question_usage, question_impact, pool_key)
+from app.utils.similarity_report import start_similarity_report, latest_similarity_report
+from app.utils.eager_loading import question_list_options, result_list_options, fetch_ordered, question_examples
+from app.utils.question_stats import (adjust_question_counts, record_question_change, question_count_key,
+                                      question_stats, question_stats_etag)
+from app.utils.image_hashing import compute_phash, find_duplicate_images
+from app.utils.reference_geometry import unpublish_reference_geometry
+from app.utils.label_index import label_statistics, annotations_with_label, label_contours
+from app.utils.coco_export import iter_coco_export, iter_coco_archive
+from app.utils.ingest_pipeline import stage_upload, stage_chunked_upload, enqueue_ingest, IngestError
+from app.utils.dataset_import import (start_dataset_import, resume_dataset_import,
+                                      parse_topic_mapping, DatasetImportError)
+from sqlalchemy import asc, desc
+from sqlalchemy.orm import joinedload, selectinload
 from urllib.parse import urlparse, urljoin
 from flask_babel import _
 
@@ -48,7 +68,8 @@ def is_safe_url(target):
 
 def generate_variants_batch_impl(test, count, user_role, user_id):
     """
-    Генерирует `count` вариантов для теста.
+    Генерирует `count` вариантов для теста с различными наборами вопросов
+    (без повторов внутри варианта и без совпадения с существующими вариантами).
     Возвращает: (список Variant, список ошибок)
     """
     if count < 1 or count > 50:
@@ -62,42 +83,33 @@ def generate_variants_batch_impl(test, count, user_role, user_id):
     if not structure:
         return [], [_('Структура теста пуста')]
 
-    new_variants = []
-    errors = []
-
-    for i in range(count):
-        question_id_list = []
-        for item in structure:
-            topic_id = item.get('topic_id')
-            q_type = item.get('question_type')
-
-            if not topic_id or not q_type:
-                errors.append(_('Ошибка в структуре: пустой элемент'))
-                continue
-
-            query = Question.query.filter_by(topic_id=topic_id, question_type=q_type)
-            if user_role != 'admin':
-                query = query.filter(Question.creator_id == user_id)
-
-            available = query.all()
-            if not available:
-                errors.append(
-                    _('Нет вопросов для: тема %(topic)s, тип %(type)s (вариант %(num)d)',
-                      topic=topic_id, type=q_type, num=i + 1)
-                )
-                break
-
-            chosen = random.choice(available)
-            question_id_list.append(chosen.id)
-        else:
-            new_variant = Variant(
-                test_id=test.id,
-                question_id_list=json.dumps(question_id_list, ensure_ascii=False)
-            )
-            new_variants.append(new_variant)
-            continue
-        break
+    demand = pool_demand(structure)
+    if demand is None:
+        return [], [_('Ошибка в структуре: пустой элемент')]
+
+    # Пулы вопросов загружаются один раз на всю пачку, выборка — в памяти
+    pools = load_question_pools(structure, creator_id=None if user_role == 'admin' else user_id)
 
+    errors = [
+        _('Недостаточно вопросов для: тема %(topic)s, тип %(type)s (нужно %(needed)d, доступно %(available)d)',
+          topic=key[0], type=key[1], needed=needed, available=available)
+        for key, needed, available in pool_shortages(demand, pools)
+    ]
+    if errors:
+        return [], errors
+
+    index = load_variant_index(test.id)
+    capacity = variant_capacity(demand, pools, limit=len(index) + count)
+    if capacity < len(index) + count:
+        return [], [_('Пулы вопросов допускают не более %(capacity)d различных вариантов '
+                      '(уже создано %(existing)d)', capacity=capacity, existing=len(index))]
+
+    question_lists = generate_unique_variants(structure, pools, count, index=index)
+    if len(question_lists) < count:
+        errors.append(_('Удалось подобрать только %(done)d различных вариантов из %(count)d',
+                        done=len(question_lists), count=count))
+
+    new_variants = [build_variant(test.id, question_ids) for question_ids in question_lists]
     return new_variants, errors
 
 
@@ -130,74 +142,24 @@ def create_question():
             creator_id=current_user.id
         )
 
+        ingest_params = None
         if question_type == 'graphic':
-            image_file = request.files.get('image_file')
-            annotation_file = request.files.get('annotation_file')
-
-            if not image_file or not annotation_file:
-                flash(_('Для графических вопросов требуются файлы изображения и аннотации'))
-                return render_template('teacher/create_question.html', topics=topics)
-
-            allowed_image_ext = set(current_app.config.get('ALLOWED_IMAGE_EXTENSIONS', {'png', 'jpg', 'jpeg'}))
-            allowed_ann_ext = set(current_app.config.get('ALLOWED_ANNOTATION_EXTENSIONS', {'json'}))
-
-            if not allowed_file(image_file.filename, allowed_image_ext) or \
-               not allowed_file(annotation_file.filename, allowed_ann_ext):
-                flash(_('Неверный формат файла'))
-                return render_template('teacher/create_question.html', topics=topics)
-
+            # Проверка и сохранение файлов; разбор аннотаций — в фоновой задаче
             try:
-                image_filename = secure_filename(image_file.filename)
-                annotation_filename = secure_filename(annotation_file.filename)
-
-                unique_id = str(uuid.uuid4())[:8]
-                name_part_img, ext_part_img = os.path.splitext(image_filename)
-                name_part_ann, ext_part_ann = os.path.splitext(annotation_filename)
-
-                raw_image_filename = f"{name_part_img}{ext_part_img}"
-                image_filename = f"{name_part_img}_{unique_id}{ext_part_img}"
-                annotation_filename = f"{name_part_ann}_{unique_id}{ext_part_ann}"
-
                 upload_folder = current_app.config.get('UPLOAD_FOLDER')
                 if not upload_folder:
                     raise RuntimeError("UPLOAD_FOLDER not configured")
-
-                image_path = os.path.join(upload_folder, 'images', image_filename)
-                annotation_path = os.path.join(upload_folder, 'annotations', annotation_filename)
-
-                os.makedirs(os.path.dirname(image_path), exist_ok=True)
-                os.makedirs(os.path.dirname(annotation_path), exist_ok=True)
-
-                image_file.save(image_path)
-                annotation_file.save(annotation_path)
-
-                format_type = 'coco' if annotation_filename.endswith('.json') else 'yolo'
-
-                if format_type == 'coco':
-                    success, result = parse_coco_for_image(annotation_path, raw_image_filename, unique_id)
-                    if not success:
-                        flash(result)
-                        try:
-                            os.remove(image_path)
-                        except OSError:
-                            pass
-                        return render_template('teacher/create_question.html', topics=topics)
-                    else:
-                        os.remove(annotation_path)
-                        annotation_filename = result
-
-                new_annotation = ImageAnnotation(
-                    image_file=image_filename,
-                    annotation_file=annotation_filename,
-                    format_type=format_type
-                )
-
-                db.session.add(new_annotation)
-                db.session.flush()
-                new_question.image_annotation_id = new_annotation.id
-
+                if request.form.get('image_upload_id'):
+                    # Файлы уже загружены поблочно и собраны в хранилище
+                    ingest_params = stage_chunked_upload(request.form.get('image_upload_id'),
+                                                         request.form.get('annotation_upload_id'), current_user.id)
+                else:
+                    ingest_params = stage_upload(request.files.get('image_file'),
+                                                 request.files.get('annotation_file'), upload_folder)
+            except IngestError as e:
+                flash(_(str(e)))
+                return render_template('teacher/create_question.html', topics=topics)
             except Exception as e:
-                db.session.rollback()
                 current_app.logger.exception("Error in create_question (graphic)")
                 flash(_('Ошибка при загрузке файлов: %(error)s', error=str(e)))
                 return render_template('teacher/create_question.html', topics=topics)
@@ -206,7 +168,17 @@ def create_question():
             correct_answer = request.form.get('correct_answer', '').strip()
             new_question.correct_answer = correct_answer
 
+        if ingest_params is not None:
+            # Графический вопрос создаётся задачей приёма в одной транзакции с аннотацией:
+            # при ошибке разбора вопрос без изображения не появится
+            db.session.commit()  # удаление сессий поблочной загрузки
+            enqueue_ingest(ingest_params, creator_id=current_user.id, new_question={
+                'question_text': question_text, 'topic_id': int(topic_id)})
+            flash(_('Изображение обрабатывается, вопрос появится после обработки'))
+            return redirect(url_for('teacher.view_questions'))
+
         db.session.add(new_question)
+        adjust_question_counts({question_count_key(new_question): 1})
         db.session.commit()
         flash(_('Вопрос успешно создан'))
         return redirect(url_for('teacher.view_questions'))
@@ -214,6 +186,129 @@ def create_question():
     return render_template('teacher/create_question.html', topics=topics)
 
 
+@bp.route('/teacher/check_image_duplicates', methods=['POST'])
+@login_required
+def check_image_duplicates():
+    """Поиск почти-дубликатов выбранного изображения (предупреждение до загрузки вопроса)"""
+    if current_user.role not in ['admin', 'teacher']:
+        return jsonify({'error': _('Доступ запрещён')}), 403
+
+    image_file = request.files.get('image_file')
+    if not image_file or not image_file.filename:
+        return jsonify({'error': _('Файл не выбран')}), 400
+
+    phash = compute_phash(image_file.read())
+    if phash is None:
+        return jsonify({'error': _('Не удалось прочитать изображение')}), 400
+
+    matches = find_duplicate_images(phash, exclude_ids={request.form.get('exclude_annotation_id', type=int)})
+    annotations = {a.id: a for a in ImageAnnotation.query.filter(
+        ImageAnnotation.id.in_([annotation_id for annotation_id, _d in matches])).all()} if matches else {}
+    questions = {}
+    if matches:
+        for q in Question.query.filter(Question.image_annotation_id.in_(annotations.keys())).all():
+            questions.setdefault(q.image_annotation_id, []).append({'id': q.id, 'text': q.question_text})
+
+    duplicates = []
+    for annotation_id, distance in matches:
+        annotation = annotations.get(annotation_id)
+        if annotation is None:
+            continue
+        duplicates.append({
+            'annotation_id': annotation_id,
+            'distance': distance,
+            'thumbnail': url_for('main.uploaded_file', folder='images', filename=annotation.image_file, size='thumb'),
+            'questions': questions.get(annotation_id, [])
+        })
+    return jsonify({'duplicates': duplicates})
+
+
+@bp.route('/teacher/labels')
+@login_required
+def label_index():
+    """Метки банка аннотаций со статистикой площадей (?q= — фильтр по началу названия)"""
+    if current_user.role not in ['admin', 'teacher']:
+        return jsonify({'error': _('Доступ запрещён')}), 403
+    return jsonify({'labels': label_statistics(request.args.get('q', '').strip() or None)})
+
+
+@bp.route('/teacher/labels/annotations')
+@login_required
+def label_annotations():
+    """
+    Изображения и вопросы, на которых размечена метка (?label=<название>)
+    С параметром contours=1 возвращаются также bbox и площади контуров метки
+    """
+    if current_user.role not in ['admin', 'teacher']:
+        return jsonify({'error': _('Доступ запрещён')}), 403
+    label = request.args.get('label', '').strip()
+    if not label:
+        return jsonify({'error': _('Не указана метка')}), 400
+
+    stats = annotations_with_label(label)
+    annotation_ids = [stat.annotation_id for stat in stats]
+    questions = {}
+    if annotation_ids:
+        question_query = Question.query.filter(Question.image_annotation_id.in_(annotation_ids))
+        if current_user.role != 'admin':
+            question_query = question_query.filter(Question.creator_id == current_user.id)
+        for q in question_query.all():
+            questions.setdefault(q.image_annotation_id, []).append({'id': q.id, 'text': q.question_text})
+
+    contours = {}
+    if annotation_ids and request.args.get('contours', type=int):
+        for contour in label_contours(label, annotation_ids):
+            contours.setdefault(contour.annotation_id, []).append({
+                'position': contour.position,
+                'bbox': contour.bbox,
+                'area': contour.area
+            })
+
+    annotations = []
+    for stat in stats:
+        entry = {
+            'annotation_id': stat.annotation_id,
+            'contours': stat.contour_count,
+            'area_total': stat.area_total,
+            'area_min': stat.area_min,
+            'area_max': stat.area_max,
+            'questions': questions.get(stat.annotation_id, [])
+        }
+        if stat.annotation_id in contours:
+            entry['polygons'] = contours[stat.annotation_id]
+        annotations.append(entry)
+    return jsonify({'label': label, 'annotations': annotations})
+
+
+@bp.route('/teacher/export_coco')
+@login_required
+def export_coco():
+    """
+    Экспорт банка аннотаций в формате COCO (потоковый ответ)
+    Параметры: format=json|zip (zip — вместе с изображениями), answers=1 —
+    добавить контуры студентов (все — только администратору, преподавателю —
+    ответы на его вопросы с псевдонимами студентов), topic_id — только
+    изображения вопросов темы
+    """
+    if current_user.role not in ['admin', 'teacher']:
+        flash(_('Доступ запрещён'))
+        return redirect(url_for('main.index'))
+
+    include_answers = bool(request.args.get('answers', type=int))
+    answers_creator_id = None if current_user.role == 'admin' else current_user.id
+    topic_id = request.args.get('topic_id', type=int)
+    stamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+    if request.args.get('format') == 'zip':
+        body = iter_coco_archive(include_answers, topic_id, answers_creator_id=answers_creator_id)
+        mimetype, filename = 'application/zip', f"coco_export_{stamp}.zip"
+    else:
+        body = (part.encode('utf-8') for part in
+                iter_coco_export(include_answers, topic_id, answers_creator_id=answers_creator_id))
+        mimetype, filename = 'application/json', f"coco_export_{stamp}.json"
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
 @bp.route('/teacher/edit_question/<int:question_id>', methods=['GET', 'POST'])
 @login_required
 def edit_question(question_id):
@@ -229,6 +324,8 @@ def edit_question(question_id):
         return redirect(url_for('teacher.view_questions'))
 
     if request.method == 'POST':
+        ingest_params = None
+        old_count_key = question_count_key(question)
         question.topic_id = request.form['topic_id']
         question.question_text = request.form['question_text']
         question.question_type = request.form['question_type']
@@ -240,93 +337,35 @@ def edit_question(question_id):
         elif question.question_type == 'graphic':
             new_image_file = request.files.get('image_file')
             new_annotation_file = request.files.get('annotation_file')
+            image_upload_id = request.form.get('image_upload_id')
 
-            if new_image_file and new_annotation_file:
-                allowed_image_ext = set(current_app.config.get('ALLOWED_IMAGE_EXTENSIONS', {'png', 'jpg', 'jpeg'}))
-                allowed_ann_ext = set(current_app.config.get('ALLOWED_ANNOTATION_EXTENSIONS', {'json'}))
-
-                if not allowed_file(new_image_file.filename, allowed_image_ext) or \
-                   not allowed_file(new_annotation_file.filename, allowed_ann_ext):
-                    flash(_('Неверный формат файла'))
-                    return render_template('teacher/edit_question.html', question=question, topics=topics)
-
+            if image_upload_id or (new_image_file and new_annotation_file):
+                # Старая аннотация заменяется в фоновой задаче после разбора новой
                 try:
-                    if question.image_annotation:
-                        old_annotation = question.image_annotation
-                        other_count = Question.query.filter(
-                            Question.image_annotation_id == old_annotation.id,
-                            Question.id != question_id
-                        ).count()
-
-                        if other_count == 0:
-                            upload_folder = current_app.config.get('UPLOAD_FOLDER')
-                            if upload_folder:
-                                img_path = os.path.join(upload_folder, 'images', old_annotation.image_file)
-                                ann_path = os.path.join(upload_folder, 'annotations', old_annotation.annotation_file)
-                                for p in [img_path, ann_path]:
-                                    if os.path.exists(p):
-                                        try:
-                                            os.remove(p)
-                                        except OSError as e:
-                                            current_app.logger.warning(f"Failed to remove {p}: {e}")
-                            db.session.delete(old_annotation)
-
-                    image_filename = secure_filename(new_image_file.filename)
-                    annotation_filename = secure_filename(new_annotation_file.filename)
-
-                    unique_id = str(uuid.uuid4())[:8]
-                    name_part_img, ext_part_img = os.path.splitext(image_filename)
-                    name_part_ann, ext_part_ann = os.path.splitext(annotation_filename)
-
-                    raw_image_filename = f"{name_part_img}{ext_part_img}"
-                    image_filename = f"{name_part_img}_{unique_id}{ext_part_img}"
-                    annotation_filename = f"{name_part_ann}_{unique_id}{ext_part_ann}"
-
                     upload_folder = current_app.config.get('UPLOAD_FOLDER')
                     if not upload_folder:
                         raise RuntimeError("UPLOAD_FOLDER not configured")
-
-                    image_path = os.path.join(upload_folder, 'images', image_filename)
-                    annotation_path = os.path.join(upload_folder, 'annotations', annotation_filename)
-
-                    os.makedirs(os.path.dirname(image_path), exist_ok=True)
-                    os.makedirs(os.path.dirname(annotation_path), exist_ok=True)
-
-                    new_image_file.save(image_path)
-                    new_annotation_file.save(annotation_path)
-
-                    format_type = 'coco' if annotation_filename.endswith('.json') else 'yolo'
-
-                    if format_type == 'coco':
-                        success, result = parse_coco_for_image(annotation_path, raw_image_filename, unique_id)
-                        if not success:
-                            flash(result)
-                            try:
-                                os.remove(image_path)
-                            except OSError:
-                                pass
-                            return render_template('teacher/edit_question.html', question=question, topics=topics)
-                        os.remove(annotation_path)
-                        annotation_filename = result
-
-                    new_annotation = ImageAnnotation(
-                        image_file=image_filename,
-                        annotation_file=annotation_filename,
-                        format_type=format_type
-                    )
-
-                    db.session.add(new_annotation)
-                    db.session.flush()
-                    question.image_annotation_id = new_annotation.id
-
+                    if image_upload_id:
+                        ingest_params = stage_chunked_upload(image_upload_id, request.form.get('annotation_upload_id'),
+                                                             current_user.id)
+                    else:
+                        ingest_params = stage_upload(new_image_file, new_annotation_file, upload_folder)
+                except IngestError as e:
+                    flash(_(str(e)))
+                    return render_template('teacher/edit_question.html', question=question, topics=topics)
                 except Exception as e:
                     db.session.rollback()
                     current_app.logger.exception("Error in edit_question (graphic)")
                     flash(_('Ошибка при обновлении файлов: %(error)s', error=str(e)))
                     return render_template('teacher/edit_question.html', question=question, topics=topics)
 
+        record_question_change(old_count_key, question)
         db.session.commit()
-        flash(_('Вопрос успешно обновлён'))
+        if ingest_params is not None:
+            enqueue_ingest(ingest_params, creator_id=current_user.id, question_id=question.id)
+            flash(_('Вопрос обновлён, новое изображение обрабатывается'))
+        else:
+            flash(_('Вопрос успешно обновлён'))
         return redirect(url_for('teacher.view_questions'))
 
     return render_template('teacher/edit_question.html', question=question, topics=topics)
@@ -345,6 +384,15 @@ def delete_question(question_id):
         flash(_('Доступ запрещён'))
         return redirect(url_for('teacher.view_questions'))
 
+    variant_count, test_count = question_impact(question.id)
+    if variant_count:
+        flash(_('Вопрос используется в %(variants)d вариантах (тестов: %(tests)d) — сначала удалите эти варианты',
+                variants=variant_count, tests=test_count))
+        next_url = request.args.get('next')
+        if next_url and is_safe_url(next_url):
+            return redirect(next_url)
+        return redirect(url_for('teacher.view_questions'))
+
     try:
         annotation = question.image_annotation
         annotation_deleted = False
@@ -356,21 +404,18 @@ def delete_question(question_id):
             ).count()
 
             if other_count == 0:
-                upload_folder = current_app.config.get('UPLOAD_FOLDER')
-                if upload_folder:
-                    img_path = os.path.join(upload_folder, 'images', annotation.image_file)
-                    ann_path = os.path.join(upload_folder, 'annotations', annotation.annotation_file)
-                    for p in [img_path, ann_path]:
-                        if os.path.exists(p):
-                            try:
-                                os.remove(p)
-                            except OSError as e:
-                                current_app.logger.warning(f"Failed to delete {p}: {e}")
+                deleted_annotation_id = annotation.id
+                deleted_files = (annotation.image_file, annotation.annotation_file)
                 db.session.delete(annotation)
                 annotation_deleted = True
 
+        adjust_question_counts({question_count_key(question): -1})
         db.session.delete(question)
         db.session.commit()
+        if annotation_deleted:
+            unpublish_reference_geometry(deleted_annotation_id)
+            # Файлы удаляются фоновой задачей (оставшиеся при сбое соберёт upload_gc)
+            enqueue_file_release([deleted_files], creator_id=current_user.id)
 
         if annotation_deleted:
             flash(_('Вопрос и связанные файлы успешно удалены'))
@@ -388,6 +433,67 @@ def delete_question(question_id):
     return redirect(url_for('teacher.view_questions'))
 
 
+@bp.route('/teacher/import_dataset', methods=['GET', 'POST'])
+@login_required
+def import_dataset():
+    """Массовый импорт графических вопросов из ZIP-архива с изображениями и COCO"""
+    if current_user.role not in ['admin', 'teacher']:
+        flash(_('Доступ запрещён'))
+        return redirect(url_for('main.index'))
+
+    topics = TestTopic.query.all()
+
+    if request.method == 'POST':
+        archive_file = request.files.get('archive')
+        # Архив, загруженный поблочно (больше MAX_CONTENT_LENGTH), уже собран в папке imports
+        upload_id = request.form.get('archive_upload_id')
+        topic_id = request.form.get('topic_id', type=int)
+        if not upload_id and (not archive_file or not archive_file.filename or
+                              not allowed_file(archive_file.filename, {'zip'})):
+            flash(_('Выберите ZIP-архив с изображениями и файлом COCO'))
+            return redirect(url_for('teacher.import_dataset'))
+        if not topic_id or db.session.get(TestTopic, topic_id) is None:
+            flash(_('Выберите тему по умолчанию'))
+            return redirect(url_for('teacher.import_dataset'))
+
+        try:
+            mapping = parse_topic_mapping(request.form.get('topic_mapping', ''))
+            job = start_dataset_import(archive_file, topic_id, current_user.id,
+                                       topic_mapping=mapping,
+                                       question_template=request.form.get('question_template', '').strip() or None,
+                                       upload_id=upload_id)
+        except DatasetImportError as e:
+            flash(str(e))
+            return redirect(url_for('teacher.import_dataset'))
+
+        flash(_('Импорт запущен'))
+        return redirect(url_for('teacher.import_dataset', job_id=job.id))
+
+    jobs = BackgroundJob.query.filter_by(kind='dataset_import', creator_id=current_user.id) \
+        .order_by(BackgroundJob.created_at.desc()).limit(10).all()
+    return render_template('teacher/import_dataset.html',
+                           topics=topics,
+                           jobs=jobs,
+                           active_job_id=request.args.get('job_id', type=int),
+                           default_template=current_app.config.get('DATASET_IMPORT_QUESTION_TEMPLATE'))
+
+
+@bp.route('/teacher/import_dataset/<int:job_id>/resume', methods=['POST'])
+@login_required
+def resume_import_dataset(job_id):
+    """Продолжение прерванного импорта с последнего зафиксированного пакета"""
+    job = BackgroundJob.query.get_or_404(job_id)
+    if job.creator_id != current_user.id and current_user.role != 'admin':
+        flash(_('Доступ запрещён'))
+        return redirect(url_for('main.index'))
+
+    if resume_dataset_import(job):
+        flash(_('Импорт возобновлён'))
+    else:
+        flash(_('Этот импорт нельзя возобновить'))
+    return redirect(url_for('teacher.import_dataset', job_id=job.id))
+
+
 @bp.route('/teacher/view_questions')
 @login_required
 def view_questions():
@@ -417,7 +523,8 @@ def view_questions():
     sort_field = sort_fields.get(sort_by, Question.created_at)
     sort_expr = asc(sort_field) if order == 'asc' else desc(sort_field)
 
-    base_query = Question.query.join(TestTopic, Question.topic_id == TestTopic.id).order_by(sort_expr)
+    base_query = Question.query.join(TestTopic, Question.topic_id == TestTopic.id) \
+        .options(*question_list_options(topic_joined=True)).order_by(sort_expr)
     if current_user.role != 'admin':
         base_query = base_query.filter(Question.creator_id == current_user.id)
 
@@ -432,6 +539,7 @@ def view_questions():
 
     return render_template('teacher/view_questions.html',
                           questions=questions,
+                          usage_counts=question_usage([q.id for q in questions]),
                           topic_map=topic_map,
                           pagination=pagination,
                           current_per_page=per_page_raw)
@@ -445,13 +553,44 @@ def view_results():
         return redirect(url_for('main.index'))
 
     if current_user.role == 'admin':
-        results = TestResult.query.all()
+        results = TestResult.query.options(*result_list_options()).all()
     else:
         results = []
 
     return render_template('teacher/view_results.html', results=results)
 
 
+@bp.route('/teacher/similarity_report', methods=['GET', 'POST'])
+@login_required
+def similarity_report():
+    if current_user.role not in ['admin', 'teacher']:
+        flash(_('Доступ запрещён'))
+        return redirect(url_for('main.index'))
+
+    if request.method == 'POST':
+        # Поиск пар идёт в фоновой задаче; страница показывает её ход и сохранённый отчёт
+        threshold = request.form.get('threshold', current_app.config.get('SIMILARITY_THRESHOLD', 0.9), type=float)
+        start_similarity_report(min(max(threshold, 0.0), 1.0), current_user.id,
+                                scope_creator_id=None if current_user.role == 'admin' else current_user.id)
+        return redirect(url_for('teacher.similarity_report'))
+
+    job = latest_similarity_report(current_user.id)
+    threshold = job.params.get('threshold') if job is not None else \
+        current_app.config.get('SIMILARITY_THRESHOLD', 0.9)
+    result = (job.result if job is not None and job.status == 'done' else None) or {}
+    report = result.get('pairs', [])
+
+    user_ids = {row['user_id_1'] for row in report} | {row['user_id_2'] for row in report}
+    users = {u.id: u for u in User.query.filter(User.id.in_(user_ids)).all()} if user_ids else {}
+
+    return render_template('teacher/similarity_report.html',
+                           job=job,
+                           report=report,
+                           total_pairs=result.get('total', 0),
+                           users=users,
+                           threshold=threshold)
+
+
 # ==================== КОНСТРУКТОР ТЕСТОВ ====================
 
 @bp.route('/teacher/test_constructor', methods=['GET', 'POST'])
@@ -593,7 +732,8 @@ def view_test(test_id):
         flash(_('Доступ запрещён'))
         return redirect(url_for('teacher.test_constructor'))
 
-    test = Test.query.get_or_404(test_id)
+    test = Test.query.options(joinedload(Test.creator), selectinload(Test.variants)) \
+        .filter_by(id=test_id).first_or_404()
 
     if test.creator_id != current_user.id and current_user.role != 'admin':
         flash(_('Доступ запрещён'))
@@ -607,14 +747,14 @@ def view_test(test_id):
     except (ValueError, TypeError):
         structure = []
 
+    # Примеры вопросов для всех элементов структуры — одним запросом
+    examples_by_key = question_examples(key for key in map(pool_key, structure) if key is not None)
+
     questions_by_item = []
     for idx, item in enumerate(structure):
         topic_id = item.get('topic_id')
         q_type = item.get('question_type')
-        examples = Question.query.filter_by(
-            topic_id=topic_id,
-            question_type=q_type
-        ).limit(3).all()
+        examples = examples_by_key.get(pool_key(item), [])
         questions_by_item.append({
             'index': idx + 1,
             'topic_id': topic_id,
@@ -624,34 +764,25 @@ def view_test(test_id):
             'examples': examples
         })
 
-    stats_rows = db.session.query(
-        Question.topic_id,
-        Question.question_type,
-        func.count(Question.id).label('count')
-    ).filter(Question.topic_id.isnot(None))
-
-    if current_user.role != 'admin':
-        stats_rows = stats_rows.filter(Question.creator_id == current_user.id)
-
-    stats_rows = stats_rows.group_by(Question.topic_id, Question.question_type).all()
-
-    stats = {}
-    for tid, qtype, cnt in stats_rows:
-        stats[f"{tid},{qtype}"] = cnt
-
-    all_topics = [t.id for t in topics]
-    all_types = ['open', 'graphic']
-    for tid in all_topics:
-        for qtype in all_types:
-            key = f"{tid},{qtype}"
-            if key not in stats:
-                stats[key] = 0
+    stats = question_stats(creator_id=None if current_user.role == 'admin' else current_user.id)
 
     total_open = sum(cnt for key, cnt in stats.items() if key.endswith(',open'))
     total_graphic = sum(cnt for key, cnt in stats.items() if key.endswith(',graphic'))
 
+    # Фоновая генерация вариантов: переданная в адресе или последняя незавершённая (в том числе прерванная)
+    generation_job = db.session.get(BackgroundJob, request.args.get('job_id', type=int) or 0)
+    if generation_job is None or generation_job.kind != 'variant_generation' or \
+            generation_job.params.get('test_id') != test.id:
+        generation_job = latest_variant_generation(test.id)
+        if generation_job is not None and generation_job.status == 'done':
+            generation_job = None
+
     return render_template('teacher/view_test.html',
                            test=test,
+                           generation_job=generation_job,
+                           generation_resumable=generation_job is not None and
+                           variant_generation_resumable(generation_job),
+                           max_variant_count=current_app.config.get('VARIANT_BULK_MAX_COUNT', 10000),
                            structure=structure,
                            questions_by_item=questions_by_item,
                            stats=stats,
@@ -667,29 +798,16 @@ def stats_api():
     if current_user.role not in ['admin', 'teacher']:
         return jsonify({'error': 'forbidden'}), 403
 
-    stats_rows = db.session.query(
-        Question.topic_id,
-        Question.question_type,
-        func.count(Question.id).label('count')
-    ).filter(Question.topic_id.isnot(None))
-
-    if current_user.role != 'admin':
-        stats_rows = stats_rows.filter(Question.creator_id == current_user.id)
-
-    stats_rows = stats_rows.group_by(Question.topic_id, Question.question_type).all()
-
-    stats = {}
-    for tid, qtype, cnt in stats_rows:
-        stats[f"{tid},{qtype}"] = cnt
-
-    all_topics = [t.id for t in TestTopic.query.all()]
-    all_types = ['open', 'graphic']
-    for tid in all_topics:
-        for qtype in all_types:
-            key = f"{tid},{qtype}"
-            stats[key] = stats.get(key, 0)
-
-    return jsonify(stats)
+    # Счётчики материализованы; неизменившаяся статистика — 304 по ETag
+    creator_id = None if current_user.role == 'admin' else current_user.id
+    etag = question_stats_etag(creator_id)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(question_stats(creator_id))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 @bp.route('/teacher/test_constructor/generate/<int:test_id>', methods=['POST'])
@@ -828,7 +946,9 @@ def view_variant(variant_id):
         flash(_('Доступ запрещён'))
         return redirect(url_for('teacher.test_constructor'))
 
-    variant = Variant.query.get_or_404(variant_id)
+    # Вариант с тестом, создателем и позициями — одним запросом
+    variant = Variant.query.options(joinedload(Variant.test).joinedload(Test.creator),
+                                    joinedload(Variant.items)).filter_by(id=variant_id).first_or_404()
     test = variant.test
 
     topics = TestTopic.query.all()
@@ -838,16 +958,8 @@ def view_variant(variant_id):
         flash(_('Доступ запрещён'))
         return redirect(url_for('teacher.view_test', test_id=test.id))
 
-    try:
-        question_ids = json.loads(variant.question_id_list) if variant.question_id_list else []
-    except:
-        question_ids = []
-
-    questions = []
-    for qid in question_ids:
-        q = Question.query.get(qid)
-        if q:
-            questions.append(q)
+    # Вопросы в порядке позиций — один запрос IN
+    questions = fetch_ordered(Question, [item.question_id for item in variant.items])
 
     return render_template('teacher/view_variant.html',
                            variant=variant,
@@ -875,6 +987,17 @@ def generate_variants_batch(test_id):
         flash(_('Некорректное количество'))
         return redirect(url_for('teacher.view_test', test_id=test.id))
 
+    if count > 50:
+        # Большая партия — фоновой задачей; запрос возвращается сразу
+        try:
+            job = start_variant_generation(test, count, current_user.id,
+                                           pool_creator_id=None if current_user.role == 'admin' else current_user.id)
+        except VariantGenerationError as e:
+            flash(str(e))
+            return redirect(url_for('teacher.view_test', test_id=test.id))
+        flash(_('Генерация %(count)d вариантов запущена', count=count))
+        return redirect(url_for('teacher.view_test', test_id=test.id, job_id=job.id))
+
     new_variants, errors = generate_variants_batch_impl(
         test, count,
         user_role=current_user.role,
@@ -902,6 +1025,28 @@ def generate_variants_batch(test_id):
     return redirect(url_for('teacher.view_test', test_id=test.id))
 
 
+@bp.route('/teacher/test_constructor/batch/<int:test_id>/resume/<int:job_id>', methods=['POST'])
+@login_required
+def resume_variants_batch(test_id, job_id):
+    """Продолжение прерванной фоновой генерации вариантов с последней сохранённой порции"""
+    if current_user.role not in ['admin', 'teacher']:
+        flash(_('Доступ запрещён'))
+        return redirect(url_for('teacher.test_constructor'))
+
+    test = Test.query.get_or_404(test_id)
+    job = BackgroundJob.query.get_or_404(job_id)
+    if (test.creator_id != current_user.id and current_user.role != 'admin') or \
+            job.params.get('test_id') != test.id:
+        flash(_('Доступ запрещён'))
+        return redirect(url_for('teacher.view_test', test_id=test.id))
+
+    if resume_variant_generation(job):
+        flash(_('Генерация вариантов возобновлена'))
+    else:
+        flash(_('Эту генерацию нельзя возобновить'))
+    return redirect(url_for('teacher.view_test', test_id=test.id, job_id=job.id))
+
+
 # ==================== УДАЛЕНИЕ ВАРИАНТА ====================
 @bp.route('/teacher/test_constructor/variant/delete/<int:variant_id>', methods=['POST'])
 @login_required
@@ -0,0 +1,172 @@
+// app/static/js/chunked_upload.js
+// Поблочная возобновляемая загрузка файлов (main.create_upload / main.upload_session).
+// Файл отправляется блоками по смещениям с SHA-256 каждого блока; после обрыва
+// связи загрузка продолжается со смещения, которое сообщает сервер. Токен
+// сессии запоминается в localStorage, поэтому продолжить можно и после перезагрузки страницы.
+
+class ChunkedUploader {
+    /**
+     * @param {string} sessionsUrl - URL открытия сессии (POST)
+     * @param {{retries?: number, onProgress?: Function}} options
+     */
+    constructor(sessionsUrl, options = {}) {
+        this.sessionsUrl = sessionsUrl.replace(/\/$/, '');
+        this.retries = options.retries ?? 5;
+        this.onProgress = options.onProgress || (() => {});
+    }
+
+    static _storageKey(file, kind) {
+        return `chunked_upload:${kind}:${file.name}:${file.size}:${file.lastModified}`;
+    }
+
+    static async _sha256(blob) {
+        // crypto.subtle доступен только в защищённом контексте (HTTPS, localhost)
+        if (!window.crypto || !window.crypto.subtle) {
+            return null;
+        }
+        const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+        return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    async _json(response) {
+        const data = await response.json().catch(() => ({}));
+        if (!response.ok && response.status !== 409) {
+            const error = new Error(data.error || `HTTP ${response.status}`);
+            error.status = response.status;
+            throw error;
+        }
+        return data;
+    }
+
+    async _open(file, kind) {
+        const key = ChunkedUploader._storageKey(file, kind);
+        const saved = localStorage.getItem(key);
+        if (saved) {
+            const response = await fetch(`${this.sessionsUrl}/${saved}`, {credentials: 'same-origin'});
+            if (response.ok) {
+                return response.json();
+            }
+            localStorage.removeItem(key);
+        }
+        const response = await fetch(this.sessionsUrl, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({filename: file.name, size: file.size, kind: kind})
+        });
+        const session = await this._json(response);
+        localStorage.setItem(key, session.upload_id);
+        return session;
+    }
+
+    /**
+     * Загрузка файла; возвращает токен завершённой сессии
+     *
+     * @param {File} file
+     * @param {string} kind - 'image' или 'annotation'
+     * @returns {Promise<string>}
+     */
+    async upload(file, kind) {
+        let session = await this._open(file, kind);
+        const url = `${this.sessionsUrl}/${session.upload_id}`;
+        let failures = 0;
+
+        while (session.status === 'open' && session.offset < session.size) {
+            const chunk = file.slice(session.offset, Math.min(session.size, session.offset + session.chunk_size));
+            const headers = {'Content-Type': 'application/octet-stream'};
+            const checksum = await ChunkedUploader._sha256(chunk);
+            if (checksum) {
+                headers['X-Chunk-SHA256'] = checksum;
+            }
+            try {
+                const response = await fetch(`${url}?offset=${session.offset}`, {
+                    method: 'PUT', credentials: 'same-origin', headers: headers, body: chunk
+                });
+                // 409 — сервер сообщает актуальное смещение, продолжаем с него
+                session = await this._json(response);
+                failures = 0;
+            } catch (error) {
+                if (error.status && error.status < 500 && error.status !== 422) {
+                    throw error;
+                }
+                if (++failures > this.retries) {
+                    throw error;
+                }
+                // Обрыв связи или повреждённый блок: пауза и сверка смещения с сервером
+                await new Promise(resolve => setTimeout(resolve, 500 * 2 ** failures));
+                session = await fetch(url, {credentials: 'same-origin'}).then(r => this._json(r)).catch(() => session);
+            }
+            this.onProgress(file, session.offset, session.size);
+        }
+
+        if (session.status !== 'complete') {
+            session = await this._json(await fetch(`${url}/complete`, {method: 'POST', credentials: 'same-origin'}));
+            if (session.status !== 'complete') {
+                throw new Error(session.error || 'Файл загружен не полностью');
+            }
+        }
+        localStorage.removeItem(ChunkedUploader._storageKey(file, kind));
+        return session.upload_id;
+    }
+}
+
+/**
+ * Поблочная загрузка файлов формы перед отправкой: выбранные файлы загружаются
+ * через ChunkedUploader, в форму добавляются скрытые поля с токенами сессий,
+ * а сами поля файлов отключаются, чтобы не отправлять файлы повторно.
+ *
+ * @param {HTMLFormElement} form
+ * @param {string} sessionsUrl - URL открытия сессии
+ * @param {Object<string, {kind: string, target: string}>} fields - id поля файла → тип и имя скрытого поля
+ * @param {{enabled?: Function, progress?: HTMLElement}} options
+ */
+function attachChunkedUpload(form, sessionsUrl, fields, options = {}) {
+    const progress = options.progress;
+    form.addEventListener('submit', async function(e) {
+        if (e.defaultPrevented || (options.enabled && !options.enabled())) {
+            return;
+        }
+        const selected = Object.entries(fields)
+            .map(([id, spec]) => [document.getElementById(id), spec])
+            .filter(([input]) => input && input.files.length);
+        // Сервер принимает только пару «изображение + аннотация»
+        if (selected.length !== Object.keys(fields).length) {
+            return;
+        }
+        e.preventDefault();
+
+        const submitButtons = form.querySelectorAll('[type="submit"]');
+        submitButtons.forEach(button => button.disabled = true);
+        const totalBytes = selected.reduce((sum, [input]) => sum + input.files[0].size, 0);
+        const done = {};
+        const uploader = new ChunkedUploader(sessionsUrl, {
+            onProgress: (file, offset) => {
+                done[file.name] = offset;
+                if (progress) {
+                    const sent = Object.values(done).reduce((a, b) => a + b, 0);
+                    progress.classList.remove('d-none');
+                    progress.querySelector('.progress-bar').style.width = Math.round(sent * 100 / totalBytes) + '%';
+                }
+            }
+        });
+
+        try {
+            for (const [input, spec] of selected) {
+                const uploadId = await uploader.upload(input.files[0], spec.kind);
+                let hidden = form.querySelector(`input[name="${spec.target}"]`);
+                if (!hidden) {
+                    hidden = document.createElement('input');
+                    hidden.type = 'hidden';
+                    hidden.name = spec.target;
+                    form.appendChild(hidden);
+                }
+                hidden.value = uploadId;
+            }
+            selected.forEach(([input]) => input.disabled = true);
+            form.submit();
+        } catch (error) {
+            submitButtons.forEach(button => button.disabled = false);
+            alert(error.message);
+        }
+    });
+}
@@ -0,0 +1,100 @@
+// app/static/js/tiled_image.js
+// Отрисовка изображения по тайловой пирамиде (main.image_tiles_info / main.image_tile).
+// Для текущего масштаба выбирается ближайший уровень не хуже экранного разрешения,
+// загружаются только тайлы, попадающие в видимую область холста.
+
+class TiledImage {
+    /**
+     * @param {string} infoUrl - URL описания пирамиды
+     * @param {string} tileUrl - URL тайла 0/0/0 (уровень, столбец и строка подставляются)
+     * @param {Function} onTileLoad - вызывается после загрузки очередного тайла
+     */
+    constructor(infoUrl, tileUrl, onTileLoad) {
+        this.infoUrl = infoUrl;
+        this.tileUrl = tileUrl;
+        this.onTileLoad = onTileLoad;
+        this.info = null;
+        this.tiles = new Map();
+        this.maxTiles = 256;
+        this._loading = null;
+    }
+
+    /** Загрузка описания пирамиды (один раз) */
+    load() {
+        if (!this._loading) {
+            this._loading = fetch(this.infoUrl, {credentials: 'same-origin'})
+                .then(response => response.ok ? response.json() : null)
+                .then(info => { this.info = info; return info; })
+                .catch(() => null);
+        }
+        return this._loading;
+    }
+
+    _url(level, col, row) {
+        return this.tileUrl.replace('/0/0/0/', `/${level}/${col}/${row}/`);
+    }
+
+    _tile(level, col, row) {
+        const key = `${level}/${col}/${row}`;
+        let tile = this.tiles.get(key);
+        if (tile) {
+            // Порядок Map используется как LRU
+            this.tiles.delete(key);
+            this.tiles.set(key, tile);
+            return tile;
+        }
+        tile = new Image();
+        tile.onload = () => this.onTileLoad && this.onTileLoad();
+        tile.src = this._url(level, col, row);
+        this.tiles.set(key, tile);
+        if (this.tiles.size > this.maxTiles) {
+            this.tiles.delete(this.tiles.keys().next().value);
+        }
+        return tile;
+    }
+
+    /**
+     * Рисование видимых тайлов. Контекст уже преобразован в координаты холста
+     * при масштабе 1 (baseWidth x baseHeight), в которые растянуто изображение.
+     *
+     * @param {CanvasRenderingContext2D} ctx
+     * @param {{zoom: number, x: number, y: number}} view - масштаб и левый верхний угол видимой области
+     * @param {number} baseWidth
+     * @param {number} baseHeight
+     * @returns {boolean} true, если все видимые тайлы уже загружены
+     */
+    draw(ctx, view, baseWidth, baseHeight) {
+        const info = this.info;
+        if (!info) {
+            return false;
+        }
+        // Пикселей оригинала на единицу холста; уровень k уменьшен в 2^k раз
+        const density = Math.min(info.width / baseWidth, info.height / baseHeight);
+        const level = Math.max(0, Math.min(info.levels.length - 1,
+            Math.floor(Math.log2(density / view.zoom))));
+        const size = info.tile_size;
+        const levelWidth = info.levels[level].width;
+        const levelHeight = info.levels[level].height;
+        const scaleX = levelWidth / baseWidth;
+        const scaleY = levelHeight / baseHeight;
+
+        const x0 = view.x * scaleX;
+        const y0 = view.y * scaleY;
+        const x1 = Math.min(levelWidth, (view.x + baseWidth / view.zoom) * scaleX);
+        const y1 = Math.min(levelHeight, (view.y + baseHeight / view.zoom) * scaleY);
+
+        let complete = true;
+        for (let row = Math.floor(y0 / size); row * size < y1; row++) {
+            for (let col = Math.floor(x0 / size); col * size < x1; col++) {
+                const tile = this._tile(level, col, row);
+                if (!tile.complete || !tile.naturalWidth) {
+                    complete = false;
+                    continue;
+                }
+                ctx.drawImage(tile, col * size / scaleX, row * size / scaleY,
+                    tile.naturalWidth / scaleX, tile.naturalHeight / scaleY);
+            }
+        }
+        return complete;
+    }
+}
@@ -6,12 +6,17 @@
 from .contour_metrics import *
 from .image_processing import *
 from .themes import *
+from .answer_similarity import *
+from .coco_stream import iter_coco
+from .annotation_cache import annotation_cache, load_annotations_cached
 
 __all__ = [
     'calculate_iou', 'calculate_chamfer_distance', 'calculate_hausdorff_distance',
     'calculate_contour_metrics', 'calculate_comprehensive_contour_score',
-    'process_coco_annotations', 'parse_coco_for_image',
-    'load_theme', 'apply_theme_to_response'
+    'process_coco_annotations', 'process_yolo_annotations', 'probe_image_size', 'parse_coco_for_image', 'split_coco_by_image', 'iter_coco',
+    'rle_encode', 'rle_decode', 'rle_compress', 'rle_area', 'rle_iou', 'polygon_to_rle',
+    'load_theme', 'apply_theme_to_response',
+    'find_similar_answers', 'annotation_cache', 'load_annotations_cached'
 ]
 
 # Фильтр для Jinja2 будет добавлен в app/__init__.py после создания приложения
\ No newline at end of file
@@ -0,0 +1,192 @@
+# app/utils/annotation_cache.py
+"""
+Кэш разобранных файлов аннотаций приложения медицинского тестирования
+Содержит LRU-кэш уровня процесса с ограничением по объёму памяти и
+автоматической инвалидацией при изменении файла (по mtime и размеру)
+"""
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from config import Config
+from app.utils.image_processing import process_coco_annotations
+
+logger = logging.getLogger(__name__)
+
+# Оценка накладных расходов на одну запись аннотации (dict, метка, bbox)
+_ENTRY_OVERHEAD_BYTES = 512
+
+
+def _freeze_annotations(data):
+    """
+    Преобразование результата process_coco_annotations к неизменяемому виду
+
+    Args:
+        data (dict): {'labels': [...], 'annotations': [{'label', 'contour', 'bbox', ...}, ...]}
+
+    Returns:
+        tuple: (dict с кортежами и read-only массивами float32, оценка объёма в байтах)
+    """
+    size = sys.getsizeof(data)
+    annotations = []
+    for ann in data.get('annotations', []):
+        contour = np.asarray(ann['contour'], dtype=np.float32).reshape(-1, 2)
+        contour.setflags(write=False)
+        frozen = dict(ann)
+        frozen['contour'] = contour
+        if frozen.get('bbox') is not None:
+            frozen['bbox'] = tuple(frozen['bbox'])
+        annotations.append(frozen)
+        size += contour.nbytes + _ENTRY_OVERHEAD_BYTES
+        if 'rle' in frozen:
+            size += len(frozen['rle']['counts'])
+    labels = tuple(data.get('labels', []))
+    size += sum(sys.getsizeof(label) for label in labels)
+    return {'labels': labels, 'annotations': tuple(annotations)}, size
+
+
+class AnnotationCache:
+    """
+    LRU-кэш разобранных файлов аннотаций
+
+    Ключ записи — абсолютный путь и признак разбора (token): результат
+    зависит не только от файла, но и от загрузчика и его параметров (например,
+    YOLO переводит нормированные координаты по размеру изображения). Вместе со
+    значением хранится версия файла (mtime_ns, size); при её несовпадении
+    запись считается устаревшей и файл разбирается заново.
+
+    Attributes:
+        max_bytes (int): Ограничение суммарного объёма записей в байтах
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (path, token) -> (version, data, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    @staticmethod
+    def _file_version(path):
+        """Версия файла (mtime_ns, size) или None, если файл недоступен"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, path, loader=process_coco_annotations, token=None):
+        """
+        Получение разобранных аннотаций файла из кэша или с диска
+
+        Args:
+            path (str): Путь к файлу аннотаций
+            loader (callable): Функция разбора файла (по умолчанию COCO)
+            token (hashable): Признак загрузчика и его параметров; обязателен, если
+                loader не по умолчанию (None — разбор COCO)
+
+        Returns:
+            dict: {'labels': tuple, 'annotations': tuple} с read-only контурами
+                numpy (float32, форма (N, 2)) или None, если файл не удалось разобрать
+        """
+        path = os.path.abspath(path)
+        version = self._file_version(path)
+        if version is None:
+            self.invalidate(path)
+            return None
+        key = (path, token)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == version:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry[1]
+                self._drop(key)
+                self._invalidations += 1
+            self._misses += 1
+
+        data = loader(path)
+        if data is None:
+            return None
+        frozen, size = _freeze_annotations(data)
+
+        # Файл переписан во время разбора: результат не соответствует версии и не кэшируется
+        if self._file_version(path) != version:
+            logger.info(f"Файл аннотаций '{path}' изменился во время разбора и не кэшируется")
+            return frozen
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if size <= self.max_bytes:
+                self._entries[key] = (version, frozen, size)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    oldest = next(iter(self._entries))
+                    self._drop(oldest)
+                    self._evictions += 1
+            else:
+                logger.info(f"Аннотации '{path}' ({size} байт) превышают бюджет кэша и не кэшируются")
+        return frozen
+
+    def invalidate(self, path):
+        """Удаление записей файла из кэша (например, после удаления файла)"""
+        path = os.path.abspath(path)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == path]:
+                self._drop(key)
+                self._invalidations += 1
+
+    def clear(self):
+        """Полная очистка кэша без сброса статистики"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        Статистика работы кэша
+
+        Returns:
+            dict: Количество попаданий, промахов, вытеснений, инвалидаций и текущий объём
+        """
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def _drop(self, key):
+        """Удаление записи без блокировки (вызывается под self._lock)"""
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+
+# Кэш уровня процесса (бюджет переопределяется в create_app из конфигурации)
+annotation_cache = AnnotationCache(Config.ANNOTATION_CACHE_MAX_BYTES)
+
+
+def load_annotations_cached(path):
+    """
+    Загрузка разобранных COCO-аннотаций через кэш уровня процесса
+
+    Args:
+        path (str): Путь к файлу аннотаций COCO
+
+    Returns:
+        dict: {'labels': tuple, 'annotations': tuple} или None при ошибке разбора
+    """
+    return annotation_cache.get(path)
@@ -0,0 +1,223 @@
+# app/utils/answer_similarity.py
+"""
+Утилиты для поиска похожих графических ответов студентов
+Содержит вычисление компактных сигнатур контуров (MinHash по растровой маске)
+и LSH-бакетирование для поиска почти совпадающих ответов за линейное время
+"""
+import json
+import logging
+from collections import defaultdict
+
+import cv2
+import numpy as np
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Простое число Мерсенна для универсального хеширования (a * x + b) mod p
+_MERSENNE_PRIME = (1 << 31) - 1
+
+
+def _points_to_array(points):
+    """
+    Преобразование точек контура в массив numpy
+
+    Args:
+        points (list): Точки в формате [{'x': .., 'y': ..}, ...] или [[x, y], ...]
+
+    Returns:
+        np.ndarray: Массив формы (N, 2) или None, если точек недостаточно
+    """
+    if not points:
+        return None
+    try:
+        if isinstance(points[0], dict):
+            arr = np.array([[p['x'], p['y']] for p in points], dtype=np.float32)
+        else:
+            arr = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+    except (KeyError, TypeError, ValueError):
+        return None
+    return arr if len(arr) >= 3 else None
+
+
+def contours_to_cells(contours, canvas_size=None, grid_size=None):
+    """
+    Растеризация контуров ответа в уменьшенную маску и получение индексов заполненных ячеек
+
+    Args:
+        contours (list): Контуры ответа студента [{'points': [...], 'label': ...}, ...]
+        canvas_size (tuple): Размер холста (ширина, высота)
+        grid_size (tuple): Размер сетки уменьшенной маски (ширина, высота)
+
+    Returns:
+        np.ndarray: Отсортированный массив индексов заполненных ячеек (int64)
+    """
+    canvas_w, canvas_h = canvas_size or Config.CANVAS_SIZE
+    grid_w, grid_h = grid_size or Config.SIMILARITY_GRID_SIZE
+    scale = np.array([grid_w / float(canvas_w), grid_h / float(canvas_h)], dtype=np.float32)
+
+    mask = np.zeros((grid_h, grid_w), dtype=np.uint8)
+    polygons = []
+    for contour in contours or []:
+        points = contour.get('points') if isinstance(contour, dict) else contour
+        arr = _points_to_array(points)
+        if arr is None:
+            continue
+        polygons.append(np.round(arr * scale).astype(np.int32))
+
+    if polygons:
+        cv2.fillPoly(mask, polygons, 1)
+
+    return np.flatnonzero(mask).astype(np.int64)
+
+
+class MinHasher:
+    """
+    Вычислитель MinHash-сигнатур для множеств целых чисел
+
+    Attributes:
+        num_perm (int): Количество хеш-функций (длина сигнатуры)
+        a (np.ndarray): Коэффициенты a универсальных хеш-функций
+        b (np.ndarray): Коэффициенты b универсальных хеш-функций
+    """
+
+    def __init__(self, num_perm=64, seed=1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+        self.b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+
+    def signature(self, cells):
+        """
+        Вычисление MinHash-сигнатуры множества ячеек
+
+        Args:
+            cells (np.ndarray): Индексы заполненных ячеек
+
+        Returns:
+            np.ndarray: Сигнатура длины num_perm (uint32) или None для пустого множества
+        """
+        if cells is None or len(cells) == 0:
+            return None
+        hashed = (self.a[:, None] * cells[None, :] + self.b[:, None]) % _MERSENNE_PRIME
+        return hashed.min(axis=1).astype(np.uint32)
+
+
+def jaccard(cells1, cells2):
+    """
+    Точное значение коэффициента Жаккара (IoU уменьшенных масок)
+
+    Args:
+        cells1 (np.ndarray): Отсортированные индексы ячеек первого ответа
+        cells2 (np.ndarray): Отсортированные индексы ячеек второго ответа
+
+    Returns:
+        float: Значение от 0.0 до 1.0
+    """
+    if len(cells1) == 0 and len(cells2) == 0:
+        return 0.0
+    inter = np.intersect1d(cells1, cells2, assume_unique=True).size
+    union = len(cells1) + len(cells2) - inter
+    return inter / union if union else 0.0
+
+
+def iter_graphic_answers(results):
+    """
+    Извлечение графических ответов из результатов тестов
+
+    Args:
+        results (iterable): Объекты TestResult
+
+    Yields:
+        tuple: (question_id, result, contours)
+    """
+    for result in results:
+        try:
+            answers = json.loads(result.answers_json) if result.answers_json else {}
+        except (TypeError, ValueError):
+            logger.warning(f"Некорректный answers_json в результате {result.id}")
+            continue
+        if not isinstance(answers, dict):
+            continue
+        for key, contours in answers.items():
+            if not key.startswith('graphic_') or not contours:
+                continue
+            try:
+                question_id = int(key[len('graphic_'):])
+            except ValueError:
+                continue
+            yield question_id, result, contours
+
+
+def find_similar_answers(results, question_ids=None, threshold=None, num_perm=None, bands=None):
+    """
+    Поиск пар почти совпадающих графических ответов по каждому вопросу
+
+    Для каждого ответа строится MinHash-сигнатура растровой маски контуров,
+    сигнатуры разбиваются на полосы (LSH), и кандидатами считаются только
+    ответы, попавшие хотя бы в один общий бакет. Кандидаты проверяются точным
+    коэффициентом Жаккара, поэтому время работы близко к линейному.
+
+    Args:
+        results (iterable): Объекты TestResult
+        question_ids (set): Ограничение по ID вопросов (None — все вопросы)
+        threshold (float): Минимальная схожесть для включения пары в отчёт
+        num_perm (int): Длина MinHash-сигнатуры
+        bands (int): Количество LSH-полос (num_perm должно делиться на bands)
+
+    Returns:
+        list: Пары, отсортированные по убыванию схожести:
+            [{'question_id', 'result_id_1', 'result_id_2', 'user_id_1', 'user_id_2', 'similarity'}, ...]
+    """
+    threshold = Config.SIMILARITY_THRESHOLD if threshold is None else threshold
+    num_perm = num_perm or Config.SIMILARITY_NUM_PERM
+    bands = bands or Config.SIMILARITY_LSH_BANDS
+    rows = num_perm // bands
+    hasher = MinHasher(num_perm=num_perm)
+
+    # question_id -> список (result, cells)
+    entries = defaultdict(list)
+    # (question_id, band, ключ полосы) -> индексы записей
+    buckets = defaultdict(list)
+
+    for question_id, result, contours in iter_graphic_answers(results):
+        if question_ids is not None and question_id not in question_ids:
+            continue
+        cells = contours_to_cells(contours)
+        signature = hasher.signature(cells)
+        if signature is None:
+            continue
+        idx = len(entries[question_id])
+        entries[question_id].append((result, cells))
+        for band in range(bands):
+            key = signature[band * rows:(band + 1) * rows].tobytes()
+            buckets[(question_id, band, key)].append(idx)
+
+    candidates = set()
+    for (question_id, _band, _key), members in buckets.items():
+        if len(members) < 2:
+            continue
+        for i in range(len(members)):
+            for j in range(i + 1, len(members)):
+                candidates.add((question_id, members[i], members[j]))
+
+    report = []
+    for question_id, i, j in candidates:
+        result1, cells1 = entries[question_id][i]
+        result2, cells2 = entries[question_id][j]
+        if result1.user_id == result2.user_id:
+            continue
+        similarity = jaccard(cells1, cells2)
+        if similarity < threshold:
+            continue
+        report.append({
+            'question_id': question_id,
+            'result_id_1': result1.id,
+            'result_id_2': result2.id,
+            'user_id_1': result1.user_id,
+            'user_id_2': result2.user_id,
+            'similarity': similarity
+        })
+
+    report.sort(key=lambda row: (-row['similarity'], row['question_id'], row['result_id_1']))
+    return report
@@ -0,0 +1,270 @@
+# app/utils/background_jobs.py
+"""
+Пул фоновых воркеров приложения медицинского тестирования
+Содержит реестр обработчиков задач, запуск задач в пуле потоков с
+контекстом приложения и обновление записи BackgroundJob по ходу выполнения
+"""
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, update
+
+from app import db
+from app.models.background_job import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+# Обработчики задач по типу: kind -> callable(job)
+_handlers = {}
+
+_app = None
+_executor = None
+_side_executor = None
+_lock = threading.Lock()
+
+
+def job_handler(kind):
+    """
+    Декоратор регистрации обработчика фоновой задачи
+
+    Обработчик получает объект BackgroundJob (в сессии воркера) и может
+    вернуть dict — он сохраняется как результат задачи.
+    """
+    def decorator(func):
+        _handlers[kind] = func
+        return func
+    return decorator
+
+
+def init_background_jobs(app):
+    """Привязка пула воркеров к приложению (вызывается из create_app)"""
+    global _app
+    _app = app
+
+
+def _get_executor(side=False):
+    """Ленивое создание пулов: основной — для задач, дополнительный — для параллельных этапов"""
+    global _executor, _side_executor
+    with _lock:
+        if side:
+            if _side_executor is None:
+                _side_executor = ThreadPoolExecutor(
+                    max_workers=_app.config.get('BACKGROUND_SIDE_WORKERS', 2),
+                    thread_name_prefix='job-side')
+            return _side_executor
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_app.config.get('BACKGROUND_WORKERS', 2),
+                thread_name_prefix='job')
+        return _executor
+
+
+def _is_async():
+    return _app is not None and _app.config.get('BACKGROUND_JOBS_ASYNC', True)
+
+
+def create_job(kind, params=None, creator_id=None, total=None):
+    """
+    Создание записи фоновой задачи (с коммитом)
+
+    Args:
+        kind (str): Тип задачи (должен быть зарегистрирован через job_handler)
+        params (dict): Параметры задачи
+        creator_id (int): ID пользователя
+        total (int): Общее количество элементов (если известно)
+
+    Returns:
+        BackgroundJob: Созданная задача
+    """
+    job = BackgroundJob(kind=kind, status='pending', creator_id=creator_id, total=total)
+    job.params = params
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def submit_job(job):
+    """
+    Постановка задачи в пул воркеров
+
+    При BACKGROUND_JOBS_ASYNC = False (тесты, CLI) задача выполняется сразу
+    в текущем потоке.
+
+    Args:
+        job (BackgroundJob | int): Задача или её ID
+    """
+    job_id = job if isinstance(job, int) else job.id
+    if _is_async():
+        _get_executor().submit(_run_job, job_id)
+    else:
+        _execute(job_id)
+
+
+def run_side_task(func, *args, **kwargs):
+    """
+    Запуск вспомогательного этапа параллельно с основным (в контексте приложения)
+
+    Используется отдельный пул, чтобы задача, ожидающая свой этап, не могла
+    занять все потоки основного пула.
+
+    Returns:
+        Future: Результат выполнения func
+    """
+    def wrapper():
+        with _app.app_context():
+            return func(*args, **kwargs)
+
+    if _is_async():
+        return _get_executor(side=True).submit(wrapper)
+
+    future = Future()
+    try:
+        future.set_result(func(*args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def update_job(job, stage=None, processed=None, total=None, message=None, commit=True):
+    """
+    Обновление прогресса задачи
+
+    Args:
+        job (BackgroundJob): Задача
+        stage (str): Текущий этап
+        processed (int): Количество обработанных элементов
+        total (int): Общее количество элементов
+        message (str): Сообщение о ходе выполнения
+        commit (bool): Зафиксировать изменения сразу (видимость для эндпоинта статуса)
+    """
+    if stage is not None:
+        job.stage = stage
+    if processed is not None:
+        job.processed = processed
+    if total is not None:
+        job.total = total
+    if message is not None:
+        job.message = message
+    job.updated_at = datetime.utcnow()
+    if commit:
+        db.session.commit()
+
+
+def _stale_cutoff():
+    minutes = (_app.config if _app is not None else {}).get('BACKGROUND_JOB_STALE_MINUTES', 30)
+    return datetime.utcnow() - timedelta(minutes=minutes)
+
+
+def job_is_stale(job):
+    """
+    Незавершённая задача без обновлений дольше BACKGROUND_JOB_STALE_MINUTES
+    (пул воркеров, выполнявший её, остановлен — перезапуск или сбой процесса)
+    """
+    return job.status in ('pending', 'running') and job.updated_at is not None and \
+        job.updated_at < _stale_cutoff()
+
+
+def fail_stale_jobs():
+    """
+    Перевод зависших задач в failed (при запуске приложения и перед проверкой
+    активных задач): пул воркеров живёт в процессе, и после перезапуска их
+    никто не выполнит. Задачи моложе BACKGROUND_JOB_STALE_MINUTES не трогаются —
+    их может выполнять другой процесс. Прерванную задачу можно возобновить
+    через requeue_job
+
+    Returns:
+        int: Количество задач
+    """
+    now = datetime.utcnow()
+    count = db.session.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.status.in_(('pending', 'running')), BackgroundJob.updated_at < _stale_cutoff())
+        .values(status='failed', finished_at=now, updated_at=now,
+                message='Задача прервана: нет обновлений (перезапуск или сбой сервера)')
+    ).rowcount
+    db.session.commit()
+    if count:
+        logger.warning(f"Зависших фоновых задач переведено в failed: {count}")
+    return count
+
+
+def requeue_job(job, message=None):
+    """
+    Повторная постановка задачи, завершившейся ошибкой или зависшей; перевод в
+    pending выполняется условным UPDATE, поэтому двойной запрос не запустит
+    задачу дважды
+
+    Args:
+        job (BackgroundJob): Задача
+        message (str): Сообщение о возобновлении
+
+    Returns:
+        bool: True, если задача поставлена в очередь
+    """
+    requeued = db.session.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.id == job.id,
+               or_(BackgroundJob.status == 'failed',
+                   and_(BackgroundJob.status.in_(('pending', 'running')),
+                        BackgroundJob.updated_at < _stale_cutoff())))
+        .values(status='pending', finished_at=None, updated_at=datetime.utcnow(), message=message)
+    ).rowcount
+    db.session.commit()
+    if not requeued:
+        return False
+    db.session.refresh(job)
+    submit_job(job)
+    return True
+
+
+def _run_job(job_id):
+    """Точка входа потока пула: выполнение задачи в контексте приложения"""
+    with _app.app_context():
+        try:
+            _execute(job_id)
+        finally:
+            db.session.remove()
+
+
+def _execute(job_id):
+    """Выполнение задачи с переводом её состояния pending → running → done/failed"""
+    job = db.session.get(BackgroundJob, job_id)
+    if job is None:
+        logger.warning(f"Фоновая задача {job_id} не найдена")
+        return
+    handler = _handlers.get(job.kind)
+    if handler is None:
+        job.status = 'failed'
+        job.message = f"Неизвестный тип задачи: {job.kind}"
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return
+
+    # Задачу, поставленную повторно (возобновление), выполняет только один воркер
+    claimed = db.session.execute(
+        update(BackgroundJob)
+        .where(BackgroundJob.id == job_id, BackgroundJob.status == 'pending')
+        .values(status='running', updated_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        logger.info(f"Фоновая задача {job_id} уже выполняется или завершена")
+        return
+    db.session.refresh(job)
+    try:
+        result = handler(job)
+        if result is not None:
+            job.result = result
+        job.status = 'done'
+        job.finished_at = datetime.utcnow()
+        update_job(job)
+    except Exception as e:
+        logger.exception(f"Ошибка фоновой задачи {job_id} ({job.kind})")
+        db.session.rollback()
+        job = db.session.get(BackgroundJob, job_id)
+        job.status = 'failed'
+        job.message = str(e)
+        job.finished_at = datetime.utcnow()
+        update_job(job)
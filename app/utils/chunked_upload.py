@@ -0,0 +1,291 @@
+# app/utils/chunked_upload.py
+"""
+Поблочная (возобновляемая) загрузка файлов
+Протокол: открытие сессии с размером файла → блоки по смещениям с SHA-256
+каждого блока → сборка. Блоки пишутся потоково прямо в файл-заготовку в
+локальной папке загрузок, поэтому сборка — это перенос файла в хранилище без
+копирования (для удалённого хранилища — одна выгрузка готового файла).
+Прерванную загрузку можно продолжить со смещения, сохранённого в сессии
+"""
+import hashlib
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import update
+from werkzeug.utils import secure_filename
+
+from app import db
+from app.models.upload_session import UploadSession
+from app.utils.storage import storage, storage_key
+from app.utils.upload_gc import release_unused_image
+from app.utils.upload_storage import store_file
+
+logger = logging.getLogger(__name__)
+
+# Папка хранилища и допустимые расширения (ключ конфигурации) для каждого типа файла
+_KINDS = {
+    'image': ('images', 'ALLOWED_IMAGE_EXTENSIONS'),
+    'annotation': ('annotations', 'ALLOWED_ANNOTATION_EXTENSIONS'),
+    'archive': ('imports', 'ALLOWED_ARCHIVE_EXTENSIONS'),
+}
+
+# Размер блока потокового чтения тела запроса
+_READ_SIZE = 64 * 1024
+
+
+class ChunkedUploadError(Exception):
+    """Ошибка протокола поблочной загрузки с HTTP-статусом ответа"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _part_path(upload_folder, session):
+    """Файл-заготовка сессии: в папке .tmp хранилища (та же файловая система)"""
+    return os.path.join(upload_folder, _KINDS[session.kind][0], '.tmp', f"{session.id}.part")
+
+
+def create_upload_session(user_id, filename, total_size, kind, sha256=None):
+    """
+    Открытие сессии загрузки и создание пустого файла-заготовки
+
+    Args:
+        user_id (int): ID пользователя
+        filename (str): Исходное имя файла
+        total_size (int): Размер файла в байтах
+        kind (str): Тип файла ('image', 'annotation', 'archive')
+        sha256 (str): SHA-256 всего файла для проверки при сборке (необязательно)
+
+    Returns:
+        UploadSession: Новая сессия
+
+    Raises:
+        ChunkedUploadError: Если тип, имя или размер файла недопустимы
+    """
+    if kind not in _KINDS:
+        raise ChunkedUploadError('Неизвестный тип файла')
+    config = current_app.config
+    filename = secure_filename(filename or '')
+    allowed_ext = set(config.get(_KINDS[kind][1], ()))
+    if '.' not in filename or filename.rsplit('.', 1)[1].lower() not in allowed_ext:
+        raise ChunkedUploadError('Неверный формат файла')
+    if not isinstance(total_size, int) or total_size <= 0:
+        raise ChunkedUploadError('Некорректный размер файла')
+    if total_size > config.get('CHUNKED_UPLOAD_MAX_BYTES', 2 * 1024 * 1024 * 1024):
+        raise ChunkedUploadError('Файл слишком большой', status=413)
+    if sha256 is not None and (len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256.lower())):
+        raise ChunkedUploadError('Некорректная контрольная сумма файла')
+
+    expire_upload_sessions()
+
+    session = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=user_id,
+        kind=kind,
+        filename=filename,
+        total_size=total_size,
+        chunk_size=config.get('CHUNKED_UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024),
+        received_size=0,
+        sha256=sha256.lower() if sha256 else None
+    )
+    part_path = _part_path(config['UPLOAD_FOLDER'], session)
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    open(part_path, 'wb').close()
+    db.session.add(session)
+    db.session.commit()
+    return session
+
+
+def write_chunk(session, offset, stream, length, checksum=None):
+    """
+    Приём блока: потоковая запись в заготовку по смещению с проверкой SHA-256
+
+    Блок принимается только по текущему смещению сессии — повторная отправка
+    уже принятого блока или пропуск отвергаются с кодом 409 и актуальным
+    смещением. При несовпадении контрольной суммы заготовка усекается до
+    прежнего размера, и блок можно отправить снова.
+
+    Args:
+        session (UploadSession): Открытая сессия
+        offset (int): Смещение блока
+        stream: Тело запроса (файловый объект)
+        length (int): Длина блока (Content-Length)
+        checksum (str): SHA-256 блока в hex
+
+    Returns:
+        int: Смещение следующего блока
+
+    Raises:
+        ChunkedUploadError: При нарушении протокола или ошибке контрольной суммы
+    """
+    if session.status != 'open':
+        raise ChunkedUploadError('Загрузка уже завершена', status=409)
+    if offset != session.received_size:
+        raise ChunkedUploadError('Неверное смещение блока', status=409)
+    if not length or length > session.chunk_size or offset + length > session.total_size:
+        raise ChunkedUploadError('Некорректный размер блока', status=413)
+
+    part_path = _part_path(current_app.config['UPLOAD_FOLDER'], session)
+    if not os.path.exists(part_path):
+        raise ChunkedUploadError('Сессия загрузки не найдена', status=404)
+
+    digest = hashlib.sha256()
+    written = 0
+    with open(part_path, 'r+b') as f:
+        f.seek(offset)
+        while written < length:
+            data = stream.read(min(_READ_SIZE, length - written))
+            if not data:
+                break
+            digest.update(data)
+            f.write(data)
+            written += len(data)
+        if written != length or (checksum and digest.hexdigest() != checksum.lower()):
+            f.truncate(offset)
+            raise ChunkedUploadError('Контрольная сумма блока не совпадает' if written == length
+                                     else 'Блок получен не полностью', status=422)
+        f.truncate(offset + length)
+
+    # Смещение продвигается условно: параллельная отправка того же блока не сдвинет его дважды
+    result = db.session.execute(
+        update(UploadSession)
+        .where(UploadSession.id == session.id, UploadSession.received_size == offset)
+        .values(received_size=offset + length, updated_at=datetime.utcnow())
+    )
+    db.session.commit()
+    if result.rowcount == 0:
+        db.session.refresh(session)
+        raise ChunkedUploadError('Неверное смещение блока', status=409)
+    db.session.refresh(session)
+    return session.received_size
+
+
+def complete_upload(session):
+    """
+    Сборка: перенос заготовки на место в хранилище
+
+    Изображения сохраняются по хешу содержимого (как при обычной загрузке),
+    файлы аннотаций — под уникальным именем в папке annotations, архивы
+    наборов данных остаются в локальной папке imports (их читает задача импорта).
+
+    Args:
+        session (UploadSession): Сессия, в которой приняты все байты
+
+    Returns:
+        UploadSession: Завершённая сессия (stored_file — имя файла в хранилище)
+
+    Raises:
+        ChunkedUploadError: Если файл принят не полностью или не совпал SHA-256
+    """
+    if session.status == 'complete':
+        return session
+    if session.received_size != session.total_size:
+        raise ChunkedUploadError('Файл загружен не полностью', status=409)
+
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    part_path = _part_path(upload_folder, session)
+    if session.sha256:
+        digest = hashlib.sha256()
+        with open(part_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        if digest.hexdigest() != session.sha256:
+            raise ChunkedUploadError('Контрольная сумма файла не совпадает', status=422)
+
+    name_part, ext_part = os.path.splitext(session.filename)
+    if session.kind == 'image':
+        stored_file, _existed = store_file(part_path, upload_folder, 'images', ext_part)
+    elif session.kind == 'archive':
+        stored_file = f"{uuid.uuid4().hex[:8]}{ext_part}"
+        os.replace(part_path, os.path.join(upload_folder, 'imports', stored_file))
+    else:
+        stored_file = f"{name_part}_{uuid.uuid4().hex[:8]}{ext_part}"
+        storage.put_file(storage_key('annotations', stored_file), part_path)
+
+    session.status = 'complete'
+    session.stored_file = stored_file
+    db.session.commit()
+    return session
+
+
+def get_upload_session(upload_id, user_id):
+    """Сессия загрузки пользователя или None"""
+    session = db.session.get(UploadSession, upload_id) if upload_id else None
+    if session is None or session.user_id != user_id:
+        return None
+    return session
+
+
+def claim_upload(upload_id, user_id, kind):
+    """
+    Получение собранного файла для дальнейшей обработки; сессия удаляется
+    (без коммита — в одной транзакции с использующей файл операцией)
+
+    Args:
+        upload_id (str): Токен сессии
+        user_id (int): ID пользователя
+        kind (str): Ожидаемый тип файла
+
+    Returns:
+        tuple: (исходное имя файла, имя файла в хранилище)
+
+    Raises:
+        ChunkedUploadError: Если сессия не найдена или загрузка не завершена
+    """
+    session = get_upload_session(upload_id, user_id)
+    if session is None or session.kind != kind:
+        raise ChunkedUploadError('Сессия загрузки не найдена', status=404)
+    if session.status != 'complete':
+        raise ChunkedUploadError('Файл загружен не полностью', status=409)
+    db.session.delete(session)
+    return session.filename, session.stored_file
+
+
+def abort_upload(session):
+    """Отмена загрузки: удаление заготовки или невостребованного файла и сессии"""
+    _remove_session_files(current_app.config['UPLOAD_FOLDER'], session)
+    db.session.delete(session)
+    db.session.commit()
+
+
+def _remove_session_files(upload_folder, session):
+    try:
+        if session.status == 'complete' and session.stored_file:
+            if session.kind == 'image':
+                # Одинаковые изображения хранятся одним файлом — он может быть нужен другим загрузкам
+                release_unused_image(upload_folder, session.stored_file, exclude_session_id=session.id)
+            elif session.kind == 'archive':
+                os.remove(os.path.join(upload_folder, 'imports', session.stored_file))
+            else:
+                storage.delete(storage_key('annotations', session.stored_file))
+        else:
+            os.remove(_part_path(upload_folder, session))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Не удалось удалить файл сессии загрузки {session.id}: {e}")
+
+
+def expire_upload_sessions():
+    """
+    Удаление сессий без активности дольше CHUNKED_UPLOAD_TTL_HOURS
+    вместе с заготовками и невостребованными собранными файлами
+
+    Returns:
+        int: Количество удалённых сессий
+    """
+    ttl = current_app.config.get('CHUNKED_UPLOAD_TTL_HOURS', 24)
+    cutoff = datetime.utcnow() - timedelta(hours=ttl)
+    expired = UploadSession.query.filter(UploadSession.updated_at < cutoff).all()
+    if not expired:
+        return 0
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    for session in expired:
+        _remove_session_files(upload_folder, session)
+        db.session.delete(session)
+    db.session.commit()
+    return len(expired)
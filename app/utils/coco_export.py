@@ -0,0 +1,313 @@
+# app/utils/coco_export.py
+"""
+Потоковый экспорт банка аннотаций в формате COCO
+Документ формируется генератором по частям: изображения, категории (метки из
+annotation_labels) и аннотации читаются из БД порциями (yield_per), поэтому
+потребление памяти не зависит от размера банка. Ответы студентов из
+answers_json можно добавить как отдельную категорию (преподавателю — только
+ответы на его вопросы, без ID результатов и с псевдонимами студентов).
+ZIP-архив (JSON + изображения) также пишется потоково
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import zipfile
+
+import numpy as np
+from datetime import datetime
+from functools import lru_cache
+
+from flask import current_app
+
+from app import db
+from app.models.annotation import AnnotationContour, AnnotationLabel, ImageAnnotation
+from app.models.question import Question
+from app.utils.answer_similarity import iter_graphic_answers
+from app.utils.similarity_report import graphic_results_query
+from app.utils.image_processing import probe_image_size, rle_decode
+from app.utils.storage import storage, storage_key
+
+logger = logging.getLogger(__name__)
+
+# Размер порции строк БД и блока копирования изображений в архив
+_BATCH_SIZE = 500
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+# Категория контуров студентов (ID назначается после категорий-меток)
+STUDENT_CATEGORY_NAME = 'student_answer'
+# Категория эталонных контуров без метки (category_id обязателен в COCO)
+UNLABELED_CATEGORY_NAME = 'unlabeled'
+
+
+def _image_query(topic_id=None):
+    query = ImageAnnotation.query.order_by(ImageAnnotation.id)
+    if topic_id is not None:
+        query = query.filter(ImageAnnotation.id.in_(
+            db.session.query(Question.image_annotation_id).filter(Question.topic_id == topic_id)))
+    return query
+
+
+def _archive_name(annotation):
+    """Имя изображения в архиве: по ID аннотации (одно изображение может использоваться дважды)"""
+    return f"images/{annotation.id}{os.path.splitext(annotation.image_file)[1].lower()}"
+
+
+def _student_pseudonym(user_id):
+    """Стабильный псевдоним студента (HMAC от ID на SECRET_KEY) вместо его ID"""
+    key = str(current_app.config.get('SECRET_KEY', '')).encode('utf-8')
+    return 'student-' + hmac.new(key, str(user_id).encode('utf-8'), hashlib.sha256).hexdigest()[:12]
+
+
+def _bbox_and_area(points, rle):
+    """
+    bbox и площадь контура, если они не сохранены в БД: по маске RLE или по вершинам
+
+    Returns:
+        tuple: ([x, y, w, h], площадь)
+    """
+    if rle:
+        mask = rle_decode(rle)
+        ys, xs = np.nonzero(mask)
+        if len(xs) == 0:
+            return [0.0, 0.0, 0.0, 0.0], 0.0
+        return ([float(xs.min()), float(ys.min()), float(xs.max() - xs.min() + 1), float(ys.max() - ys.min() + 1)],
+                float(len(xs)))
+    xy = AnnotationContour.unpack_points(points).reshape(-1, 2).astype(np.float64)
+    if len(xy) == 0:
+        return [0.0, 0.0, 0.0, 0.0], 0.0
+    x, y = xy[:, 0], xy[:, 1]
+    area = 0.5 * abs(float(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1))))
+    return [float(x.min()), float(y.min()), float(x.max() - x.min()), float(y.max() - y.min())], area
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def _iter_array(items):
+    """Элементы JSON-массива через запятую"""
+    first = True
+    for item in items:
+        yield ('' if first else ',') + _dumps(item)
+        first = False
+
+
+def iter_coco_export(include_answers=False, topic_id=None, for_archive=False, answers_creator_id=None):
+    """
+    Генератор COCO-документа по частям (строки JSON)
+
+    Args:
+        include_answers (bool): Добавить контуры студентов из answers_json
+        topic_id (int): Только изображения вопросов темы
+        for_archive (bool): Имена файлов изображений — пути внутри ZIP-архива
+        answers_creator_id (int): Только ответы на вопросы этого создателя, без ID
+            результатов и с псевдонимами студентов (None — все ответы, для администратора)
+
+    Yields:
+        str: Очередной фрагмент JSON-документа
+    """
+    canvas_w, canvas_h = current_app.config.get('CANVAS_SIZE', (600, 400))
+
+    @lru_cache(maxsize=1024)
+    def image_size(image_file):
+        path = storage.fetch(storage_key('images', image_file))
+        return probe_image_size(path) if path else None
+
+    yield '{"info":' + _dumps({
+        'description': current_app.config.get('APP_NAME', 'Medical tests') + ' annotation bank',
+        'date_created': datetime.utcnow().isoformat(timespec='seconds'),
+        'version': '1.0'
+    }) + ',"licenses":[],"images":['
+
+    def images():
+        for annotation in _image_query(topic_id).yield_per(_BATCH_SIZE):
+            width, height = image_size(annotation.image_file) or (None, None)
+            yield {
+                'id': annotation.id,
+                'file_name': _archive_name(annotation) if for_archive else annotation.image_file,
+                'width': width,
+                'height': height
+            }
+    yield from _iter_array(images())
+
+    # Категории — словарь меток (ограничен числом различных меток, а не размером банка)
+    labels = AnnotationLabel.query.order_by(AnnotationLabel.id).all()
+    categories = {label.key: label.id for label in labels}
+    student_category_id = max(categories.values(), default=0) + 1
+    unlabeled_category_id = student_category_id + 1
+    yield '],"categories":['
+    category_items = [{'id': label.id, 'name': label.name, 'supercategory': 'anatomy'} for label in labels]
+    if db.session.query(AnnotationContour.query.filter(AnnotationContour.label_id.is_(None)).exists()).scalar():
+        category_items.append({'id': unlabeled_category_id, 'name': UNLABELED_CATEGORY_NAME,
+                               'supercategory': 'anatomy'})
+    if include_answers:
+        category_items.append({'id': student_category_id, 'name': STUDENT_CATEGORY_NAME,
+                               'supercategory': 'student'})
+    yield from _iter_array(category_items)
+    yield '],"annotations":['
+
+    def reference_annotations():
+        query = db.session.query(
+            AnnotationContour.id,
+            AnnotationContour.annotation_id,
+            AnnotationContour.label,
+            AnnotationContour.label_id,
+            AnnotationContour.bbox_x,
+            AnnotationContour.bbox_y,
+            AnnotationContour.bbox_w,
+            AnnotationContour.bbox_h,
+            AnnotationContour.area,
+            AnnotationContour.points,
+            AnnotationContour.rle
+        ).order_by(AnnotationContour.annotation_id, AnnotationContour.position)
+        if topic_id is not None:
+            query = query.filter(AnnotationContour.annotation_id.in_(
+                _image_query(topic_id).with_entities(ImageAnnotation.id)))
+        for contour_id, annotation_id, label, label_id, bx, by, bw, bh, area, points, rle in \
+                query.yield_per(_BATCH_SIZE * 2):
+            if label_id is None and label is not None:
+                label_id = categories.get(AnnotationLabel.normalize(label))
+            rle = json.loads(rle) if rle else None
+            bbox = [bx, by, bw, bh]
+            if bx is None or area is None:
+                computed_bbox, computed_area = _bbox_and_area(points, rle)
+                bbox = computed_bbox if bx is None else bbox
+                area = computed_area if area is None else area
+            item = {
+                'id': contour_id,
+                'image_id': annotation_id,
+                'category_id': label_id if label_id is not None else unlabeled_category_id,
+                'bbox': bbox,
+                'area': area,
+                'iscrowd': 0,
+                'attributes': {'source': 'reference'}
+            }
+            if rle:
+                item['segmentation'] = rle
+                item['iscrowd'] = 1
+            else:
+                item['segmentation'] = [[round(float(v), 2) for v in
+                                         AnnotationContour.unpack_points(points).reshape(-1)]]
+            yield item
+
+    # ID контуров студентов продолжают последовательность ID эталонных контуров
+    next_id = (db.session.query(db.func.max(AnnotationContour.id)).scalar() or 0) + 1
+
+    @lru_cache(maxsize=1024)
+    def question_image(question_id):
+        question = db.session.get(Question, question_id)
+        if question is None or question.image_annotation is None:
+            return None
+        if topic_id is not None and question.topic_id != topic_id:
+            return None
+        if answers_creator_id is not None and question.creator_id != answers_creator_id:
+            return None
+        annotation = question.image_annotation
+        return annotation.id, image_size(annotation.image_file)
+
+    def student_annotations():
+        nonlocal next_id
+        # Отбор в SQL: только результаты с ответами на графические вопросы (в области видимости)
+        results = graphic_results_query(answers_creator_id).yield_per(_BATCH_SIZE)
+        for question_id, result, contours in iter_graphic_answers(results):
+            target = question_image(question_id)
+            if target is None or not isinstance(contours, list):
+                continue
+            image_id, size = target
+            # Контуры рисуются на холсте, в который изображение вписано с растяжением
+            scale_x = size[0] / canvas_w if size else 1.0
+            scale_y = size[1] / canvas_h if size else 1.0
+            for contour in contours:
+                points = contour.get('points') if isinstance(contour, dict) else None
+                if not points or len(points) < 3:
+                    continue
+                try:
+                    xs = [float(p['x']) * scale_x for p in points]
+                    ys = [float(p['y']) * scale_y for p in points]
+                except (KeyError, TypeError, ValueError):
+                    continue
+                area = 0.5 * abs(sum(xs[i] * ys[i - 1] - xs[i - 1] * ys[i] for i in range(len(xs))))
+                if answers_creator_id is None:
+                    attributes = {'source': 'student', 'result_id': result.id, 'user_id': result.user_id}
+                else:
+                    attributes = {'source': 'student', 'student': _student_pseudonym(result.user_id)}
+                attributes.update(question_id=question_id, label=contour.get('label'))
+                yield {
+                    'id': next_id,
+                    'image_id': image_id,
+                    'category_id': student_category_id,
+                    'segmentation': [[round(v, 2) for pair in zip(xs, ys) for v in pair]],
+                    'bbox': [min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys)],
+                    'area': area,
+                    'iscrowd': 0,
+                    'attributes': attributes
+                }
+                next_id += 1
+
+    def all_annotations():
+        yield from reference_annotations()
+        if include_answers:
+            yield from student_annotations()
+
+    yield from _iter_array(all_annotations())
+    yield ']}'
+
+
+class _StreamBuffer:
+    """Приёмник для zipfile без поддержки seek: накопленные байты забираются генератором"""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def iter_coco_archive(include_answers=False, topic_id=None, answers_creator_id=None):
+    """
+    Генератор ZIP-архива: annotations.coco.json и изображения банка
+
+    Args:
+        include_answers (bool): Добавить контуры студентов из answers_json
+        topic_id (int): Только изображения вопросов темы
+        answers_creator_id (int): Только ответы на вопросы этого создателя (см. iter_coco_export)
+
+    Yields:
+        bytes: Очередной фрагмент архива
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        with archive.open('annotations.coco.json', 'w', force_zip64=True) as entry:
+            for part in iter_coco_export(include_answers, topic_id, for_archive=True,
+                                         answers_creator_id=answers_creator_id):
+                entry.write(part.encode('utf-8'))
+                data = buffer.drain()
+                if data:
+                    yield data
+
+        for annotation in _image_query(topic_id).yield_per(_BATCH_SIZE):
+            key = storage_key('images', annotation.image_file)
+            if not storage.exists(key):
+                logger.warning(f"Экспорт COCO: файл изображения не найден: {key}")
+                continue
+            # Изображения уже сжаты — сохраняются без повторного сжатия
+            info = zipfile.ZipInfo(_archive_name(annotation), date_time=datetime.utcnow().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            with archive.open(info, 'w', force_zip64=True) as entry:
+                for block in storage.stream(key, _COPY_CHUNK_SIZE):
+                    entry.write(block)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+    yield buffer.drain()
@@ -0,0 +1,147 @@
+# app/utils/coco_stream.py
+"""
+Потоковый разбор файлов аннотаций COCO
+Содержит инкрементальный парсер JSON, который перебирает элементы массивов
+images, categories и annotations без загрузки всего документа в память
+"""
+import json
+import os
+
+from config import Config
+
+_WHITESPACE = ' \t\n\r'
+
+
+class _JsonStreamReader:
+    """
+    Буферизованный читатель JSON-документа верхнего уровня
+
+    Документ читается блоками; каждое значение декодируется через
+    json.JSONDecoder.raw_decode, а прочитанная часть буфера отбрасывается,
+    поэтому память ограничена размером блока и самого крупного элемента.
+    """
+
+    def __init__(self, fileobj, chunk_size):
+        self._file = fileobj
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size=None):
+        """Дочитывание очередного блока в буфер; возвращает False при конце файла"""
+        if self._eof:
+            return False
+        if self._pos > self._chunk_size:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        data = self._file.read(size or self._chunk_size)
+        if not data:
+            self._eof = True
+            return False
+        self._buf += data
+        return True
+
+    def peek(self):
+        """Следующий значимый символ (после пробелов) или '' в конце файла"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        """Проверка и пропуск ожидаемого символа-разделителя"""
+        found = self.peek()
+        if found != char:
+            raise json.JSONDecodeError(f"Ожидался символ '{char}'", self._buf, self._pos)
+        self._pos += 1
+
+    def value(self):
+        """Декодирование одного JSON-значения начиная с текущей позиции"""
+        self.peek()
+        read_size = self._chunk_size
+        while True:
+            try:
+                obj, end = self._decoder.raw_decode(self._buf, self._pos)
+                # Число в самом конце буфера может быть обрезано — дочитываем
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            if not self._fill(read_size):
+                obj, end = self._decoder.raw_decode(self._buf, self._pos)
+                self._pos = end
+                return obj
+            # Растущий размер чтения, чтобы крупные элементы не разбирались квадратично
+            read_size *= 2
+
+
+def _iter_stream(path, sections, chunk_size):
+    """Потоковый обход документа COCO (см. iter_coco)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        reader = _JsonStreamReader(f, chunk_size)
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            key = reader.value()
+            reader.expect(':')
+            if key in sections and reader.peek() == '[':
+                reader.expect('[')
+                if reader.peek() != ']':
+                    while True:
+                        yield key, reader.value()
+                        if reader.peek() != ',':
+                            break
+                        reader.expect(',')
+                reader.expect(']')
+            else:
+                yield key, reader.value()
+            if reader.peek() != ',':
+                break
+            reader.expect(',')
+        reader.expect('}')
+
+
+def iter_coco(path, sections=('images', 'categories', 'annotations'), streaming=None):
+    """
+    Перебор содержимого COCO-файла без материализации всего документа
+
+    Для ключей из sections, значения которых являются массивами, выдаётся
+    по одному элементу массива; для прочих ключей верхнего уровня
+    (info, licenses, ...) — значение целиком.
+
+    Args:
+        path (str): Путь к файлу COCO JSON
+        sections (tuple): Ключи массивов, перебираемых поэлементно
+        streaming (bool): Принудительный выбор режима. Если None — потоковый
+            разбор включается для файлов больше COCO_STREAMING_THRESHOLD
+
+    Yields:
+        tuple: (ключ верхнего уровня, элемент массива или значение)
+
+    Raises:
+        FileNotFoundError: Если файл не найден
+        json.JSONDecodeError: Если файл не является корректным JSON
+    """
+    if streaming is None:
+        streaming = os.path.getsize(path) >= Config.COCO_STREAMING_THRESHOLD
+
+    if streaming:
+        yield from _iter_stream(path, set(sections), Config.COCO_STREAM_CHUNK_SIZE)
+        return
+
+    with open(path, 'r', encoding='utf-8') as f:
+        coco_data = json.load(f)
+    for key, value in coco_data.items():
+        if key in sections and isinstance(value, list):
+            for item in value:
+                yield key, item
+        else:
+            yield key, value
@@ -6,11 +6,27 @@
 import cv2
 import numpy as np
 from app.models.annotation import ImageAnnotation
-from app.utils.image_processing import process_coco_annotations
+from app.utils.image_processing import polygon_to_rle, rle_iou
 from config import Config
 import math
 import os
 
+def to_points_array(contour):
+    """
+    Приведение контура к массиву точек numpy
+
+    Args:
+        contour (list | np.ndarray): Контур в формате [(x1,y1), ...], [{'x': .., 'y': ..}, ...] или массив (N, 2)
+
+    Returns:
+        np.ndarray: Массив формы (N, 2), dtype float32
+    """
+    if isinstance(contour, np.ndarray):
+        return contour.astype(np.float32, copy=False).reshape(-1, 2)
+    if contour and isinstance(contour[0], dict):
+        return np.array([[p['x'], p['y']] for p in contour], dtype=np.float32)
+    return np.asarray(contour, dtype=np.float32).reshape(-1, 2)
+
 def calculate_iou(contour1, contour2):
     """
     Вычисление Intersection over Union между двумя контурами
@@ -23,19 +39,16 @@ def calculate_iou(contour1, contour2):
         float: Значение IoU (0.0 - 1.0)
     """
     # Создание бинарных масок
-    all_points = contour1 + contour2
-    max_x = max([point[0] for point in all_points])
-    max_y = max([point[1] for point in all_points])
+    contour1_np = np.round(to_points_array(contour1)).astype(np.int32)
+    contour2_np = np.round(to_points_array(contour2)).astype(np.int32)
+    max_x, max_y = np.vstack([contour1_np, contour2_np]).max(axis=0)
 
-    # Использование подходящего размера для маски с отступом
-    mask_size = (max(int(max_x) + 50, 512), max(int(max_y) + 50, 512))
+    # Использование подходящего размера для маски с отступом (строки — y, столбцы — x)
+    mask_size = (max(int(max_y) + 50, 512), max(int(max_x) + 50, 512))
     mask1 = np.zeros(mask_size, dtype=np.uint8)
     mask2 = np.zeros(mask_size, dtype=np.uint8)
 
     # Рисование контуров на масках
-    contour1_np = np.array(contour1, dtype=np.int32)
-    contour2_np = np.array(contour2, dtype=np.int32)
-
     cv2.fillPoly(mask1, [contour1_np], 255)
     cv2.fillPoly(mask2, [contour2_np], 255)
 
@@ -63,8 +76,8 @@ def calculate_chamfer_distance(contour1, contour2):
         float: Значение расстояния Чамфера
     """
     # Преобразование в массивы numpy
-    c1 = np.array(contour1, dtype=np.float32)
-    c2 = np.array(contour2, dtype=np.float32)
+    c1 = to_points_array(contour1)
+    c2 = to_points_array(contour2)
 
     # Вычисление расстояний от каждой точки контура1 до ближайшей точки контура2
     dists_1_to_2 = []
@@ -103,8 +116,8 @@ def calculate_hausdorff_distance(contour1, contour2):
         float: Значение расстояния Хаусдорфа
     """
     # Преобразование в массивы numpy
-    c1 = np.array(contour1, dtype=np.float32)
-    c2 = np.array(contour2, dtype=np.float32)
+    c1 = to_points_array(contour1)
+    c2 = to_points_array(contour2)
 
     # Вычисление направленного расстояния Хаусдорфа от c1 к c2
     hausdorff_1_to_2 = 0
@@ -131,7 +144,7 @@ def calculate_hausdorff_distance(contour1, contour2):
     # Возвращение максимального из двух направленных расстояний
     return max(hausdorff_1_to_2, hausdorff_2_to_1)
 
-def calculate_contour_metrics(contour1, contour2, expected_label=None, user_label=None):
+def calculate_contour_metrics(contour1, contour2, expected_label=None, user_label=None, reference_rle=None):
     """
     Вычисление нескольких метрик для сравнения двух контуров с дополнительным контекстом
 
@@ -140,17 +153,22 @@ def calculate_contour_metrics(contour1, contour2, expected_label=None, user_labe
         contour2 (list): Контур эталона
         expected_label (str): Ожидаемая метка
         user_label (str): Пользовательская метка
+        reference_rle (dict): Маска эталона в формате RLE (если есть, IoU считается по маске)
 
     Returns:
         dict: Словарь с вычисленными метриками
     """
-    iou = calculate_iou(contour1, contour2)
+    if reference_rle is not None:
+        height, width = reference_rle['size']
+        iou = rle_iou(polygon_to_rle(contour1, height, width), reference_rle)
+    else:
+        iou = calculate_iou(contour1, contour2)
     chamfer_dist = calculate_chamfer_distance(contour1, contour2)
     hausdorff_dist = calculate_hausdorff_distance(contour1, contour2)
 
     # Дополнительные метрики
-    c1 = np.array(contour1, dtype=np.float32)
-    c2 = np.array(contour2, dtype=np.float32)
+    c1 = to_points_array(contour1)
+    c2 = to_points_array(contour2)
 
     # Схожесть площадей
     area1 = cv2.contourArea(c1.astype(np.int32))
@@ -248,32 +266,26 @@ def evaluate_graphic_answer_with_metrics(question_id, user_contours):
         dict: Результаты оценки с метриками
     """
     from app.models.question import Question
-    from app import db
+    from app.utils.reference_geometry import get_reference_geometry
 
     question = Question.query.get(question_id)
     if not question:
         return {'error': 'Вопрос не найден'}
 
-    # Получение ID аннотации из поля correct_answer
-    try:
-        annotation_id = int(question.correct_answer)
-    except ValueError:
-        return {'error': 'Неверная ссылка на аннотацию'}
+    # ID аннотации: связь вопроса, а для старых записей — поле correct_answer
+    annotation_id = question.image_annotation_id
+    if annotation_id is None:
+        try:
+            annotation_id = int(question.correct_answer)
+        except (TypeError, ValueError):
+            return {'error': 'Неверная ссылка на аннотацию'}
 
     annotation = ImageAnnotation.query.get(annotation_id)
     if not annotation:
         return {'error': 'Аннотация не найдена'}
 
-    annotation_path = os.path.join(db.session.bind.url.database, 'app', 'static', 'uploads', annotation.annotation_file)
-
-    if annotation.format_type == 'coco':
-        correct_data = process_coco_annotations(annotation_path)
-    else:  # YOLO
-        image_path = os.path.join(db.session.bind.url.database, 'app', 'static', 'uploads', annotation.filename)
-        img = cv2.imread(image_path)
-        if img is None:
-            return {'error': 'Не удалось загрузить изображение'}
-        correct_data = process_yolo_annotations(annotation_path, img.shape)
+    # Эталонная геометрия хранится в БД; файл читается только для старых записей
+    correct_data = get_reference_geometry(annotation)
 
     if not correct_data:
         return {'error': 'Не удалось загрузить правильные ответы'}
@@ -297,7 +309,8 @@ def evaluate_graphic_answer_with_metrics(question_id, user_contours):
                     user_contour['points'],
                     correct_ann['contour'],
                     correct_ann['label'],
-                    user_label
+                    user_label,
+                    reference_rle=correct_ann.get('rle')
                 )
 
                 # Вычисление комплексного балла
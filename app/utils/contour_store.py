@@ -0,0 +1,337 @@
+# app/utils/contour_store.py
+"""
+Общее хранилище эталонных контуров на диске с доступом через mmap
+Содержит упакованный файл вершин и индексы со смещениями; воркеры открывают
+их через np.memmap, поэтому геометрия разделяется через page cache ОС
+без копирования в память каждого процесса
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# Запись контура: смещение и число вершин в points.bin, метка, bbox, площадь,
+# а также диапазон JSON маски RLE в rle.bin (rle_length = 0, если маски нет)
+CONTOUR_RECORD = np.dtype([
+    ('offset', '<i8'),
+    ('count', '<i4'),
+    ('label_id', '<i4'),
+    ('bbox', '<f4', (4,)),
+    ('area', '<f4'),
+    ('rle_offset', '<i8'),
+    ('rle_length', '<i4'),
+])
+
+# Запись аннотации: диапазон записей контуров (последняя запись для ID актуальна)
+ANNOTATION_RECORD = np.dtype([
+    ('annotation_id', '<i8'),
+    ('first', '<i8'),
+    ('count', '<i4'),
+])
+
+# Файлы поколения в порядке дозаписи; annotations.idx — commit-точка
+_STORE_FILES = ('labels.txt', 'rle.bin', 'points.bin', 'contours.idx', 'annotations.idx')
+
+
+@contextmanager
+def _exclusive_lock(path):
+    """Межпроцессная блокировка на время изменения хранилища"""
+    with open(path, 'a+b') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _open_memmap(path, dtype):
+    """Открытие файла как read-only np.memmap (пустой файл — пустой массив)"""
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    count = size // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+def _file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _normalize_label(label):
+    """Метка хранится построчно в labels.txt, поэтому переводы строк заменяются пробелами"""
+    if label is None:
+        return None
+    return str(label).replace('\r', ' ').replace('\n', ' ')
+
+
+class ContourStore:
+    """
+    Хранилище эталонных контуров с дозаписью и чтением через mmap
+
+    Данные лежат в каталоге поколения (gen-<N>), имя текущего поколения
+    записано в файле CURRENT. Дозапись идёт в текущее поколение, перестройка
+    создаёт новое и атомарно переключает CURRENT.
+
+    Файлы поколения:
+        labels.txt — словарь меток (номер строки — label_id)
+        rle.bin — JSON масок RLE подряд
+        points.bin — вершины всех контуров подряд (float32 x, y)
+        contours.idx — записи CONTOUR_RECORD
+        annotations.idx — записи ANNOTATION_RECORD
+
+    Attributes:
+        folder (str): Корневой каталог хранилища
+    """
+
+    def __init__(self, folder=None):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._signature_cache = None
+        self._generation = None
+        self._rle = None
+        self._points = None
+        self._contours = None
+        self._annotations = None
+        self._annotations_sorted = True
+        self._labels = []
+        self._label_ids = {}
+
+    def _current_generation(self):
+        try:
+            with open(os.path.join(self.folder, 'CURRENT'), 'r', encoding='utf-8') as f:
+                return f.read().strip() or 'gen-0'
+        except OSError:
+            return 'gen-0'
+
+    def _path(self, name, generation=None):
+        return os.path.join(self.folder, generation or self._generation or self._current_generation(), name)
+
+    def _signature(self, generation):
+        """Поколение, размеры и время изменения файлов (меняются при дозаписи)"""
+        signature = [generation]
+        for name in _STORE_FILES:
+            try:
+                stat = os.stat(self._path(name, generation))
+                signature.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                signature.append((0, 0))
+        return tuple(signature)
+
+    def _refresh(self):
+        """Переоткрытие отображений, если хранилище было дописано или перестроено"""
+        generation = self._current_generation()
+        signature = self._signature(generation)
+        if signature == self._signature_cache:
+            return
+        # Порядок открытия обратен порядку записи в append: любая видимая запись
+        # аннотации гарантированно ссылается на уже записанные контуры и вершины
+        self._annotations = _open_memmap(self._path('annotations.idx', generation), ANNOTATION_RECORD)
+        self._contours = _open_memmap(self._path('contours.idx', generation), CONTOUR_RECORD)
+        self._points = _open_memmap(self._path('points.bin', generation), np.dtype('<f4'))
+        self._rle = _open_memmap(self._path('rle.bin', generation), np.dtype('u1'))
+        ids = self._annotations['annotation_id']
+        self._annotations_sorted = bool(len(ids) < 2 or np.all(ids[1:] >= ids[:-1]))
+        self._labels = []
+        if os.path.exists(self._path('labels.txt', generation)):
+            with open(self._path('labels.txt', generation), 'r', encoding='utf-8') as f:
+                self._labels = [line.rstrip('\n') for line in f]
+        self._label_ids = {label: i for i, label in enumerate(self._labels)}
+        self._generation = generation
+        self._signature_cache = signature
+
+    def _find(self, annotation_id):
+        """Поиск последней записи аннотации в индексе"""
+        ids = self._annotations['annotation_id']
+        if self._annotations_sorted:
+            pos = int(np.searchsorted(ids, annotation_id, side='right')) - 1
+            if pos >= 0 and ids[pos] == annotation_id:
+                return self._annotations[pos]
+            return None
+        matches = np.flatnonzero(ids == annotation_id)
+        return self._annotations[matches[-1]] if len(matches) else None
+
+    def get(self, annotation_id):
+        """
+        Чтение эталонных контуров аннотации
+
+        Args:
+            annotation_id (int): ID аннотации изображения
+
+        Returns:
+            dict: {'labels': [...], 'annotations': [{'label', 'contour', 'bbox'[, 'rle']}, ...]}
+                с контурами-представлениями np.memmap (без копирования) или None
+        """
+        if not self.folder:
+            return None
+        with self._lock:
+            self._refresh()
+            entry = self._find(int(annotation_id))
+            if entry is None or entry['count'] <= 0:
+                return None
+            first = int(entry['first'])
+            records = self._contours[first:first + int(entry['count'])]
+            points = self._points
+            rle_bytes = self._rle
+            labels_table = self._labels
+
+        labels = []
+        annotations = []
+        for record in records:
+            label = labels_table[record['label_id']] if record['label_id'] >= 0 else None
+            if label not in labels:
+                labels.append(label)
+            start = int(record['offset']) * 2
+            ann = {
+                'label': label,
+                'contour': points[start:start + int(record['count']) * 2].reshape(-1, 2),
+                'bbox': [float(v) for v in record['bbox']]
+            }
+            if record['rle_length'] > 0:
+                rle_start = int(record['rle_offset'])
+                ann['rle'] = json.loads(rle_bytes[rle_start:rle_start + int(record['rle_length'])].tobytes())
+            annotations.append(ann)
+        return {'labels': labels, 'annotations': annotations}
+
+    def append(self, annotation_id, contours):
+        """
+        Дозапись контуров аннотации (заменяет предыдущую версию для того же ID)
+
+        Args:
+            annotation_id (int): ID аннотации изображения
+            contours (list): [{'label', 'contour', 'bbox', 'area'[, 'rle']}, ...];
+                пустой список помечает аннотацию как удалённую
+        """
+        if not self.folder:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+
+        with _exclusive_lock(os.path.join(self.folder, 'store.lock')), self._lock:
+            self._refresh()
+            self._append_locked(self._generation, annotation_id, contours)
+
+    def _append_locked(self, generation, annotation_id, contours):
+        """Дозапись в указанное поколение (под блокировкой)"""
+        os.makedirs(os.path.join(self.folder, generation), exist_ok=True)
+        new_labels = []
+        label_ids = dict(self._label_ids)
+        for contour in contours:
+            label = _normalize_label(contour.get('label'))
+            if label is not None and label not in label_ids:
+                label_ids[label] = len(label_ids)
+                new_labels.append(label)
+
+        offset = _file_size(self._path('points.bin', generation)) // 8
+        rle_offset = _file_size(self._path('rle.bin', generation))
+        first = _file_size(self._path('contours.idx', generation)) // CONTOUR_RECORD.itemsize
+
+        records = np.zeros(len(contours), dtype=CONTOUR_RECORD)
+        point_chunks = []
+        rle_chunks = []
+        for i, contour in enumerate(contours):
+            points = np.ascontiguousarray(contour['contour'], dtype='<f4').reshape(-1, 2)
+            rle_blob = json.dumps(contour['rle'], separators=(',', ':')).encode('utf-8') \
+                if contour.get('rle') else b''
+            records[i] = (offset, len(points), label_ids.get(_normalize_label(contour.get('label')), -1),
+                          contour['bbox'], contour.get('area') or 0.0,
+                          rle_offset if rle_blob else 0, len(rle_blob))
+            offset += len(points)
+            rle_offset += len(rle_blob)
+            point_chunks.append(points.tobytes())
+            rle_chunks.append(rle_blob)
+
+        if new_labels:
+            with open(self._path('labels.txt', generation), 'a', encoding='utf-8') as f:
+                f.write(''.join(f"{label}\n" for label in new_labels))
+            self._label_ids = label_ids
+        with open(self._path('rle.bin', generation), 'ab') as f:
+            f.write(b''.join(rle_chunks))
+        with open(self._path('points.bin', generation), 'ab') as f:
+            f.write(b''.join(point_chunks))
+        with open(self._path('contours.idx', generation), 'ab') as f:
+            f.write(records.tobytes())
+        # Запись аннотации последней: до неё новые данные невидимы читателям
+        entry = np.array([(annotation_id, first, len(contours))], dtype=ANNOTATION_RECORD)
+        with open(self._path('annotations.idx', generation), 'ab') as f:
+            f.write(entry.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self, annotation_id):
+        """Пометка аннотации как удалённой"""
+        self.append(annotation_id, [])
+
+    def rebuild(self, items):
+        """
+        Полная перестройка хранилища в новое поколение (сжатие устаревших версий)
+
+        Пары читаются потоково и не собираются в памяти, поэтому должны идти по
+        возрастанию annotation_id (например, из запроса с ORDER BY annotation_id):
+        тогда индекс аннотаций отсортирован и поиск в нём двоичный.
+
+        Args:
+            items (iterable): Пары (annotation_id, contours) в формате append
+        """
+        if not self.folder:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+
+        with _exclusive_lock(os.path.join(self.folder, 'store.lock')), self._lock:
+            old_generation = self._current_generation()
+            new_generation = f"gen-{int(old_generation.rsplit('-', 1)[-1]) + 1}"
+            new_dir = os.path.join(self.folder, new_generation)
+            if os.path.isdir(new_dir):
+                shutil.rmtree(new_dir)
+
+            self._label_ids = {}
+            for annotation_id, contours in items:
+                self._append_locked(new_generation, annotation_id, contours)
+
+            # Атомарное переключение поколения для всех процессов
+            tmp_current = os.path.join(self.folder, 'CURRENT.tmp')
+            with open(tmp_current, 'w', encoding='utf-8') as f:
+                f.write(new_generation)
+            os.replace(tmp_current, os.path.join(self.folder, 'CURRENT'))
+            self._signature_cache = None
+            self._refresh()
+
+            # Открытые отображения старого поколения остаются валидными (POSIX)
+            shutil.rmtree(os.path.join(self.folder, old_generation), ignore_errors=True)
+
+    def stats(self):
+        """Текущее поколение, размеры файлов и количество записей"""
+        if not self.folder:
+            return {}
+        with self._lock:
+            self._refresh()
+            return {
+                'generation': self._generation,
+                'annotations': int(len(self._annotations)),
+                'contours': int(len(self._contours)),
+                'points': int(len(self._points) // 2),
+                'labels': len(self._labels),
+                'bytes': int(sum(size for size, _ in self._signature_cache[1:]))
+            }
+
+
+# Хранилище уровня процесса (каталог задаётся в create_app из конфигурации)
+contour_store = ContourStore()
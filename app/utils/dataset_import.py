@@ -0,0 +1,321 @@
+# app/utils/dataset_import.py
+"""
+Массовый импорт набора данных (ZIP с изображениями и одним файлом COCO)
+Архив читается потоково, аннотации разбиваются по изображениям за один
+проход, записи ImageAnnotation и Question создаются пакетными вставками
+в отдельных транзакциях; прогресс сохраняется в задаче, что позволяет
+продолжить прерванный импорт с последнего зафиксированного пакета
+"""
+import logging
+import os
+import shutil
+import string
+import uuid
+import zipfile
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import insert
+
+from app import db
+from app.models.question import Question
+from app.models.annotation import ImageAnnotation
+from app.models.test_topics import TestTopic
+from app.utils.chunked_upload import claim_upload, ChunkedUploadError
+from app.utils.background_jobs import (create_job, submit_job, job_handler, update_job, run_side_task,
+                                      job_is_stale, requeue_job)
+from app.utils.image_derivatives import generate_image_derivatives
+from app.utils.image_hashing import record_image_phash, find_duplicate_images
+from app.utils.image_processing import split_coco_by_image
+from app.utils.image_tiles import generate_image_tiles
+from app.utils.question_stats import adjust_question_counts
+from app.utils.reference_geometry import store_reference_geometry, publish_reference_geometry, parse_annotation_file
+from app.utils.storage import storage, storage_key
+from app.utils.upload_storage import store_stream
+
+logger = logging.getLogger(__name__)
+
+# Предпочтительное имя файла аннотаций в экспорте Roboflow
+_PREFERRED_COCO_NAME = '_annotations.coco.json'
+
+# Поля, доступные в шаблоне текста вопроса
+_TEMPLATE_FIELDS = ('labels', 'image')
+
+
+class DatasetImportError(Exception):
+    """Ошибка импорта набора данных с сообщением для пользователя"""
+
+
+def parse_topic_mapping(text):
+    """
+    Разбор соответствия категорий COCO темам вопросов
+
+    Формат: по одной паре на строку "категория = тема", где тема — ID или
+    название существующей темы.
+
+    Args:
+        text (str): Текст соответствия из формы
+
+    Returns:
+        dict: {название категории: ID темы}
+
+    Raises:
+        DatasetImportError: Если тема не найдена или строка некорректна
+    """
+    mapping = {}
+    if not text:
+        return mapping
+
+    topics_by_name = {topic.name.strip().lower(): topic.id for topic in TestTopic.query.all()}
+    topic_ids = set(topics_by_name.values())
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if '=' not in line:
+            raise DatasetImportError(f'Строка {line_no}: ожидается формат "категория = тема"')
+        category, topic = (part.strip() for part in line.split('=', 1))
+        if topic.isdigit() and int(topic) in topic_ids:
+            mapping[category] = int(topic)
+        elif topic.lower() in topics_by_name:
+            mapping[category] = topics_by_name[topic.lower()]
+        else:
+            raise DatasetImportError(f'Строка {line_no}: тема "{topic}" не найдена')
+    return mapping
+
+
+def validate_question_template(template):
+    """
+    Проверка шаблона текста вопроса до запуска импорта: допускаются только
+    поля {labels} и {image} (без обращения к атрибутам и индексам), шаблон
+    должен успешно форматироваться на пробных значениях
+
+    Raises:
+        DatasetImportError: Если шаблон некорректен
+    """
+    try:
+        for _literal, field_name, _spec, _conversion in string.Formatter().parse(template):
+            if field_name is not None and field_name not in _TEMPLATE_FIELDS:
+                raise DatasetImportError(f'Шаблон вопроса: неизвестное поле {{{field_name}}}, '
+                                         f'допустимы {{labels}} и {{image}}')
+        _question_text(template, ['label'], 'image.jpg')
+    except (KeyError, IndexError, ValueError, TypeError) as e:
+        raise DatasetImportError(f'Шаблон вопроса некорректен: {e}')
+
+
+def start_dataset_import(archive_file, default_topic_id, creator_id, topic_mapping=None, question_template=None,
+                         upload_id=None):
+    """
+    Сохранение архива и постановка задачи импорта в пул воркеров
+
+    Архив больше MAX_CONTENT_LENGTH загружается поблочно (сессия типа
+    'archive'): собранный файл уже лежит в папке imports и передаётся upload_id.
+
+    Args:
+        archive_file (FileStorage): ZIP-архив набора данных (если нет upload_id)
+        default_topic_id (int): Тема для изображений без сопоставленной категории
+        creator_id (int): ID преподавателя
+        topic_mapping (dict): {категория: ID темы}
+        question_template (str): Шаблон текста вопроса ({labels}, {image})
+        upload_id (str): Токен завершённой поблочной загрузки архива
+
+    Returns:
+        BackgroundJob: Задача импорта
+
+    Raises:
+        DatasetImportError: Если шаблон вопроса некорректен или файл не является ZIP-архивом
+    """
+    question_template = question_template or current_app.config['DATASET_IMPORT_QUESTION_TEMPLATE']
+    validate_question_template(question_template)
+
+    import_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'imports')
+    os.makedirs(import_dir, exist_ok=True)
+    if upload_id:
+        try:
+            _source_name, stored_file = claim_upload(upload_id, creator_id, 'archive')
+        except ChunkedUploadError as e:
+            raise DatasetImportError(str(e)) from e
+        token = os.path.splitext(stored_file)[0]
+        archive_path = os.path.join(import_dir, stored_file)
+    else:
+        token = uuid.uuid4().hex[:8]
+        archive_path = os.path.join(import_dir, f"{token}.zip")
+        archive_file.save(archive_path)
+
+    if not zipfile.is_zipfile(archive_path):
+        os.remove(archive_path)
+        db.session.commit()  # удаление сессии загрузки вместе с файлом
+        raise DatasetImportError('Файл не является ZIP-архивом')
+
+    params = {
+        'archive': archive_path,
+        'token': token,
+        'default_topic_id': default_topic_id,
+        'topic_mapping': topic_mapping or {},
+        'question_template': question_template
+    }
+    job = create_job('dataset_import', params=params, creator_id=creator_id)
+    submit_job(job)
+    return job
+
+
+def resume_dataset_import(job):
+    """
+    Повторная постановка прерванного импорта (продолжается с job.processed):
+    только завершившегося ошибкой или зависшего
+
+    Returns:
+        bool: True, если задача поставлена в очередь
+    """
+    if job.kind != 'dataset_import' or not (job.status == 'failed' or job_is_stale(job)) or \
+            not os.path.exists(job.params.get('archive', '')):
+        return False
+    return requeue_job(job, message='Импорт возобновлён')
+
+
+def _image_entries(archive, allowed_ext):
+    """Изображения архива, упорядоченные по имени (порядок нужен для возобновления)"""
+    entries = {}
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        name = os.path.basename(info.filename)
+        if '.' in name and name.rsplit('.', 1)[1].lower() in allowed_ext and not name.startswith('.'):
+            entries.setdefault(name, info)
+    return [entries[name] for name in sorted(entries)]
+
+
+def _find_coco_entry(archive):
+    """Файл COCO в архиве: _annotations.coco.json или единственный .json"""
+    candidates = [info for info in archive.infolist()
+                  if not info.is_dir() and info.filename.lower().endswith('.json')]
+    for info in candidates:
+        if os.path.basename(info.filename) == _PREFERRED_COCO_NAME:
+            return info
+    if len(candidates) != 1:
+        raise DatasetImportError('В архиве должен быть ровно один файл аннотаций COCO (.json)')
+    return candidates[0]
+
+
+def _question_text(template, labels, image_name):
+    return template.format(labels=', '.join(str(label) for label in labels) or '—', image=image_name)
+
+
+@job_handler('dataset_import')
+def run_dataset_import(job):
+    """
+    Этапы импорта: extract (файл COCO), split (разбиение по изображениям за
+    один проход), import (изображения, геометрия и вопросы пакетами)
+
+    Args:
+        job (BackgroundJob): Задача импорта
+
+    Returns:
+        dict: {'images', 'questions', 'skipped'[, 'duplicates']}
+    """
+    params = job.params
+    config = current_app.config
+    upload_folder = config['UPLOAD_FOLDER']
+    batch_size = config.get('DATASET_IMPORT_BATCH_SIZE', 50)
+    max_image_bytes = config.get('DATASET_IMPORT_MAX_IMAGE_BYTES')
+    allowed_ext = set(config.get('ALLOWED_IMAGE_EXTENSIONS', {'png', 'jpg', 'jpeg'}))
+    topic_mapping = params.get('topic_mapping') or {}
+    start = job.processed or 0
+    result = job.result or {'images': 0, 'questions': 0, 'skipped': []}
+
+    with zipfile.ZipFile(params['archive']) as archive:
+        # extract: файл COCO копируется из архива потоково
+        update_job(job, stage='extract')
+        coco_entry = _find_coco_entry(archive)
+        coco_path = os.path.join(os.path.dirname(params['archive']), f"{params['token']}.json")
+        if not os.path.exists(coco_path):
+            with archive.open(coco_entry) as src, open(coco_path + '.tmp', 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(coco_path + '.tmp', coco_path)
+
+        entries = _image_entries(archive, allowed_ext)
+        if not entries:
+            raise DatasetImportError('В архиве нет изображений')
+
+        # split: один проход по COCO; имена файлов детерминированы токеном задачи
+        update_job(job, stage='split', total=len(entries))
+        success, split = split_coco_by_image(
+            coco_path, output_dir=os.path.join(upload_folder, 'annotations'),
+            unique_id=params['token'], image_filenames=[os.path.basename(e.filename) for e in entries])
+        if not success:
+            raise DatasetImportError(split)
+
+        update_job(job, stage='import', processed=start)
+        for batch_start in range(start, len(entries), batch_size):
+            batch = entries[batch_start:batch_start + batch_size]
+            annotations = []
+            pending = []
+            for info in batch:
+                image_name = os.path.basename(info.filename)
+                annotation_filename = split.get(image_name)
+                if annotation_filename is None:
+                    result['skipped'].append(image_name)
+                    continue
+                if max_image_bytes and info.file_size > max_image_bytes:
+                    result['skipped'].append(image_name)
+                    continue
+
+                with archive.open(info) as src:
+                    image_filename, _existed = store_stream(src, upload_folder, 'images',
+                                                            os.path.splitext(image_name)[1])
+                image_path = storage.fetch(storage_key('images', image_filename))
+                # Файлы аннотаций разбиты в локальной копии; в хранилище попадают только используемые
+                annotation_key = storage_key('annotations', annotation_filename)
+                storage.publish(annotation_key)
+                processed_data = parse_annotation_file(storage.local_path(annotation_key), 'coco', image_path)
+                if not processed_data or not processed_data.get('annotations'):
+                    result['skipped'].append(image_name)
+                    continue
+
+                annotation = ImageAnnotation(image_file=image_filename,
+                                             annotation_file=annotation_filename, format_type='coco')
+                store_reference_geometry(annotation, processed_data)
+                duplicates = find_duplicate_images(record_image_phash(annotation, image_path), limit=1)
+                if duplicates:
+                    result.setdefault('duplicates', []).append({
+                        'image': image_name, 'annotation_id': duplicates[0][0], 'distance': duplicates[0][1]})
+                annotations.append(annotation)
+                labels = list(processed_data.get('labels', []))
+                topic_id = next((topic_mapping[label] for label in labels if label in topic_mapping),
+                                params['default_topic_id'])
+                pending.append((annotation, processed_data, labels, topic_id, image_name))
+
+            # Пакет: аннотации с контурами и вопросы в одной транзакции с отметкой прогресса
+            db.session.add_all(annotations)
+            db.session.flush()
+            if pending:
+                db.session.execute(insert(Question), [{
+                    'question_text': _question_text(params['question_template'], labels, image_name),
+                    'question_type': 'graphic',
+                    'image_annotation_id': annotation.id,
+                    'topic_id': topic_id,
+                    'creator_id': job.creator_id
+                } for annotation, _data, labels, topic_id, image_name in pending])
+                adjust_question_counts(Counter((topic_id, 'graphic', job.creator_id)
+                                               for _annotation, _data, _labels, topic_id, _name in pending))
+
+            result['images'] += len(pending)
+            result['questions'] += len(pending)
+            job.result = result
+            update_job(job, processed=batch_start + len(batch))  # commit пакета
+
+            for annotation, processed_data, _labels, _topic, _name in pending:
+                publish_reference_geometry(annotation.id, processed_data)
+            futures = [run_side_task(generate, upload_folder, annotation.image_file)
+                       for annotation in annotations
+                       for generate in (generate_image_derivatives, generate_image_tiles)]
+            for future in futures:
+                future.exception()
+
+    # Временные файлы удаляются только после полного импорта (для возобновления)
+    for path in (params['archive'], coco_path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return result
@@ -0,0 +1,83 @@
+# app/utils/eager_loading.py
+"""
+Политика загрузки связей для страниц преподавателя и базы данных
+Связи, которые нужны при отрисовке списков, загружаются заранее (joinedload
+для связей «многие к одному», contains_eager — если таблица уже присоединена
+для сортировки), а выборки по спискам ID делаются одним запросом IN с
+восстановлением порядка. Число запросов страницы не зависит от её размера
+"""
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import contains_eager, joinedload
+
+from app import db
+from app.models.annotation import TestResult
+from app.models.question import Question
+
+
+def question_list_options(topic_joined=False):
+    """
+    Опции загрузки вопросов для списков: создатель, тема и аннотация изображения
+
+    Args:
+        topic_joined (bool): Таблица тем уже присоединена в запросе (сортировка по теме)
+
+    Returns:
+        list: Опции для Query.options
+    """
+    return [
+        joinedload(Question.creator),
+        joinedload(Question.image_annotation),
+        contains_eager(Question.topic) if topic_joined else joinedload(Question.topic),
+    ]
+
+
+def result_list_options():
+    """Опции загрузки результатов тестов для списков: пользователь"""
+    return [joinedload(TestResult.user)]
+
+
+def fetch_ordered(model, ids, *options):
+    """
+    Записи по списку ID одним запросом IN в порядке ids
+
+    Args:
+        model: Модель SQLAlchemy с первичным ключом id
+        ids (list): ID в нужном порядке (повторы допускаются)
+        options: Опции загрузки связей
+
+    Returns:
+        list: Найденные записи в порядке ids (отсутствующие пропускаются)
+    """
+    if not ids:
+        return []
+    found = {obj.id: obj for obj in model.query.options(*options).filter(model.id.in_(set(ids)))}
+    return [found[obj_id] for obj_id in ids if obj_id in found]
+
+
+def question_examples(keys, limit=3):
+    """
+    Первые limit вопросов для каждой пары (тема, тип) одним запросом
+    (нумерация строк внутри пары оконной функцией)
+
+    Args:
+        keys (iterable): Пары (ID темы, тип вопроса)
+        limit (int): Вопросов на пару
+
+    Returns:
+        dict: {(ID темы, тип вопроса): [Question, ...]} в порядке ID
+    """
+    keys = sorted(set(keys))
+    examples = {key: [] for key in keys}
+    if not keys:
+        return examples
+
+    row_number = func.row_number().over(partition_by=(Question.topic_id, Question.question_type),
+                                        order_by=Question.id).label('row_number')
+    ranked = db.session.query(Question.id, row_number) \
+        .filter(tuple_(Question.topic_id, Question.question_type).in_(keys)).subquery()
+    questions = Question.query.join(ranked, ranked.c.id == Question.id) \
+        .filter(ranked.c.row_number <= limit) \
+        .order_by(Question.id)
+    for question in questions:
+        examples[(question.topic_id, question.question_type)].append(question)
+    return examples
@@ -0,0 +1,155 @@
+# app/utils/image_derivatives.py
+"""
+Производные версии загруженных изображений
+Содержит генерацию уменьшенных копий (под холст, миниатюра, 2x) при загрузке
+и их поиск при выдаче через маршрут main.uploaded_file. Производные
+кодируются в локальной копии и передаются в хранилище загрузок
+"""
+import logging
+import os
+
+import cv2
+import numpy as np
+from flask import current_app
+
+from app.utils.storage import storage, storage_key
+
+logger = logging.getLogger(__name__)
+
+# Кодеки OpenCV для поддерживаемых форматов производных
+_ENCODE_PARAMS = {
+    'webp': lambda quality: [cv2.IMWRITE_WEBP_QUALITY, quality],
+    'jpg': lambda quality: [cv2.IMWRITE_JPEG_QUALITY, quality],
+}
+
+
+def _derivative_settings():
+    """Размеры, формат и качество производных из конфигурации приложения"""
+    config = current_app.config
+    return (config.get('IMAGE_DERIVATIVES', {}),
+            config.get('IMAGE_DERIVATIVE_FORMAT', 'webp'),
+            config.get('IMAGE_DERIVATIVE_QUALITY', 80))
+
+
+def derivative_filename(filename, fmt=None):
+    """Имя файла производной: исходное имя без расширения + формат производных"""
+    fmt = fmt or _derivative_settings()[1]
+    return f"{os.path.splitext(filename)[0]}.{fmt}"
+
+
+def derivative_key(filename, size):
+    """Ключ производной изображения указанного размера в хранилище"""
+    return storage_key('derived', f"{size}/{derivative_filename(filename)}")
+
+
+def derivative_path(upload_folder, filename, size):
+    """Путь к локальной копии производной изображения указанного размера"""
+    return os.path.join(upload_folder, 'derived', size, derivative_filename(filename))
+
+
+def _target_size(image_shape, spec):
+    """
+    Итоговый размер производной (ширина, высота)
+
+    Версии под холст растягиваются до размера холста так же, как это делает
+    drawImage в браузере; миниатюры вписываются с сохранением пропорций.
+    Увеличение исходника не выполняется.
+    """
+    height, width = image_shape[:2]
+    target_w, target_h = spec['size']
+    if spec.get('keep_aspect'):
+        scale = min(target_w / width, target_h / height, 1.0)
+        return max(1, round(width * scale)), max(1, round(height * scale))
+    return min(target_w, width), min(target_h, height)
+
+
+def _write_derivative(image, spec, key, path, fmt, quality):
+    """Масштабирование, атомарная запись одной производной и передача в хранилище"""
+    target_w, target_h = _target_size(image.shape, spec)
+    if (target_w, target_h) != (image.shape[1], image.shape[0]):
+        image = cv2.resize(image, (target_w, target_h), interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(f'.{fmt}', image, _ENCODE_PARAMS[fmt](quality))
+    if not ok:
+        raise ValueError(f"Не удалось закодировать производную в формат {fmt}")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(encoded.tobytes())
+    storage.put_file(key, tmp_path)
+
+
+def _read_image(image_path):
+    """Декодирование изображения (np.fromfile — для путей с не-ASCII символами)"""
+    data = np.fromfile(image_path, dtype=np.uint8)
+    return cv2.imdecode(data, cv2.IMREAD_COLOR) if data.size else None
+
+
+def generate_image_derivatives(upload_folder, filename, sizes=None):
+    """
+    Генерация производных изображения (исходник декодируется один раз)
+
+    Args:
+        upload_folder (str): Корневая папка загрузок
+        filename (str): Имя файла в папке images
+        sizes (list): Имена размеров из IMAGE_DERIVATIVES (по умолчанию — все)
+
+    Returns:
+        dict: {имя размера: путь к файлу производной}
+    """
+    derivatives, fmt, quality = _derivative_settings()
+    sizes = [size for size in (sizes or derivatives) if size in derivatives]
+    if not sizes:
+        return {}
+
+    original = storage.fetch(storage_key('images', filename))
+    image = _read_image(original) if original else None
+    if image is None:
+        logger.warning(f"Не удалось прочитать изображение '{filename}' для генерации производных")
+        return {}
+
+    result = {}
+    for size in sizes:
+        path = derivative_path(upload_folder, filename, size)
+        try:
+            _write_derivative(image, derivatives[size], derivative_key(filename, size), path, fmt, quality)
+            result[size] = path
+        except Exception as e:
+            logger.warning(f"Ошибка генерации производной '{size}' для '{filename}': {e}")
+    return result
+
+
+def ensure_image_derivative(upload_folder, filename, size):
+    """
+    Путь к производной изображения; отсутствующая производная (например, для
+    загруженных ранее изображений) создаётся при первом обращении
+
+    Args:
+        upload_folder (str): Корневая папка загрузок
+        filename (str): Имя файла в папке images
+        size (str): Имя размера из IMAGE_DERIVATIVES
+
+    Returns:
+        str: Путь к файлу производной или None, если её не удалось получить
+    """
+    path = storage.fetch(derivative_key(filename, size))
+    original = storage.local_path(storage_key('images', filename))
+    # Устаревшей производная может быть только для исходника, перезаписанного на месте
+    # в локальном хранилище; время изменения кэша удалённого хранилища ничего не говорит
+    if path and (not storage.is_local or not os.path.exists(original) or
+                 os.path.getmtime(path) >= os.path.getmtime(original)):
+        return path
+    if not storage.fetch(storage_key('images', filename)):
+        return None
+    return generate_image_derivatives(upload_folder, filename, [size]).get(size)
+
+
+def remove_image_derivatives(upload_folder, filename):
+    """Удаление всех производных изображения (при удалении исходника)"""
+    derivatives, _, _ = _derivative_settings()
+    for size in derivatives:
+        key = derivative_key(filename, size)
+        try:
+            storage.delete(key)
+        except Exception as e:
+            logger.warning(f"Не удалось удалить производную '{key}': {e}")
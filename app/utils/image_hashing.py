@@ -0,0 +1,208 @@
+# app/utils/image_hashing.py
+"""
+Перцептивное хеширование изображений и поиск почти-дубликатов
+Содержит 64-битный DCT-хеш (pHash) и индекс с поиском по расстоянию Хэмминга
+на основе multi-index hashing: хеш делится на 8 байтов, и по принципу
+Дирихле любой хеш на расстоянии < 8 совпадает с запросом хотя бы в одном байте
+"""
+import logging
+import threading
+
+import cv2
+import numpy as np
+from flask import current_app
+
+from app import db
+from app.models.annotation import ImagePerceptualHash
+
+logger = logging.getLogger(__name__)
+
+# Размер уменьшенного изображения для DCT и размер низкочастотного блока
+_DCT_SIZE = 32
+_HASH_SIZE = 8
+# Число фрагментов multi-index hashing (по 8 бит)
+_CHUNKS = 8
+
+
+def compute_phash(image):
+    """
+    Вычисление 64-битного перцептивного хеша (pHash)
+
+    Изображение приводится к 32x32 в оттенках серого, берётся блок 8x8
+    низких частот DCT; бит равен 1, если коэффициент больше медианы блока.
+    Хеш устойчив к масштабированию, перекодированию и небольшой коррекции цвета.
+
+    Args:
+        image (str | bytes | np.ndarray): Путь к файлу, содержимое файла или изображение (BGR/серое)
+
+    Returns:
+        int: Беззнаковый 64-битный хеш или None, если изображение не прочитано
+    """
+    if isinstance(image, (str, bytes)):
+        data = np.fromfile(image, dtype=np.uint8) if isinstance(image, str) else np.frombuffer(image, dtype=np.uint8)
+        # Уменьшенное декодирование JPEG заметно быстрее полного для больших снимков
+        image = cv2.imdecode(data, cv2.IMREAD_REDUCED_GRAYSCALE_4) if data.size else None
+    if image is None:
+        return None
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    small = cv2.resize(image, (_DCT_SIZE, _DCT_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    block = cv2.dct(small)[:_HASH_SIZE, :_HASH_SIZE].flatten()
+    median = np.median(block[1:])  # DC-коэффициент не учитывается в медиане
+    bits = block > median
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def hamming_distance(a, b):
+    """Расстояние Хэмминга между двумя 64-битными хешами"""
+    return bin(a ^ b).count('1')
+
+
+def _popcount64(values):
+    """Число единичных битов для массива uint64"""
+    bytes_view = values.view(np.uint8).reshape(-1, 8)
+    return np.unpackbits(bytes_view, axis=1).sum(axis=1)
+
+
+class PerceptualHashIndex:
+    """
+    Индекс перцептивных хешей для поиска по расстоянию Хэмминга
+
+    Для каждого из 8 байтов хеша хранится словарь значение байта → позиции
+    в массиве хешей. Кандидаты собираются по совпадающим байтам запроса и
+    проверяются векторно; при max_distance < 8 поиск точный.
+
+    Индекс синхронизируется с таблицей image_perceptual_hashes: новые строки
+    догружаются по возрастанию id, при удалениях индекс перестраивается.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._ids = []
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._buckets = [dict() for _ in range(_CHUNKS)]
+        self._last_row_id = 0
+        self._row_count = 0
+
+    def _add_many(self, rows):
+        """Добавление строк (row_id, annotation_id, signed phash) в индекс"""
+        if not rows:
+            return
+        start = len(self._ids)
+        values = np.array([ImagePerceptualHash.to_unsigned(phash) for _, _, phash in rows], dtype=np.uint64)
+        self._hashes = np.concatenate([self._hashes, values])
+        chunks = values.view(np.uint8).reshape(-1, 8)
+        for offset, (row_id, annotation_id, _) in enumerate(rows):
+            position = start + offset
+            self._ids.append(annotation_id)
+            for chunk_no in range(_CHUNKS):
+                self._buckets[chunk_no].setdefault(int(chunks[offset, chunk_no]), []).append(position)
+        self._last_row_id = max(self._last_row_id, rows[-1][0])
+        self._row_count += len(rows)
+
+    def sync(self):
+        """Догрузка новых строк из БД; полная перестройка, если строки удалялись"""
+        count, max_id = db.session.query(
+            db.func.count(ImagePerceptualHash.id), db.func.max(ImagePerceptualHash.id)).one()
+        with self._lock:
+            if count == self._row_count and (max_id or 0) == self._last_row_id:
+                return
+            rows = self._load_rows(self._last_row_id)
+            if count != self._row_count + len(rows):
+                # Часть загруженных строк удалена — перестраиваем индекс целиком
+                self._reset()
+                rows = self._load_rows(0)
+            self._add_many(rows)
+
+    @staticmethod
+    def _load_rows(after_id):
+        rows = db.session.query(
+            ImagePerceptualHash.id, ImagePerceptualHash.annotation_id, ImagePerceptualHash.phash
+        ).filter(ImagePerceptualHash.id > after_id).order_by(ImagePerceptualHash.id).all()
+        return [tuple(row) for row in rows]
+
+    def search(self, phash, max_distance, exclude_ids=None, limit=10):
+        """
+        Поиск хешей на расстоянии Хэмминга не больше max_distance
+
+        Args:
+            phash (int): Беззнаковый 64-битный хеш запроса
+            max_distance (int): Максимальное расстояние (точный поиск при < 8)
+            exclude_ids (set): ID аннотаций, исключаемые из результата
+            limit (int): Максимальное количество результатов
+
+        Returns:
+            list: [(annotation_id, расстояние), ...] по возрастанию расстояния
+        """
+        query_chunks = np.array([phash], dtype=np.uint64).view(np.uint8)
+        with self._lock:
+            candidates = set()
+            for chunk_no in range(_CHUNKS):
+                candidates.update(self._buckets[chunk_no].get(int(query_chunks[chunk_no]), ()))
+            if max_distance >= _CHUNKS:
+                # Вне гарантии multi-index hashing — полный векторный перебор
+                candidates = range(len(self._ids))
+            if not candidates:
+                return []
+            positions = np.fromiter(candidates, dtype=np.int64)
+            distances = _popcount64(self._hashes[positions] ^ np.uint64(phash))
+            ids = self._ids
+
+        matches = []
+        for position, distance in zip(positions[distances <= max_distance], distances[distances <= max_distance]):
+            annotation_id = ids[position]
+            if exclude_ids and annotation_id in exclude_ids:
+                continue
+            matches.append((annotation_id, int(distance)))
+        matches.sort(key=lambda item: (item[1], item[0]))
+        return matches[:limit]
+
+    def __len__(self):
+        return len(self._ids)
+
+
+# Индекс уровня процесса (синхронизируется с БД при каждом поиске)
+phash_index = PerceptualHashIndex()
+
+
+def record_image_phash(annotation, image_path):
+    """
+    Вычисление и привязка перцептивного хеша к аннотации (без коммита)
+
+    Args:
+        annotation (ImageAnnotation): Аннотация изображения
+        image_path (str): Путь к файлу изображения
+
+    Returns:
+        int: Хеш или None, если изображение не удалось прочитать
+    """
+    phash = compute_phash(image_path)
+    if phash is None:
+        return None
+    annotation.perceptual_hash = ImagePerceptualHash(phash=ImagePerceptualHash.to_signed(phash))
+    return phash
+
+
+def find_duplicate_images(phash, max_distance=None, exclude_ids=None, limit=10):
+    """
+    Поиск почти-дубликатов изображения в банке вопросов
+
+    Args:
+        phash (int): Хеш изображения
+        max_distance (int): Порог расстояния Хэмминга (по умолчанию PHASH_DUPLICATE_DISTANCE)
+        exclude_ids (set): ID аннотаций, исключаемые из результата
+        limit (int): Максимальное количество результатов
+
+    Returns:
+        list: [(annotation_id, расстояние), ...]
+    """
+    if phash is None:
+        return []
+    if max_distance is None:
+        max_distance = current_app.config.get('PHASH_DUPLICATE_DISTANCE', 6)
+    phash_index.sync()
+    return phash_index.search(phash, max_distance, exclude_ids=exclude_ids, limit=limit)
@@ -8,13 +8,56 @@ import cv2
 import numpy as np
 import os
 import logging
+import struct
+from collections import defaultdict
+
+from app.utils.coco_stream import iter_coco
 
 logger = logging.getLogger(__name__)
 
+def _segmentation_entries(ann):
+    """
+    Преобразование сегментации одной COCO-аннотации в записи с контурами
+
+    Args:
+        ann (dict): Аннотация COCO
+
+    Returns:
+        list: Записи {'contour', 'bbox'[, 'rle']} без метки
+    """
+    segmentation = ann.get('segmentation', [])
+    entries = []
+
+    if isinstance(segmentation, dict):
+        # Маска в формате RLE: храним её в сжатом виде, контур восстанавливаем для метрик
+        rle = rle_compress(segmentation)
+        contour = rle_to_contour(rle)
+        if contour is not None:
+            entries.append({
+                'contour': contour.astype(float).tolist(),
+                'bbox': ann.get('bbox'),
+                'rle': rle
+            })
+    elif segmentation and isinstance(segmentation[0], list):
+        # Преобразование сегментации в контуры
+        for seg in segmentation:
+            if len(seg) >= 6:  # Требуется не менее 3 точек для полигона
+                contour = np.array(seg).reshape(-1, 2)
+                entries.append({
+                    'contour': contour.astype(float).tolist(),
+                    'bbox': ann.get('bbox')
+                })
+
+    return entries
+
+
 def process_coco_annotations(annotation_file):
     """
     Обработка файла аннотаций в формате COCO
 
+    Файл перебирается поэлементно (см. iter_coco), поэтому крупные экспорты
+    не загружаются в память целиком.
+
     Args:
         annotation_file (str): Путь к файлу аннотаций COCO
 
@@ -22,26 +65,20 @@ def process_coco_annotations(annotation_file):
         dict: Словарь с обработанными аннотациями и метками
     """
     try:
-        with open(annotation_file, 'r') as f:
-            coco_data = json.load(f)
-
         annotations = []
-        categories = {cat['id']: cat['name'] for cat in coco_data.get('categories', [])}
-
-        for ann in coco_data.get('annotations', []):
-            category_name = categories.get(ann['category_id'], f'object_{ann["category_id"]}')
-            segmentation = ann.get('segmentation', [])
-
-            if segmentation and isinstance(segmentation[0], list):
-                # Преобразование сегментации в контуры
-                for seg in segmentation:
-                    if len(seg) >= 6:  # Требуется не менее 3 точек для полигона
-                        contour = np.array(seg).reshape(-1, 2)
-                        annotations.append({
-                            'label': category_name,
-                            'contour': contour.astype(float).tolist(),
-                            'bbox': ann.get('bbox')
-                        })
+        categories = {}
+        # Категории могут идти в файле после аннотаций, поэтому метки проставляются в конце
+        pending = []
+
+        for key, item in iter_coco(annotation_file, sections=('categories', 'annotations')):
+            if key == 'categories':
+                categories[item['id']] = item['name']
+            elif key == 'annotations':
+                for entry in _segmentation_entries(item):
+                    pending.append((item['category_id'], entry))
+
+        for category_id, entry in pending:
+            annotations.append({'label': categories.get(category_id, f'object_{category_id}'), **entry})
 
         return {
             'labels': list(categories.values()),
@@ -51,83 +88,458 @@ def process_coco_annotations(annotation_file):
         print(f"Ошибка обработки аннотаций COCO: {e}")
         return None
 
-def parse_coco_for_image(coco_file_path, image_filename, unique_id=None, output_dir=None):
+def process_yolo_annotations(annotation_file, image_shape, class_names=None):
     """
-    Парсит COCO-файл и извлекает аннотации, категории и информацию об изображении
-    для конкретного изображения по имени файла.
+    Обработка файла аннотаций в формате YOLO (bbox и сегментация)
+
+    Строка bbox: "class x_center y_center width height", строка сегментации:
+    "class x1 y1 x2 y2 ...". Координаты нормированы на размер изображения.
+    Строки одного вида разбираются и масштабируются пакетно средствами numpy.
+
+    Args:
+        annotation_file (str): Путь к файлу аннотаций YOLO (.txt)
+        image_shape (tuple): Размер изображения (высота, ширина[, каналы])
+        class_names (list): Названия классов по индексу (если известны)
+
+    Returns:
+        dict: Словарь с обработанными аннотациями и метками
+    """
+    try:
+        height, width = float(image_shape[0]), float(image_shape[1])
+        scale = np.array([width, height], dtype=np.float64)
+
+        with open(annotation_file, 'r', encoding='utf-8') as f:
+            rows = [line.split() for line in f if line.strip()]
+
+        def label_for(cls):
+            if class_names and 0 <= cls < len(class_names):
+                return class_names[cls]
+            return f'object_{cls}'
+
+        # Порядок строк сохраняется: сначала собираем разобранные записи по позициям
+        entries = [None] * len(rows)
+
+        bbox_idx = [i for i, row in enumerate(rows) if len(row) == 5]
+        if bbox_idx:
+            boxes = np.array([rows[i] for i in bbox_idx], dtype=np.float64)
+            classes = boxes[:, 0].astype(int)
+            centers = boxes[:, 1:3] * scale
+            sizes = boxes[:, 3:5] * scale
+            top_left = centers - sizes / 2
+            bottom_right = centers + sizes / 2
+            corners = np.stack([
+                top_left,
+                np.column_stack([bottom_right[:, 0], top_left[:, 1]]),
+                bottom_right,
+                np.column_stack([top_left[:, 0], bottom_right[:, 1]])
+            ], axis=1)
+            for k, i in enumerate(bbox_idx):
+                entries[i] = {
+                    'label': label_for(int(classes[k])),
+                    'contour': corners[k].tolist(),
+                    'bbox': [float(top_left[k, 0]), float(top_left[k, 1]), float(sizes[k, 0]), float(sizes[k, 1])]
+                }
+
+        # Полигоны: не менее 3 точек и чётное число координат
+        poly_idx = [i for i, row in enumerate(rows) if len(row) >= 7 and len(row) % 2 == 1]
+        if poly_idx:
+            lengths = np.array([(len(rows[i]) - 1) // 2 for i in poly_idx])
+            classes = np.array([rows[i][0] for i in poly_idx], dtype=np.float64).astype(int)
+            flat = np.array([v for i in poly_idx for v in rows[i][1:]], dtype=np.float64)
+            points = flat.reshape(-1, 2) * scale
+            for k, (i, polygon) in enumerate(zip(poly_idx, np.split(points, np.cumsum(lengths)[:-1]))):
+                x_min, y_min = polygon.min(axis=0)
+                x_max, y_max = polygon.max(axis=0)
+                entries[i] = {
+                    'label': label_for(int(classes[k])),
+                    'contour': polygon.tolist(),
+                    'bbox': [float(x_min), float(y_min), float(x_max - x_min), float(y_max - y_min)]
+                }
+
+        annotations = [entry for entry in entries if entry is not None]
+        labels = []
+        for entry in annotations:
+            if entry['label'] not in labels:
+                labels.append(entry['label'])
+
+        return {
+            'labels': labels,
+            'annotations': annotations
+        }
+    except Exception as e:
+        print(f"Ошибка обработки аннотаций YOLO: {e}")
+        return None
+
+
+def probe_image_size(image_path):
+    """
+    Определение размеров изображения по заголовку файла без декодирования
+
+    Поддерживаются PNG (чанк IHDR) и JPEG (маркер SOFn).
+
+    Args:
+        image_path (str): Путь к изображению
+
+    Returns:
+        tuple: (ширина, высота) или None, если формат не распознан
+    """
+    with open(image_path, 'rb') as f:
+        head = f.read(26)
+        if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+            width, height = struct.unpack('>II', head[16:24])
+            return width, height
+
+        if head[:2] != b'\xff\xd8':
+            return None
+
+        f.seek(2)
+        while True:
+            byte = f.read(1)
+            while byte and byte != b'\xff':
+                byte = f.read(1)
+            while byte == b'\xff':  # Пропуск заполняющих байтов 0xFF
+                byte = f.read(1)
+            if not byte:
+                return None
+            marker = byte[0]
+            if marker == 0xD8 or marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                continue  # Маркеры без сегмента данных
+            if marker == 0xD9 or marker == 0xDA:
+                return None  # Конец изображения или начало скана до SOF
+            length_bytes = f.read(2)
+            if len(length_bytes) < 2:
+                return None
+            length = struct.unpack('>H', length_bytes)[0]
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                data = f.read(5)
+                if len(data) < 5:
+                    return None
+                height, width = struct.unpack('>HH', data[1:5])
+                return width, height
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+# === RLE (COCO run-length encoding) ===
+# Маска кодируется по столбцам (Fortran order), счётчики начинаются с серии нулей.
+
+def rle_string_to_counts(counts_str):
+    """
+    Декодирование сжатой строки счётчиков COCO RLE (формат pycocotools)
+
+    Args:
+        counts_str (str): Сжатая строка счётчиков
+
+    Returns:
+        list: Список длин серий
+    """
+    if isinstance(counts_str, bytes):
+        counts_str = counts_str.decode('ascii')
+    counts = []
+    p = 0
+    n = len(counts_str)
+    while p < n:
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = ord(counts_str[p]) - 48
+            x |= (c & 0x1f) << (5 * k)
+            more = bool(c & 0x20)
+            p += 1
+            k += 1
+            if not more and (c & 0x10):
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return counts
+
+
+def rle_counts_to_string(counts):
+    """
+    Кодирование списка длин серий в сжатую строку COCO RLE (формат pycocotools)
+
+    Args:
+        counts (list): Список длин серий
+
+    Returns:
+        str: Сжатая строка счётчиков
+    """
+    chars = []
+    for i, x in enumerate(counts):
+        x = int(x)
+        if i > 2:
+            x -= int(counts[i - 2])
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = (x != -1) if (c & 0x10) else (x != 0)
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return ''.join(chars)
+
+
+def _rle_counts(rle):
+    """Получение списка длин серий из RLE в сжатом или несжатом виде"""
+    counts = rle['counts']
+    if isinstance(counts, (str, bytes)):
+        return rle_string_to_counts(counts)
+    return [int(c) for c in counts]
+
+
+def rle_compress(rle):
+    """
+    Приведение RLE к сжатому виду {'size': [h, w], 'counts': str}
+
+    Args:
+        rle (dict): RLE со счётчиками в виде списка или строки
+
+    Returns:
+        dict: RLE со сжатой строкой счётчиков
+    """
+    counts = rle['counts']
+    if not isinstance(counts, (str, bytes)):
+        counts = rle_counts_to_string(counts)
+    elif isinstance(counts, bytes):
+        counts = counts.decode('ascii')
+    return {'size': [int(v) for v in rle['size']], 'counts': counts}
+
+
+def rle_encode(mask):
+    """
+    Кодирование бинарной маски в сжатый COCO RLE
+
+    Args:
+        mask (np.ndarray): Бинарная маска формы (h, w)
+
+    Returns:
+        dict: RLE {'size': [h, w], 'counts': str}
+    """
+    mask = np.asarray(mask)
+    h, w = mask.shape[:2]
+    flat = mask.ravel(order='F') > 0
+    if flat.size == 0:
+        return {'size': [h, w], 'counts': rle_counts_to_string([0])}
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate(([0], changes, [flat.size]))
+    counts = np.diff(bounds).tolist()
+    if flat[0]:
+        counts.insert(0, 0)
+    return {'size': [h, w], 'counts': rle_counts_to_string(counts)}
+
+
+def rle_decode(rle):
+    """
+    Декодирование COCO RLE в бинарную маску
+
+    Args:
+        rle (dict): RLE со счётчиками в виде списка или строки
+
+    Returns:
+        np.ndarray: Маска формы (h, w), dtype uint8 (значения 0/1)
+    """
+    h, w = (int(v) for v in rle['size'])
+    counts = np.asarray(_rle_counts(rle), dtype=np.int64)
+    values = np.arange(len(counts), dtype=np.int64) % 2
+    flat = np.repeat(values.astype(np.uint8), counts)
+    if flat.size < h * w:
+        flat = np.concatenate((flat, np.zeros(h * w - flat.size, dtype=np.uint8)))
+    return flat[:h * w].reshape((h, w), order='F')
+
+
+def polygon_to_rle(contour, height, width):
+    """
+    Растеризация полигона в сжатый COCO RLE
+
+    Args:
+        contour (list): Контур в формате [[x, y], ...] или [{'x': .., 'y': ..}, ...]
+        height (int): Высота маски
+        width (int): Ширина маски
+
+    Returns:
+        dict: RLE {'size': [h, w], 'counts': str}
+    """
+    mask = np.zeros((int(height), int(width)), dtype=np.uint8)
+    if contour is not None and len(contour):
+        if isinstance(contour[0], dict):
+            points = np.array([[p['x'], p['y']] for p in contour], dtype=np.float32)
+        else:
+            points = np.asarray(contour, dtype=np.float32).reshape(-1, 2)
+        if len(points) >= 3:
+            cv2.fillPoly(mask, [np.round(points).astype(np.int32)], 1)
+    return rle_encode(mask)
+
+
+def rle_to_contour(rle):
+    """
+    Восстановление внешнего контура наибольшей связной области маски RLE
+
+    Args:
+        rle (dict): RLE маски
+
+    Returns:
+        np.ndarray: Контур формы (N, 2) или None, если маска пуста
+    """
+    mask = rle_decode(rle)
+    found = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contours = found[-2]
+    if not contours:
+        return None
+    largest = max(contours, key=cv2.contourArea)
+    if len(largest) < 3:
+        return None
+    return largest.reshape(-1, 2)
+
+
+def _rle_intervals(rle):
+    """Получение интервалов [start, end) единичных серий в пространстве Fortran-индексов"""
+    counts = np.asarray(_rle_counts(rle), dtype=np.int64)
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+    starts = bounds[1:-1:2]
+    ends = bounds[2::2]
+    return starts[:len(ends)], ends
+
+
+def rle_area(rle):
+    """
+    Площадь маски без декодирования (сумма единичных серий)
+
+    Args:
+        rle (dict): RLE маски
+
+    Returns:
+        int: Количество единичных пикселей
+    """
+    counts = _rle_counts(rle)
+    return int(sum(counts[1::2]))
+
+
+def rle_intersection_area(rle1, rle2):
+    """
+    Площадь пересечения двух масок, вычисленная слиянием серий без декодирования
+
+    Args:
+        rle1 (dict): RLE первой маски
+        rle2 (dict): RLE второй маски (того же размера)
+
+    Returns:
+        int: Количество пикселей пересечения
+    """
+    starts1, ends1 = _rle_intervals(rle1)
+    starts2, ends2 = _rle_intervals(rle2)
+    i = j = 0
+    area = 0
+    while i < len(starts1) and j < len(starts2):
+        lo = max(starts1[i], starts2[j])
+        hi = min(ends1[i], ends2[j])
+        if hi > lo:
+            area += int(hi - lo)
+        if ends1[i] < ends2[j]:
+            i += 1
+        else:
+            j += 1
+    return area
+
+
+def rle_iou(rle1, rle2):
+    """
+    Intersection over Union двух масок в формате RLE
+
+    Args:
+        rle1 (dict): RLE первой маски
+        rle2 (dict): RLE второй маски
+
+    Returns:
+        float: Значение IoU (0.0 - 1.0)
+    """
+    if list(rle1['size']) != list(rle2['size']):
+        raise ValueError(f"Размеры масок RLE не совпадают: {rle1['size']} и {rle2['size']}")
+    intersection = rle_intersection_area(rle1, rle2)
+    union = rle_area(rle1) + rle_area(rle2) - intersection
+    if union == 0:
+        return 0.0
+    return intersection / union
+
+def _coco_output_filename(coco_file_path, image_filename, unique_id=None):
+    """Имя файла аннотаций для отдельного изображения: <имя изображения>[_<unique_id>]<расширение COCO>"""
+    _, ext_part = os.path.splitext(os.path.basename(coco_file_path))
+    name_part_img, _ = os.path.splitext(image_filename)
+    if unique_id:
+        return f"{name_part_img}_{unique_id}{ext_part}"
+    return f"{name_part_img}{ext_part}"
+
+
+def split_coco_by_image(coco_file_path, output_dir=None, unique_id=None, image_filenames=None):
+    """
+    Разбивает COCO-файл на отдельные файлы для каждого изображения за один проход.
+
+    Файл перебирается поэлементно (см. iter_coco), аннотации индексируются по
+    image_id за один проход, после чего файлы всех (или выбранных) изображений
+    записываются сразу в компактном JSON.
 
     Args:
         coco_file_path (str): Путь к исходному файлу COCO JSON.
-        image_filename (str): Имя изображения (например, 'image.jpg'), для которого извлекаются данные.
-        unique_id (str): Уникальная приставка к имени файла.
-        output_dir (str, optional): Каталог для сохранения нового файла. Если None, сохраняет рядом с исходным.
+        output_dir (str, optional): Каталог для сохранения файлов. Если None, сохраняет рядом с исходным.
+        unique_id (str, optional): Уникальная приставка к именам файлов.
+        image_filenames (iterable, optional): Имена изображений, для которых нужны файлы. Если None — все.
 
     Returns:
-        tuple: (bool, str)
+        tuple: (bool, dict | str)
             - bool: True, если успешно, False в случае ошибки.
-            - str: Имя созданного файла (если успех) или сообщение об ошибке.
+            - dict: {имя изображения: имя созданного файла} (если успех) или сообщение об ошибке.
     """
     try:
-        with open(coco_file_path, 'r', encoding='utf-8') as f:
-            coco_data = json.load(f)
-
-        # Найти ID изображения по имени
-        image_id = None
-        for img_info in coco_data.get('images', []):
-            if img_info['file_name'] == image_filename:
-                image_id = img_info['id']
-                break
-
-        if image_id is None:
-            logger.error(f"Изображение '{image_filename}' не найдено в COCO-файле '{coco_file_path}'.")
-            return False, f"Изображение '{image_filename}' не найдено в файле аннотаций."
-
-        # Собрать данные для нового файла
-        new_coco_data = {
-            "info": coco_data.get("info", {}),
-            "licenses": coco_data.get("licenses", []),
-            "categories": [], # Заполним позже
-            "images": [],
-            "annotations": []
-        }
+        wanted = set(image_filenames) if image_filenames is not None else None
+
+        images_by_id = {}
+        anns_by_image = defaultdict(list)
+        category_map = {}
+        info = {}
+        licenses = []
+        images_seen = False
+
+        # Один поэлементный проход по файлу с группировкой аннотаций по image_id
+        for key, item in iter_coco(coco_file_path):
+            if key == 'images':
+                images_seen = True
+                if wanted is None or item['file_name'] in wanted:
+                    images_by_id[item['id']] = item
+            elif key == 'annotations':
+                # Если список изображений уже прочитан, лишние аннотации сразу отбрасываются
+                if images_seen and item['image_id'] not in images_by_id:
+                    continue
+                anns_by_image[item['image_id']].append(item)
+            elif key == 'categories':
+                category_map[item['id']] = item
+            elif key == 'info':
+                info = item
+            elif key == 'licenses':
+                licenses = item
 
-        # Найти изображение
-        for img_info in coco_data.get('images', []):
-            if img_info['id'] == image_id:
-                new_coco_data['images'].append(img_info)
-                break
-
-        # Найти аннотации для этого изображения
-        annotation_categories = set()
-        for ann in coco_data.get('annotations', []):
-            if ann['image_id'] == image_id:
-                new_coco_data['annotations'].append(ann)
-                annotation_categories.add(ann['category_id'])
-
-        # Найти соответствующие категории
-        category_map = {cat['id']: cat for cat in coco_data.get('categories', [])}
-        for cat_id in sorted(annotation_categories): # Сортировка для предсказуемости
-            if cat_id in category_map:
-                new_coco_data['categories'].append(category_map[cat_id])
-
-        # Определить имя и путь для нового файла
         if output_dir is None:
             output_dir = os.path.dirname(coco_file_path)
-        original_filename = os.path.basename(coco_file_path)
-        name_part, ext_part = os.path.splitext(original_filename)
-        name_part_img, ext_part_img = os.path.splitext(image_filename)
-        if unique_id:
-            new_filename = f"{name_part_img}_{unique_id}{ext_part}"
-        else:
-            new_filename = f"{name_part_img}{ext_part}"
-        new_file_path = os.path.join(output_dir, new_filename)
 
-        # Сохранить новый файл
-        with open(new_file_path, 'w', encoding='utf-8') as f:
-            json.dump(new_coco_data, f, ensure_ascii=False, indent=2)
+        created = {}
+        for image_id, img_info in images_by_id.items():
+            anns = anns_by_image.get(image_id, [])
+            category_ids = sorted({ann['category_id'] for ann in anns})  # Сортировка для предсказуемости
+            new_coco_data = {
+                "info": info,
+                "licenses": licenses,
+                "categories": [category_map[cat_id] for cat_id in category_ids if cat_id in category_map],
+                "images": [img_info],
+                "annotations": anns
+            }
 
-        logger.info(f"Создан новый COCO-файл для изображения '{image_filename}': {new_file_path}")
-        return True, new_filename
+            new_filename = _coco_output_filename(coco_file_path, img_info['file_name'], unique_id)
+            with open(os.path.join(output_dir, new_filename), 'w', encoding='utf-8') as f:
+                json.dump(new_coco_data, f, ensure_ascii=False, separators=(',', ':'))
+            created[img_info['file_name']] = new_filename
+
+        logger.info(f"COCO-файл '{coco_file_path}' разбит на {len(created)} файлов в '{output_dir}'")
+        return True, created
 
     except FileNotFoundError:
         logger.error(f"COCO-файл не найден: {coco_file_path}")
@@ -139,5 +551,34 @@ def parse_coco_for_image(coco_file_path, image_filename, unique_id=None, output_
         logger.error(f"Отсутствует ожидаемое поле в COCO-файле {coco_file_path}: {e}")
         return False, f"Некорректная структура файла аннотаций: {e}"
     except Exception as e:
-        logger.exception(f"Неизвестная ошибка при парсинге COCO-файла '{coco_file_path}': {e}")
-        return False, f"Ошибка при обработке файла аннотаций: {str(e)}"
\ No newline at end of file
+        logger.exception(f"Неизвестная ошибка при разбиении COCO-файла '{coco_file_path}': {e}")
+        return False, f"Ошибка при обработке файла аннотаций: {str(e)}"
+
+
+def parse_coco_for_image(coco_file_path, image_filename, unique_id=None, output_dir=None):
+    """
+    Парсит COCO-файл и извлекает аннотации, категории и информацию об изображении
+    для конкретного изображения по имени файла.
+
+    Args:
+        coco_file_path (str): Путь к исходному файлу COCO JSON.
+        image_filename (str): Имя изображения (например, 'image.jpg'), для которого извлекаются данные.
+        unique_id (str): Уникальная приставка к имени файла.
+        output_dir (str, optional): Каталог для сохранения нового файла. Если None, сохраняет рядом с исходным.
+
+    Returns:
+        tuple: (bool, str)
+            - bool: True, если успешно, False в случае ошибки.
+            - str: Имя созданного файла (если успех) или сообщение об ошибке.
+    """
+    success, result = split_coco_by_image(coco_file_path, output_dir=output_dir,
+                                          unique_id=unique_id, image_filenames=[image_filename])
+    if not success:
+        return False, result
+
+    if image_filename not in result:
+        logger.error(f"Изображение '{image_filename}' не найдено в COCO-файле '{coco_file_path}'.")
+        return False, f"Изображение '{image_filename}' не найдено в файле аннотаций."
+
+    logger.info(f"Создан новый COCO-файл для изображения '{image_filename}': {result[image_filename]}")
+    return True, result[image_filename]
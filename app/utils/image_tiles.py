@@ -0,0 +1,181 @@
+# app/utils/image_tiles.py
+"""
+Тайловая пирамида изображений
+Уровень 0 — оригинал, каждый следующий уменьшен вдвое, пока изображение не
+поместится в один тайл. Тайлы хранятся на диске (tiles/<имя>/<уровень>/<x>_<y>.webp)
+вместе с описанием пирамиды info.json; холст запрашивает только видимые тайлы.
+Пирамида строится в локальной копии и передаётся в хранилище загрузок
+"""
+import json
+import logging
+import math
+import os
+import shutil
+import uuid
+
+import cv2
+from flask import current_app
+
+from app.utils.image_derivatives import _ENCODE_PARAMS, _read_image
+from app.utils.storage import storage, storage_key
+
+logger = logging.getLogger(__name__)
+
+_INFO_NAME = 'info.json'
+
+
+def _tile_settings():
+    """Размер тайла, формат и качество из конфигурации приложения"""
+    config = current_app.config
+    return (config.get('IMAGE_TILE_SIZE', 256),
+            config.get('IMAGE_DERIVATIVE_FORMAT', 'webp'),
+            config.get('IMAGE_DERIVATIVE_QUALITY', 80))
+
+
+def tiles_dir(upload_folder, filename):
+    """Каталог пирамиды изображения: исходное имя без расширения"""
+    return os.path.join(upload_folder, 'tiles', os.path.splitext(filename)[0])
+
+
+def tiles_prefix(filename):
+    """Префикс ключей пирамиды изображения в хранилище"""
+    return storage_key('tiles', os.path.splitext(filename)[0])
+
+
+def tile_key(filename, level, col, row, fmt=None):
+    """Ключ тайла уровня level в столбце col и строке row"""
+    fmt = fmt or _tile_settings()[1]
+    return f"{tiles_prefix(filename)}/{level}/{col}_{row}.{fmt}"
+
+
+def tile_path(upload_folder, filename, level, col, row, fmt=None):
+    """Путь к локальной копии тайла уровня level в столбце col и строке row"""
+    fmt = fmt or _tile_settings()[1]
+    return os.path.join(tiles_dir(upload_folder, filename), str(level), f"{col}_{row}.{fmt}")
+
+
+def pyramid_levels(width, height, tile_size):
+    """
+    Размеры уровней пирамиды
+
+    Returns:
+        list: [(ширина, высота), ...] от оригинала до уровня в один тайл
+    """
+    levels = [(width, height)]
+    while max(width, height) > tile_size:
+        width, height = max(1, math.ceil(width / 2)), max(1, math.ceil(height / 2))
+        levels.append((width, height))
+    return levels
+
+
+def generate_image_tiles(upload_folder, filename):
+    """
+    Генерация тайловой пирамиды изображения (исходник декодируется один раз,
+    каждый уровень получается уменьшением предыдущего)
+
+    Args:
+        upload_folder (str): Корневая папка загрузок
+        filename (str): Имя файла в папке images
+
+    Returns:
+        dict: Описание пирамиды (как в info.json) или None, если изображение не прочитано
+    """
+    tile_size, fmt, quality = _tile_settings()
+    original = storage.fetch(storage_key('images', filename))
+    image = _read_image(original) if original else None
+    if image is None:
+        logger.warning(f"Не удалось прочитать изображение '{filename}' для генерации тайлов")
+        return None
+
+    height, width = image.shape[:2]
+    levels = pyramid_levels(width, height, tile_size)
+    target_dir = tiles_dir(upload_folder, filename)
+    # Пирамида строится во временном каталоге и подменяется целиком
+    build_dir = f"{target_dir}.{uuid.uuid4().hex[:8]}.tmp"
+
+    encode_params = _ENCODE_PARAMS[fmt](quality)
+    try:
+        for level, (level_w, level_h) in enumerate(levels):
+            if (level_w, level_h) != (image.shape[1], image.shape[0]):
+                image = cv2.resize(image, (level_w, level_h), interpolation=cv2.INTER_AREA)
+            level_dir = os.path.join(build_dir, str(level))
+            os.makedirs(level_dir, exist_ok=True)
+            for row in range(math.ceil(level_h / tile_size)):
+                for col in range(math.ceil(level_w / tile_size)):
+                    tile = image[row * tile_size:(row + 1) * tile_size, col * tile_size:(col + 1) * tile_size]
+                    ok, encoded = cv2.imencode(f'.{fmt}', tile, encode_params)
+                    if not ok:
+                        raise ValueError(f"Не удалось закодировать тайл в формат {fmt}")
+                    with open(os.path.join(level_dir, f"{col}_{row}.{fmt}"), 'wb') as f:
+                        f.write(encoded.tobytes())
+
+        info = {
+            'width': width,
+            'height': height,
+            'tile_size': tile_size,
+            'format': fmt,
+            'levels': [{'width': w, 'height': h} for w, h in levels]
+        }
+        with open(os.path.join(build_dir, _INFO_NAME), 'w', encoding='utf-8') as f:
+            json.dump(info, f)
+    except Exception:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+
+    shutil.rmtree(target_dir, ignore_errors=True)
+    os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+    try:
+        os.replace(build_dir, target_dir)
+    except OSError:
+        # Пирамиду одновременно построил другой запрос — оставляем его результат
+        shutil.rmtree(build_dir, ignore_errors=True)
+        return info
+
+    if not storage.is_local:
+        # Описание выгружается последним: другие узлы видят пирамиду только целиком
+        for level, (level_w, level_h) in enumerate(levels):
+            for row in range(math.ceil(level_h / tile_size)):
+                for col in range(math.ceil(level_w / tile_size)):
+                    storage.publish(tile_key(filename, level, col, row, fmt))
+        storage.publish(f"{tiles_prefix(filename)}/{_INFO_NAME}")
+    return info
+
+
+def ensure_image_tiles(upload_folder, filename):
+    """
+    Описание пирамиды изображения; отсутствующая или устаревшая пирамида
+    (например, для загруженных ранее изображений) создаётся при первом обращении
+
+    Args:
+        upload_folder (str): Корневая папка загрузок
+        filename (str): Имя файла в папке images
+
+    Returns:
+        dict: Описание пирамиды или None, если её не удалось получить
+    """
+    info_path = storage.fetch(f"{tiles_prefix(filename)}/{_INFO_NAME}")
+    original = storage.local_path(storage_key('images', filename))
+    if info_path and (not storage.is_local or not os.path.exists(original) or
+                      os.path.getmtime(info_path) >= os.path.getmtime(original)):
+        try:
+            with open(info_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Повреждено описание пирамиды '{info_path}': {e}")
+    if not storage.fetch(storage_key('images', filename)):
+        return None
+    try:
+        return generate_image_tiles(upload_folder, filename)
+    except Exception as e:
+        logger.warning(f"Ошибка генерации тайлов для '{filename}': {e}")
+        return None
+
+
+def remove_image_tiles(upload_folder, filename):
+    """Удаление тайловой пирамиды изображения (при удалении исходника)"""
+    prefix = tiles_prefix(filename)
+    try:
+        # Пустые каталоги шардов хранилище удаляет само, как и для исходников
+        storage.delete_prefix(prefix)
+    except Exception as e:
+        logger.warning(f"Не удалось удалить тайлы '{prefix}': {e}")
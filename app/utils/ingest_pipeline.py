@@ -0,0 +1,317 @@
+# app/utils/ingest_pipeline.py
+"""
+Конвейер приёма изображений и аннотаций
+Единые этапы validate → store → parse → index → derive для загрузок
+администратора и преподавателя: в запросе выполняются только проверка и
+потоковое сохранение файлов, остальные этапы — в пуле фоновых воркеров
+"""
+import logging
+import os
+import uuid
+
+from flask import current_app
+from werkzeug.utils import secure_filename
+
+from app import db
+from app.models.annotation import ImageAnnotation, ImagePerceptualHash
+from app.models.question import Question
+from app.utils.chunked_upload import claim_upload, ChunkedUploadError
+from app.utils.background_jobs import create_job, submit_job, job_handler, update_job, run_side_task
+from app.utils.image_derivatives import generate_image_derivatives
+from app.utils.image_hashing import compute_phash, find_duplicate_images
+from app.utils.image_processing import parse_coco_for_image, probe_image_size
+from app.utils.image_tiles import generate_image_tiles
+from app.utils.question_stats import adjust_question_counts, question_count_key
+from app.utils.reference_geometry import (store_reference_geometry, publish_reference_geometry,
+                                          unpublish_reference_geometry, parse_annotation_file)
+from app.utils.storage import storage, storage_key
+from app.utils.upload_gc import enqueue_file_release, release_unused_image
+from app.utils.upload_storage import store_upload
+
+logger = logging.getLogger(__name__)
+
+INGEST_STAGES = ('validate', 'store', 'parse', 'index', 'derive')
+
+
+class IngestError(Exception):
+    """Ошибка приёма загрузки с сообщением для пользователя"""
+
+
+def _allowed_file(filename, allowed_extensions):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
+
+
+def stage_upload(image_file, annotation_file, upload_folder):
+    """
+    Этапы validate и store, выполняемые в запросе: проверка расширений и
+    потоковое сохранение файлов (изображение — по хешу содержимого)
+
+    Args:
+        image_file (FileStorage): Загруженное изображение
+        annotation_file (FileStorage): Загруженный файл аннотаций
+        upload_folder (str): Корневая папка загрузок
+
+    Returns:
+        dict: Параметры задачи приёма (имена сохранённых файлов и формат)
+
+    Raises:
+        IngestError: Если файлы отсутствуют или имеют недопустимый формат
+    """
+    if not image_file or not annotation_file or not image_file.filename or not annotation_file.filename:
+        raise IngestError('Для графических вопросов требуются файлы изображения и аннотации')
+
+    allowed_image_ext = set(current_app.config.get('ALLOWED_IMAGE_EXTENSIONS', {'png', 'jpg', 'jpeg'}))
+    allowed_ann_ext = set(current_app.config.get('ALLOWED_ANNOTATION_EXTENSIONS', {'json', 'txt'}))
+    if not _allowed_file(image_file.filename, allowed_image_ext) or \
+       not _allowed_file(annotation_file.filename, allowed_ann_ext):
+        raise IngestError('Неверный формат файла')
+
+    source_image_name = secure_filename(image_file.filename)
+    unique_id = str(uuid.uuid4())[:8]
+    name_part_ann, ext_part_ann = os.path.splitext(secure_filename(annotation_file.filename))
+    annotation_filename = f"{name_part_ann}_{unique_id}{ext_part_ann}"
+
+    image_filename, _existed = store_upload(image_file, upload_folder, 'images',
+                                            os.path.splitext(source_image_name)[1])
+    storage.put(storage_key('annotations', annotation_filename), annotation_file.stream)
+
+    return _ingest_params(image_filename, annotation_filename, source_image_name, unique_id)
+
+
+def stage_chunked_upload(image_upload_id, annotation_upload_id, user_id):
+    """
+    Этапы validate и store для файлов, загруженных поблочно: собранные файлы
+    уже лежат в хранилище, сессии загрузки удаляются при коммите запроса
+
+    Args:
+        image_upload_id (str): Токен сессии загрузки изображения
+        annotation_upload_id (str): Токен сессии загрузки аннотации
+        user_id (int): ID пользователя, открывшего сессии
+
+    Returns:
+        dict: Параметры задачи приёма (как у stage_upload)
+
+    Raises:
+        IngestError: Если загрузка не найдена или не завершена
+    """
+    try:
+        source_image_name, image_filename = claim_upload(image_upload_id, user_id, 'image')
+        _source_ann_name, annotation_filename = claim_upload(annotation_upload_id, user_id, 'annotation')
+    except ChunkedUploadError as e:
+        raise IngestError(str(e)) from e
+    return _ingest_params(image_filename, annotation_filename, source_image_name, str(uuid.uuid4())[:8])
+
+
+def _ingest_params(image_filename, annotation_filename, source_image_name, unique_id):
+    return {
+        'image_file': image_filename,
+        'annotation_file': annotation_filename,
+        'source_image_name': source_image_name,
+        'format_type': 'coco' if annotation_filename.endswith('.json') else 'yolo',
+        'unique_id': unique_id
+    }
+
+
+def enqueue_ingest(params, creator_id=None, question_id=None, new_question=None):
+    """
+    Создание задачи приёма для уже сохранённых файлов и постановка её в пул
+
+    Args:
+        params (dict): Результат stage_upload
+        creator_id (int): ID пользователя
+        question_id (int): ID вопроса, к которому привязывается аннотация (если есть)
+        new_question (dict): {'question_text', 'topic_id'} графического вопроса, который
+            создаётся вместе с аннотацией (вместо question_id)
+
+    Returns:
+        BackgroundJob: Созданная задача
+    """
+    params = dict(params, question_id=question_id, new_question=new_question)
+    job = create_job('ingest', params=params, creator_id=creator_id, total=len(INGEST_STAGES))
+    update_job(job, stage='store', processed=INGEST_STAGES.index('store') + 1)
+    submit_job(job)
+    return job
+
+
+def start_ingest(image_file, annotation_file, creator_id=None, question_id=None):
+    """
+    Приём загрузки: сохранение файлов в запросе и постановка задачи в пул
+
+    Args:
+        image_file (FileStorage): Загруженное изображение
+        annotation_file (FileStorage): Загруженный файл аннотаций
+        creator_id (int): ID пользователя
+        question_id (int): ID вопроса, к которому привязывается аннотация (если есть)
+
+    Returns:
+        BackgroundJob: Созданная задача
+
+    Raises:
+        IngestError: Если файлы не прошли проверку
+    """
+    upload_folder = current_app.config.get('UPLOAD_FOLDER')
+    if not upload_folder:
+        raise RuntimeError("UPLOAD_FOLDER not configured")
+    return enqueue_ingest(stage_upload(image_file, annotation_file, upload_folder), creator_id, question_id)
+
+
+def _release_annotation(annotation):
+    """
+    Удаление аннотации, которая больше не используется вопросами (без коммита);
+    файлы освобождаются отдельной задачей после коммита
+
+    Returns:
+        tuple: (ID удалённой аннотации, (имя изображения, имя файла аннотаций))
+    """
+    files = (annotation.image_file, annotation.annotation_file)
+    annotation_id = annotation.id
+    db.session.delete(annotation)
+    return annotation_id, files
+
+
+def _cleanup_failed(params, upload_folder, job_id):
+    """
+    Удаление сохранённых файлов задачи, завершившейся ошибкой; изображение
+    остаётся, если оно нужно другой задаче приёма или сессии загрузки
+    """
+    try:
+        storage.delete(storage_key('annotations', params['annotation_file']))
+    except Exception:
+        pass
+    release_unused_image(upload_folder, params['image_file'], exclude_job_id=job_id)
+
+
+@job_handler('ingest')
+def run_ingest_job(job):
+    """
+    Фоновые этапы приёма: validate (заголовок изображения), parse (выделение
+    аннотаций изображения и разбор геометрии), index (записи в БД и общее
+    хранилище контуров), derive (производные и тайловая пирамида изображения,
+    параллельно с parse)
+
+    Args:
+        job (BackgroundJob): Задача приёма
+
+    Returns:
+        dict: {'annotation_id', 'question_id', 'contours', 'derivatives', 'tile_levels', 'duplicates'}
+    """
+    params = job.params
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    image_path = None
+    annotation_filename = params['annotation_file']
+    format_type = params['format_type']
+    derive_future = tiles_future = None
+    committed = False
+
+    try:
+        update_job(job, stage='validate')
+        image_path = storage.fetch(storage_key('images', params['image_file']))
+        if image_path is None or probe_image_size(image_path) is None:
+            raise IngestError('Файл изображения повреждён или имеет неподдерживаемый формат')
+        phash = compute_phash(image_path)
+        duplicates = find_duplicate_images(phash)
+
+        # Производные и тайлы не зависят от аннотаций и строятся параллельно с разбором
+        derive_future = run_side_task(generate_image_derivatives, upload_folder, params['image_file'])
+        tiles_future = run_side_task(generate_image_tiles, upload_folder, params['image_file'])
+
+        update_job(job, stage='parse', processed=INGEST_STAGES.index('parse'))
+        if format_type == 'coco':
+            annotation_path = storage.fetch(storage_key('annotations', annotation_filename))
+            if annotation_path is None:
+                raise IngestError('Файл аннотации не найден')
+            success, result = parse_coco_for_image(annotation_path, params['source_image_name'],
+                                                   params['unique_id'])
+            if not success:
+                raise IngestError(result)
+            # Файл аннотаций изображения записан рядом с исходным (в локальной копии)
+            storage.publish(storage_key('annotations', result))
+            storage.delete(storage_key('annotations', annotation_filename))
+            annotation_filename = result
+            params['annotation_file'] = annotation_filename
+
+        annotation_path = storage.fetch(storage_key('annotations', annotation_filename))
+        processed_data = parse_annotation_file(annotation_path, format_type, image_path) \
+            if annotation_path else None
+        if processed_data is None:
+            raise IngestError('Не удалось обработать файл аннотации')
+
+        update_job(job, stage='index', processed=INGEST_STAGES.index('index'))
+        new_annotation = ImageAnnotation(
+            image_file=params['image_file'],
+            annotation_file=annotation_filename,
+            format_type=format_type
+        )
+        contour_count = store_reference_geometry(new_annotation, processed_data) \
+            if processed_data.get('annotations') else 0
+        if phash is not None:
+            new_annotation.perceptual_hash = ImagePerceptualHash(phash=ImagePerceptualHash.to_signed(phash))
+        db.session.add(new_annotation)
+        db.session.flush()
+
+        removed_annotation_id = removed_files = None
+        question_id = params.get('question_id')
+        if params.get('new_question'):
+            question = Question(question_text=params['new_question']['question_text'],
+                                question_type='graphic',
+                                topic_id=params['new_question']['topic_id'],
+                                creator_id=job.creator_id,
+                                image_annotation_id=new_annotation.id)
+            db.session.add(question)
+            adjust_question_counts({question_count_key(question): 1})
+            db.session.flush()
+            question_id = question.id
+        elif question_id:
+            question = db.session.get(Question, question_id)
+            if question is None:
+                raise IngestError(f'Вопрос {question_id} не найден')
+            old_annotation = question.image_annotation
+            question.image_annotation_id = new_annotation.id
+            if old_annotation is not None and old_annotation.id != new_annotation.id:
+                other_count = Question.query.filter(
+                    Question.image_annotation_id == old_annotation.id,
+                    Question.id != question_id
+                ).count()
+                if other_count == 0:
+                    removed_annotation_id, removed_files = _release_annotation(old_annotation)
+
+        db.session.commit()
+        committed = True
+        publish_reference_geometry(new_annotation.id, processed_data)
+        if removed_annotation_id is not None:
+            unpublish_reference_geometry(removed_annotation_id)
+            enqueue_file_release([removed_files], creator_id=job.creator_id)
+
+        update_job(job, stage='derive', processed=INGEST_STAGES.index('derive'))
+        try:
+            derivatives = sorted(derive_future.result())
+        except Exception as e:
+            # Производные будут созданы при первом запросе — загрузка не считается ошибочной
+            logger.warning(f"Ошибка генерации производных для '{params['image_file']}': {e}")
+            derivatives = []
+        try:
+            tiles = tiles_future.result()
+            tile_levels = len(tiles['levels']) if tiles else 0
+        except Exception as e:
+            # Тайлы также создаются при первом запросе описания пирамиды
+            logger.warning(f"Ошибка генерации тайлов для '{params['image_file']}': {e}")
+            tile_levels = 0
+
+        update_job(job, processed=len(INGEST_STAGES), commit=False)
+        return {
+            'annotation_id': new_annotation.id,
+            'question_id': question_id,
+            'contours': contour_count,
+            'derivatives': derivatives,
+            'tile_levels': tile_levels,
+            'duplicates': [{'annotation_id': annotation_id, 'distance': distance}
+                           for annotation_id, distance in duplicates]
+        }
+    except Exception:
+        db.session.rollback()
+        if not committed:
+            for future in (derive_future, tiles_future):
+                if future is not None:
+                    future.exception()  # Дожидаемся производных перед удалением файлов
+            _cleanup_failed(params, upload_folder, job.id)
+        raise
@@ -0,0 +1,189 @@
+# app/utils/label_index.py
+"""
+Инвертированный индекс меток аннотаций
+Метки (категории COCO) хранятся в нормализованной таблице annotation_labels;
+для каждой пары метка–изображение ведётся статистика площадей контуров
+(annotation_label_stats), а контуры ссылаются на метку по label_id. Поиск
+изображений и контуров по метке — индексный запрос без разбора файлов аннотаций
+"""
+import logging
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models.annotation import AnnotationContour, AnnotationLabel, AnnotationLabelStat, ImageAnnotation
+
+logger = logging.getLogger(__name__)
+
+
+def get_or_create_labels(names):
+    """
+    Метки по названиям; отсутствующие создаются (без коммита)
+
+    Args:
+        names (iterable): Названия меток
+
+    Returns:
+        dict: {ключ метки: AnnotationLabel}
+    """
+    wanted = {}
+    for name in names:
+        if name is None or not str(name).strip():
+            continue
+        wanted.setdefault(AnnotationLabel.normalize(name), ' '.join(str(name).split()))
+    if not wanted:
+        return {}
+
+    labels = {label.key: label for label in
+              AnnotationLabel.query.filter(AnnotationLabel.key.in_(list(wanted))).all()}
+    for key, name in wanted.items():
+        if key in labels:
+            continue
+        try:
+            # Метку может одновременно создать другой воркер — вставка в точке сохранения
+            with db.session.begin_nested():
+                label = AnnotationLabel(name=name, key=key)
+                db.session.add(label)
+        except IntegrityError:
+            label = AnnotationLabel.query.filter_by(key=key).one()
+        labels[key] = label
+    return labels
+
+
+def index_annotation_labels(annotation, rows):
+    """
+    Привязка контуров к меткам и пересчёт статистики меток изображения (без коммита)
+
+    Args:
+        annotation (ImageAnnotation): Аннотация изображения
+        rows (list): Объекты AnnotationContour аннотации
+
+    Returns:
+        int: Количество различных меток на изображении
+    """
+    labels = get_or_create_labels(row.label for row in rows)
+    stats = {}
+    for row in rows:
+        if row.label is None or not str(row.label).strip():
+            row.label_ref = None
+            continue
+        label = labels[AnnotationLabel.normalize(row.label)]
+        row.label_ref = label
+        area = float(row.area or 0.0)
+        stat = stats.get(label.key)
+        if stat is None:
+            stats[label.key] = AnnotationLabelStat(label=label, contour_count=1, area_total=area,
+                                                   area_min=area, area_max=area)
+        else:
+            stat.contour_count += 1
+            stat.area_total += area
+            stat.area_min = min(stat.area_min, area)
+            stat.area_max = max(stat.area_max, area)
+
+    if annotation.id is not None and annotation.label_stats:
+        # Старые записи удаляются до вставки новых с тем же первичным ключом
+        annotation.label_stats = []
+        db.session.flush()
+    annotation.label_stats = list(stats.values())
+    return len(stats)
+
+
+def find_label(name):
+    """Метка по названию (без учёта регистра и лишних пробелов) или None"""
+    return AnnotationLabel.query.filter_by(key=AnnotationLabel.normalize(name)).first()
+
+
+def annotations_with_label(name):
+    """
+    Изображения, на которых размечена метка
+
+    Args:
+        name (str): Название метки
+
+    Returns:
+        list: Записи AnnotationLabelStat (с аннотацией и статистикой площадей)
+    """
+    label = find_label(name)
+    if label is None:
+        return []
+    return AnnotationLabelStat.query.filter_by(label_id=label.id) \
+        .order_by(AnnotationLabelStat.annotation_id).all()
+
+
+def label_contours(name, annotation_ids=None):
+    """
+    Контуры метки (по индексу label_id)
+
+    Args:
+        name (str): Название метки
+        annotation_ids (list): Ограничение набором аннотаций
+
+    Returns:
+        list: Объекты AnnotationContour
+    """
+    label = find_label(name)
+    if label is None:
+        return []
+    query = AnnotationContour.query.filter(AnnotationContour.label_id == label.id)
+    if annotation_ids is not None:
+        query = query.filter(AnnotationContour.annotation_id.in_(annotation_ids))
+    return query.order_by(AnnotationContour.annotation_id, AnnotationContour.position).all()
+
+
+def label_statistics(prefix=None):
+    """
+    Сводная статистика по меткам банка аннотаций
+
+    Args:
+        prefix (str): Фильтр по началу названия метки
+
+    Returns:
+        list: [{'id', 'name', 'annotations', 'contours', 'area_total', 'area_mean',
+                'area_min', 'area_max'}, ...] по убыванию числа изображений
+    """
+    query = db.session.query(
+        AnnotationLabel.id,
+        AnnotationLabel.name,
+        func.count(AnnotationLabelStat.annotation_id),
+        func.sum(AnnotationLabelStat.contour_count),
+        func.sum(AnnotationLabelStat.area_total),
+        func.min(AnnotationLabelStat.area_min),
+        func.max(AnnotationLabelStat.area_max)
+    ).join(AnnotationLabelStat, AnnotationLabelStat.label_id == AnnotationLabel.id) \
+        .group_by(AnnotationLabel.id, AnnotationLabel.name)
+    if prefix:
+        query = query.filter(AnnotationLabel.key.startswith(AnnotationLabel.normalize(prefix), autoescape=True))
+
+    result = []
+    for label_id, name, annotations, contours, area_total, area_min, area_max in query.all():
+        result.append({
+            'id': label_id,
+            'name': name,
+            'annotations': annotations,
+            'contours': int(contours or 0),
+            'area_total': float(area_total or 0.0),
+            'area_mean': float(area_total or 0.0) / contours if contours else 0.0,
+            'area_min': area_min,
+            'area_max': area_max
+        })
+    result.sort(key=lambda item: (-item['annotations'], item['name']))
+    return result
+
+
+def rebuild_label_index(batch_size=200):
+    """
+    Заполнение индекса меток для всех аннотаций по сохранённым контурам
+    (для аннотаций, загруженных до появления индекса)
+
+    Returns:
+        int: Количество проиндексированных аннотаций
+    """
+    annotation_ids = [row[0] for row in db.session.query(ImageAnnotation.id).order_by(ImageAnnotation.id)]
+    for start in range(0, len(annotation_ids), batch_size):
+        batch = ImageAnnotation.query.filter(
+            ImageAnnotation.id.in_(annotation_ids[start:start + batch_size])).all()
+        for annotation in batch:
+            index_annotation_labels(annotation, annotation.contours)
+        db.session.commit()
+    return len(annotation_ids)
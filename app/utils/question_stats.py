@@ -0,0 +1,157 @@
+# app/utils/question_stats.py
+"""
+Статистика количества вопросов для конструктора тестов
+Счётчики по (тема, тип, создатель) хранятся в таблице question_counts и
+изменяются в той же транзакции, что и сами вопросы (создание, редактирование,
+удаление); массовые операции (удаление темы или пользователя) пересчитывают
+таблицу одним GROUP BY. Каждое изменение получает номер из общей возрастающей
+последовательности (строка question_count_version, увеличивается атомарно в той
+же транзакции) — по нему строится ETag ответа со статистикой
+"""
+import logging
+from collections import Counter
+
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models.question import Question, QuestionCount, QuestionCountVersion
+from app.models.test_topics import TestTopic
+
+logger = logging.getLogger(__name__)
+
+# Типы вопросов, для которых статистика заполняется нулями
+QUESTION_TYPES = ('open', 'graphic')
+
+
+def question_count_key(question):
+    """
+    Ключ счётчика вопроса
+
+    Returns:
+        tuple: (ID темы, тип вопроса, ID создателя); ID темы — None, если темы нет
+    """
+    try:
+        topic_id = int(question.topic_id) if question.topic_id not in (None, '') else None
+    except (TypeError, ValueError):
+        topic_id = None
+    return topic_id, question.question_type, question.creator_id
+
+
+def _next_version():
+    """
+    Следующий номер изменения: UPDATE ... SET version = version + 1 блокирует
+    строку последовательности до конца транзакции, поэтому параллельные
+    транзакции получают разные номера и фиксируются в порядке их выдачи
+    """
+    statement = update(QuestionCountVersion).where(QuestionCountVersion.id == 1) \
+        .values(version=QuestionCountVersion.version + 1).returning(QuestionCountVersion.version)
+    version = db.session.execute(statement).scalar()
+    if version is not None:
+        return version
+    try:
+        # Первое изменение: строка создаётся с номером после уже выданных счётчикам
+        with db.session.begin_nested():
+            version = (db.session.query(func.max(QuestionCount.version)).scalar() or 0) + 1
+            db.session.add(QuestionCountVersion(id=1, version=version))
+        return version
+    except IntegrityError:
+        return db.session.execute(statement).scalar()
+
+
+def _key_filter(topic_id, question_type, creator_id):
+    return (QuestionCount.topic_id == topic_id,
+            QuestionCount.question_type == question_type,
+            QuestionCount.creator_id == creator_id)  # == None даёт IS NULL
+
+
+def adjust_question_counts(deltas):
+    """
+    Изменение счётчиков (без коммита)
+
+    Args:
+        deltas (dict): {(ID темы, тип, ID создателя): изменение}; ключи без темы пропускаются
+    """
+    deltas = {key: delta for key, delta in Counter(deltas).items() if delta and key[0] is not None}
+    if not deltas:
+        return
+    version = _next_version()
+    for (topic_id, question_type, creator_id), delta in deltas.items():
+        values = {'count': QuestionCount.count + delta, 'version': version}
+        statement = update(QuestionCount).where(*_key_filter(topic_id, question_type, creator_id)).values(**values)
+        if db.session.execute(statement).rowcount:
+            continue
+        try:
+            # Строку может одновременно создать другой воркер — вставка в точке сохранения
+            with db.session.begin_nested():
+                db.session.add(QuestionCount(topic_id=topic_id, question_type=question_type,
+                                             creator_id=creator_id, count=max(delta, 0), version=version))
+        except IntegrityError:
+            db.session.execute(statement)
+
+
+def record_question_change(old_key, question):
+    """Перенос вопроса между счётчиками после редактирования (без коммита)"""
+    new_key = question_count_key(question)
+    if new_key != old_key:
+        adjust_question_counts({old_key: -1, new_key: 1})
+
+
+def rebuild_question_counts():
+    """
+    Пересчёт счётчиков по таблице questions (без коммита); используется для
+    первичного заполнения и после массовых изменений (удаление темы или пользователя)
+
+    Returns:
+        int: Количество непустых счётчиков
+    """
+    db.session.flush()
+    actual = {(topic_id, question_type, creator_id): count
+              for topic_id, question_type, creator_id, count in
+              db.session.query(Question.topic_id, Question.question_type, Question.creator_id,
+                               func.count(Question.id))
+              .filter(Question.topic_id.isnot(None))
+              .group_by(Question.topic_id, Question.question_type, Question.creator_id)}
+    stored = {(row.topic_id, row.question_type, row.creator_id): row.count
+              for row in QuestionCount.query.all()}
+    deltas = {key: actual.get(key, 0) - stored.get(key, 0) for key in actual.keys() | stored.keys()}
+    adjust_question_counts(deltas)
+    return len(actual)
+
+
+def question_stats(creator_id=None):
+    """
+    Количество вопросов по парам (тема, тип) с нулями для всех тем
+
+    Args:
+        creator_id (int): Только вопросы этого создателя (None — все вопросы)
+
+    Returns:
+        dict: {"ID темы,тип": количество}
+    """
+    query = db.session.query(QuestionCount.topic_id, QuestionCount.question_type, func.sum(QuestionCount.count)) \
+        .filter(QuestionCount.count > 0)
+    if creator_id is not None:
+        query = query.filter(QuestionCount.creator_id == creator_id)
+
+    stats = {f"{topic_id},{q_type}": 0 for (topic_id,) in db.session.query(TestTopic.id) for q_type in QUESTION_TYPES}
+    for topic_id, q_type, count in query.group_by(QuestionCount.topic_id, QuestionCount.question_type):
+        stats[f"{topic_id},{q_type}"] = int(count)
+    return stats
+
+
+def question_stats_etag(creator_id=None):
+    """
+    Версия статистики для ETag: последний номер изменения счётчиков в области
+    видимости и набор тем (темы без вопросов тоже попадают в ответ)
+
+    Returns:
+        str: Значение ETag (без кавычек)
+    """
+    query = db.session.query(func.max(QuestionCount.version))
+    if creator_id is not None:
+        query = query.filter(QuestionCount.creator_id == creator_id)
+    version = query.scalar() or 0
+    topic_count, max_topic_id = db.session.query(func.count(TestTopic.id), func.max(TestTopic.id)).one()
+    scope = 'all' if creator_id is None else creator_id
+    return f"qs-{scope}-{version}-{topic_count}-{max_topic_id or 0}"
@@ -0,0 +1,318 @@
+# app/utils/reference_geometry.py
+"""
+Утилиты хранения эталонной геометрии аннотаций в базе данных
+Содержит сохранение разобранных контуров в таблицу annotation_contours
+при загрузке и их чтение при оценке ответов без обращения к файлам
+"""
+import json
+import logging
+import os
+
+import cv2
+import numpy as np
+
+from app import db
+from app.models.annotation import AnnotationContour
+from app.utils.annotation_cache import annotation_cache, load_annotations_cached
+from app.utils.image_processing import probe_image_size, process_yolo_annotations
+from app.utils.contour_store import contour_store
+from app.utils.label_index import index_annotation_labels
+from app.utils.storage import storage, storage_key
+
+logger = logging.getLogger(__name__)
+
+# Аннотации, чья запись в общем хранилище контуров могла устареть (дозапись и пометка
+# удаления не удались): для них геометрия читается из БД
+_stale_store_entries = set()
+
+
+def normalize_contours(processed_data):
+    """
+    Приведение результата разбора аннотаций к записям с вычисленными bbox и площадью
+
+    Args:
+        processed_data (dict): {'labels': [...], 'annotations': [{'label', 'contour', 'bbox'[, 'rle']}, ...]}
+
+    Returns:
+        list: [{'position', 'label', 'contour' (np.ndarray float32), 'bbox', 'area'[, 'rle']}, ...]
+    """
+    contours = []
+    for position, ann in enumerate(processed_data.get('annotations', [])):
+        contour = np.asarray(ann['contour'], dtype=np.float32).reshape(-1, 2)
+        if len(contour) < 3:
+            continue
+
+        bbox = ann.get('bbox')
+        if not bbox or len(bbox) != 4:
+            x_min, y_min = contour.min(axis=0)
+            x_max, y_max = contour.max(axis=0)
+            bbox = [float(x_min), float(y_min), float(x_max - x_min), float(y_max - y_min)]
+
+        entry = {
+            'position': position,
+            'label': ann.get('label'),
+            'contour': contour,
+            'bbox': [float(v) for v in bbox],
+            'area': float(abs(cv2.contourArea(contour)))
+        }
+        if ann.get('rle'):
+            entry['rle'] = ann['rle']
+        contours.append(entry)
+    return contours
+
+
+def build_contour_rows(processed_data):
+    """
+    Построение строк AnnotationContour из результата разбора аннотаций
+
+    Args:
+        processed_data (dict): {'labels': [...], 'annotations': [{'label', 'contour', 'bbox'[, 'rle']}, ...]}
+
+    Returns:
+        list: Несохранённые объекты AnnotationContour
+    """
+    rows = []
+    for entry in normalize_contours(processed_data):
+        bbox = entry['bbox']
+        rows.append(AnnotationContour(
+            position=entry['position'],
+            label=entry['label'],
+            bbox_x=bbox[0],
+            bbox_y=bbox[1],
+            bbox_w=bbox[2],
+            bbox_h=bbox[3],
+            area=entry['area'],
+            vertex_count=len(entry['contour']),
+            points=AnnotationContour.pack_points(entry['contour']),
+            rle=json.dumps(entry['rle']) if entry.get('rle') else None
+        ))
+    return rows
+
+
+def publish_reference_geometry(annotation_id, processed_data):
+    """
+    Дозапись эталонных контуров в общее mmap-хранилище (после коммита в БД)
+
+    Если дозапись не удалась, прежняя версия в хранилище помечается удалённой,
+    чтобы чтение перешло к БД; если не удалась и пометка, хранилище для этой
+    аннотации не используется в текущем процессе
+
+    Args:
+        annotation_id (int): ID аннотации изображения
+        processed_data (dict): Результат разбора аннотаций или None (пометка удаления)
+    """
+    try:
+        contours = normalize_contours(processed_data) if processed_data else []
+        contour_store.append(annotation_id, contours)
+        _stale_store_entries.discard(annotation_id)
+    except Exception as e:
+        logger.warning(f"Не удалось обновить хранилище контуров для аннотации {annotation_id}: {e}")
+        try:
+            contour_store.remove(annotation_id)
+        except Exception as remove_error:
+            logger.error(f"Запись хранилища контуров для аннотации {annotation_id} устарела "
+                         f"и не может быть удалена: {remove_error}")
+            _stale_store_entries.add(annotation_id)
+
+
+def unpublish_reference_geometry(annotation_id):
+    """Пометка аннотации как удалённой в общем mmap-хранилище"""
+    publish_reference_geometry(annotation_id, None)
+
+
+def rebuild_contour_store():
+    """
+    Полная перестройка mmap-хранилища контуров из таблицы annotation_contours
+
+    Returns:
+        int: Количество аннотаций в новом поколении хранилища
+    """
+    def iter_items():
+        rows = db.session.query(
+            AnnotationContour.annotation_id,
+            AnnotationContour.label,
+            AnnotationContour.bbox_x,
+            AnnotationContour.bbox_y,
+            AnnotationContour.bbox_w,
+            AnnotationContour.bbox_h,
+            AnnotationContour.area,
+            AnnotationContour.points,
+            AnnotationContour.rle
+        ).order_by(AnnotationContour.annotation_id, AnnotationContour.position).yield_per(1000)
+
+        current_id = None
+        contours = []
+        for annotation_id, label, bx, by, bw, bh, area, points, rle in rows:
+            if annotation_id != current_id and contours:
+                yield current_id, contours
+                contours = []
+            current_id = annotation_id
+            contours.append({
+                'label': label,
+                'contour': AnnotationContour.unpack_points(points),
+                'bbox': [bx or 0.0, by or 0.0, bw or 0.0, bh or 0.0],
+                'area': area or 0.0,
+                'rle': json.loads(rle) if rle else None
+            })
+        if contours:
+            yield current_id, contours
+
+    count = 0
+
+    def counted():
+        nonlocal count
+        for item in iter_items():
+            count += 1
+            yield item
+
+    contour_store.rebuild(counted())
+    return count
+
+
+def store_reference_geometry(annotation, processed_data):
+    """
+    Сохранение эталонных контуров для аннотации (заменяет существующие)
+    и обновление индекса меток изображения
+
+    Args:
+        annotation (ImageAnnotation): Аннотация изображения (в текущей сессии)
+        processed_data (dict): Результат разбора файла аннотаций
+
+    Returns:
+        int: Количество сохранённых контуров
+    """
+    rows = build_contour_rows(processed_data)
+    annotation.contours = rows
+    index_annotation_labels(annotation, rows)
+    return len(rows)
+
+
+def load_reference_geometry(annotation_id):
+    """
+    Чтение эталонных контуров аннотации из базы данных
+
+    Args:
+        annotation_id (int): ID аннотации изображения
+
+    Returns:
+        dict: {'labels': [...], 'annotations': [{'label', 'contour', 'bbox'[, 'rle']}, ...]}
+            с read-only контурами numpy или None, если геометрия не сохранена
+    """
+    rows = db.session.query(
+        AnnotationContour.label,
+        AnnotationContour.bbox_x,
+        AnnotationContour.bbox_y,
+        AnnotationContour.bbox_w,
+        AnnotationContour.bbox_h,
+        AnnotationContour.points,
+        AnnotationContour.rle
+    ).filter(AnnotationContour.annotation_id == annotation_id) \
+        .order_by(AnnotationContour.position).all()
+
+    if not rows:
+        return None
+
+    labels = []
+    annotations = []
+    for label, bx, by, bw, bh, points, rle in rows:
+        if label not in labels:
+            labels.append(label)
+        entry = {
+            'label': label,
+            'contour': AnnotationContour.unpack_points(points),
+            'bbox': [bx, by, bw, bh] if bx is not None else None
+        }
+        if rle:
+            entry['rle'] = json.loads(rle)
+        annotations.append(entry)
+
+    return {'labels': labels, 'annotations': annotations}
+
+
+def parse_annotation_file(annotation_path, format_type, image_path=None):
+    """
+    Разбор файла аннотаций COCO или YOLO через кэш уровня процесса
+
+    Для YOLO размеры изображения читаются из заголовка файла изображения
+    (без декодирования пикселей) и нужны для перевода нормированных координат.
+
+    Args:
+        annotation_path (str): Путь к файлу аннотаций
+        format_type (str): 'coco' или 'yolo'
+        image_path (str): Путь к изображению (обязателен для YOLO)
+
+    Returns:
+        dict: {'labels': [...], 'annotations': [...]} или None при ошибке разбора
+    """
+    if format_type == 'coco':
+        return load_annotations_cached(annotation_path)
+
+    if format_type == 'yolo':
+        size = probe_image_size(image_path) if image_path and os.path.exists(image_path) else None
+        if size is None:
+            logger.warning(f"Не удалось определить размеры изображения '{image_path}' для аннотаций YOLO")
+            return None
+        width, height = size
+        # Координаты YOLO зависят от размера изображения — он входит в ключ кэша
+        return annotation_cache.get(
+            annotation_path, loader=lambda path: process_yolo_annotations(path, (height, width)),
+            token=('yolo', width, height))
+
+    logger.warning(f"Формат аннотаций '{format_type}' не поддерживается")
+    return None
+
+
+def load_reference_from_file(annotation):
+    """
+    Разбор файла аннотаций с диска (для записей без сохранённой геометрии)
+
+    Args:
+        annotation (ImageAnnotation): Аннотация изображения
+
+    Returns:
+        dict: Результат разбора или None
+    """
+    if not annotation.annotation_file:
+        return None
+    annotation_path = storage.fetch(storage_key('annotations', annotation.annotation_file))
+    if annotation_path is None:
+        logger.warning(f"Файл аннотаций '{annotation.annotation_file}' не найден в хранилище")
+        return None
+
+    return parse_annotation_file(
+        annotation_path,
+        annotation.format_type,
+        storage.fetch(storage_key('images', annotation.image_file)))
+
+
+def get_reference_geometry(annotation):
+    """
+    Получение эталонной геометрии аннотации: из общего mmap-хранилища, затем
+    из БД, а при их отсутствии — из файла с последующим сохранением в БД
+    (для старых записей)
+
+    Args:
+        annotation (ImageAnnotation): Аннотация изображения
+
+    Returns:
+        dict: {'labels': [...], 'annotations': [...]} или None
+    """
+    data = contour_store.get(annotation.id) if annotation.id not in _stale_store_entries else None
+    if data is not None:
+        return data
+
+    data = load_reference_geometry(annotation.id)
+    if data is not None:
+        publish_reference_geometry(annotation.id, data)
+        return data
+
+    data = load_reference_from_file(annotation)
+    if data is None:
+        return None
+
+    try:
+        with db.session.begin_nested():
+            store_reference_geometry(annotation, data)
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить геометрию аннотации {annotation.id}: {e}")
+    return data
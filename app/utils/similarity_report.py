@@ -0,0 +1,113 @@
+# app/utils/similarity_report.py
+"""
+Фоновое построение отчёта о похожих графических ответах
+Результаты тестов отбираются в SQL: только содержащие ответы на графические
+вопросы преподавателя (ключи graphic_<ID> в answers_json), поиск пар
+(MinHash/LSH) выполняется в пуле воркеров, отчёт сохраняется в задаче
+"""
+import logging
+
+from flask import current_app
+from sqlalchemy import String, case, cast, literal, select
+
+from app import db
+from app.models.annotation import TestResult
+from app.models.background_job import BackgroundJob
+from app.models.question import Question
+from app.utils.answer_similarity import find_similar_answers
+from app.utils.background_jobs import create_job, submit_job, job_handler, update_job, fail_stale_jobs
+
+logger = logging.getLogger(__name__)
+
+# Шаг обновления прогресса (результатов тестов)
+_PROGRESS_STEP = 500
+
+
+def graphic_results_query(creator_id=None):
+    """
+    Результаты тестов с ответами на графические вопросы (только нужные столбцы)
+
+    Args:
+        creator_id (int): Только ответы на вопросы этого создателя (None — все вопросы)
+
+    Returns:
+        Query: Строки (id, user_id, answers_json) по возрастанию ID
+    """
+    # Некорректный JSON не должен прерывать запрос: такие ответы пропускаются
+    answers = case((db.func.json_valid(TestResult.answers_json), TestResult.answers_json), else_='{}')
+    answer_keys = db.func.json_each(answers).table_valued('key')
+    matched = select(literal(1)).select_from(answer_keys)
+    if creator_id is None:
+        matched = matched.where(answer_keys.c.key.like('graphic\\_%', escape='\\'))
+    else:
+        matched = matched.join(Question, answer_keys.c.key == literal('graphic_') + cast(Question.id, String)) \
+            .where(Question.question_type == 'graphic', Question.creator_id == creator_id)
+    return db.session.query(TestResult.id, TestResult.user_id, TestResult.answers_json) \
+        .filter(TestResult.answers_json.isnot(None), matched.exists()) \
+        .order_by(TestResult.id)
+
+
+def latest_similarity_report(creator_id):
+    """Последняя задача построения отчёта пользователя или None"""
+    return BackgroundJob.query.filter_by(kind='similarity_report', creator_id=creator_id) \
+        .order_by(BackgroundJob.id.desc()).first()
+
+
+def start_similarity_report(threshold, creator_id, scope_creator_id=None):
+    """
+    Постановка построения отчёта в пул воркеров (незавершённая задача
+    пользователя возвращается вместо новой)
+
+    Args:
+        threshold (float): Минимальная схожесть пары
+        creator_id (int): ID пользователя, запросившего отчёт
+        scope_creator_id (int): Только вопросы этого создателя (None — все вопросы)
+
+    Returns:
+        BackgroundJob: Задача
+    """
+    fail_stale_jobs()
+    job = latest_similarity_report(creator_id)
+    if job is not None and job.status in ('pending', 'running'):
+        return job
+    job = create_job('similarity_report', creator_id=creator_id,
+                     params={'threshold': threshold, 'scope_creator_id': scope_creator_id})
+    submit_job(job)
+    return job
+
+
+@job_handler('similarity_report')
+def run_similarity_report(job):
+    """
+    Поиск пар похожих ответов по отобранным результатам тестов
+
+    Returns:
+        dict: {'pairs': [...] (не более SIMILARITY_REPORT_MAX_ROWS), 'total': всего пар,
+            'results': просмотрено результатов}
+    """
+    params = job.params
+    scope_creator_id = params.get('scope_creator_id')
+    question_ids = None
+    if scope_creator_id is not None:
+        question_ids = {qid for (qid,) in db.session.query(Question.id).filter(
+            Question.question_type == 'graphic', Question.creator_id == scope_creator_id)}
+
+    query = graphic_results_query(scope_creator_id)
+    update_job(job, stage='signatures', processed=0, total=query.order_by(None).count())
+    scanned = 0
+
+    def tracked(rows):
+        nonlocal scanned
+        for row in rows:
+            yield row
+            scanned += 1
+            if scanned % _PROGRESS_STEP == 0:
+                update_job(job, processed=scanned)
+
+    report = find_similar_answers(tracked(query.yield_per(_PROGRESS_STEP)), question_ids=question_ids,
+                                  threshold=params.get('threshold'))
+    update_job(job, stage='done', processed=scanned, commit=False)
+
+    max_rows = current_app.config.get('SIMILARITY_REPORT_MAX_ROWS', 1000)
+    logger.info(f"Отчёт о похожих ответах: {len(report)} пар в {scanned} результатах")
+    return {'pairs': report[:max_rows], 'total': len(report), 'results': scanned}
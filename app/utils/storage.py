@@ -0,0 +1,343 @@
+# app/utils/storage.py
+"""
+Хранилище загруженных файлов с подключаемыми реализациями
+Файлы адресуются ключами вида '<папка>/<имя>' ('images/ab/cd/<sha256>.jpg',
+'annotations/...', 'derived/...', 'tiles/...'). Локальная реализация хранит
+их в UPLOAD_FOLDER; S3-совместимая — в бакете объектного хранилища (AWS S3,
+MinIO, moto_server как локальная замена для проверки), используя UPLOAD_FOLDER
+как локальный кэш узла для обработки файлов (OpenCV, разбор аннотаций).
+Несколько веб-узлов с общим бакетом видят одни и те же загрузки
+"""
+import logging
+import os
+import shutil
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Размер блока потокового чтения
+_STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class StorageError(Exception):
+    """Ошибка хранилища файлов"""
+
+
+class StorageBackend:
+    """
+    Интерфейс хранилища файлов
+
+    Локальная копия объекта всегда находится по пути local_path(key): для
+    локального хранилища это сам файл, для удалённого — кэш узла.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def local_path(self, key):
+        """Путь к локальной копии объекта (с защитой от выхода за пределы корня)"""
+        root = os.path.abspath(self.root)
+        path = os.path.abspath(os.path.join(root, key))
+        if not path.startswith(root + os.sep):
+            raise StorageError(f"Недопустимый ключ: {key}")
+        return path
+
+    def put(self, key, stream):
+        """Сохранение объекта из файлового объекта (потоково)"""
+        tmp_path = self._tmp_path(key)
+        try:
+            with open(tmp_path, 'wb') as f:
+                shutil.copyfileobj(stream, f, _STREAM_CHUNK_SIZE)
+            self.put_file(key, tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def put_file(self, key, path):
+        """Сохранение локального файла под ключом (файл переносится, а не копируется)"""
+        target = self.local_path(key)
+        if os.path.abspath(path) != target:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+        self.publish(key)
+
+    def publish(self, key):
+        """Выгрузка локальной копии (уже записанной по local_path) в хранилище"""
+
+    def fetch(self, key):
+        """Путь к локальной копии объекта (при необходимости копия загружается) или None"""
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def open(self, key):
+        """Файловый объект для чтения в двоичном режиме"""
+        raise NotImplementedError
+
+    def stream(self, key, chunk_size=_STREAM_CHUNK_SIZE):
+        """Генератор содержимого объекта блоками"""
+        with self.open(key) as f:
+            for block in iter(lambda: f.read(chunk_size), b''):
+                yield block
+
+    def get(self, key):
+        """Содержимое объекта целиком"""
+        with self.open(key) as f:
+            return f.read()
+
+    def delete(self, key):
+        """Удаление объекта; True, если объект существовал"""
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix):
+        """Удаление всех объектов с ключами, начинающимися с prefix/"""
+        raise NotImplementedError
+
+    def iter_objects(self, prefix):
+        """
+        Потоковый перечень объектов с ключами, начинающимися с prefix/
+        (без временных файлов .tmp), сгруппированный по каталогам
+
+        Yields:
+            tuple: (ключ, время изменения (timestamp), размер в байтах)
+        """
+        raise NotImplementedError
+
+    def url(self, key, expires=None):
+        """Прямая ссылка на объект или None, если файл отдаёт приложение"""
+        return None
+
+    def _tmp_path(self, key):
+        tmp_dir = os.path.join(self.root, key.split('/', 1)[0], '.tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        return os.path.join(tmp_dir, uuid.uuid4().hex)
+
+    def _remove_local(self, key):
+        """Удаление локальной копии и опустевших каталогов шардов"""
+        path = self.local_path(key)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        self._prune_dirs(os.path.dirname(path), key.split('/', 1)[0])
+        return True
+
+    def _prune_dirs(self, directory, folder):
+        """Удаление пустых каталогов вверх до корня папки (images, tiles, ...)"""
+        folder_root = os.path.abspath(os.path.join(self.root, folder))
+        while os.path.abspath(directory).startswith(folder_root + os.sep):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+
+class LocalStorage(StorageBackend):
+    """Хранилище в локальной файловой системе (UPLOAD_FOLDER)"""
+
+    def fetch(self, key):
+        path = self.local_path(key)
+        return path if os.path.isfile(path) else None
+
+    def exists(self, key):
+        return os.path.isfile(self.local_path(key))
+
+    def open(self, key):
+        try:
+            return open(self.local_path(key), 'rb')
+        except FileNotFoundError:
+            raise StorageError(f"Объект не найден: {key}") from None
+
+    def delete(self, key):
+        try:
+            return self._remove_local(key)
+        except OSError as e:
+            logger.warning(f"Не удалось удалить файл '{key}': {e}")
+            return False
+
+    def delete_prefix(self, prefix):
+        directory = self.local_path(prefix.rstrip('/'))
+        if not os.path.isdir(directory):
+            return 0
+        count = sum(len(files) for _, _, files in os.walk(directory))
+        shutil.rmtree(directory, ignore_errors=True)
+        self._prune_dirs(os.path.dirname(directory), prefix.split('/', 1)[0])
+        return count
+
+    def iter_objects(self, prefix):
+        root = os.path.abspath(self.root)
+        directory = self.local_path(prefix.rstrip('/'))
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames[:] = sorted(d for d in dirnames if not d.endswith('.tmp'))
+            for name in sorted(filenames):
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield os.path.relpath(path, root).replace(os.sep, '/'), stat.st_mtime, stat.st_size
+
+
+class S3Storage(StorageBackend):
+    """
+    S3-совместимое объектное хранилище (boto3 — необязательная зависимость)
+
+    endpoint_url позволяет работать с MinIO или moto_server; локальные копии
+    объектов кэшируются в root и используются повторно.
+    """
+
+    def __init__(self, root, bucket, prefix='', endpoint_url=None, region=None,
+                 access_key=None, secret_key=None, url_expires=3600):
+        super().__init__(root)
+        try:
+            import boto3
+        except ImportError as e:
+            raise StorageError("Для STORAGE_BACKEND='s3' требуется пакет boto3") from e
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.url_expires = url_expires
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region,
+                                   aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+
+    def _object_key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    @staticmethod
+    def _is_missing(error):
+        code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+        return code in ('404', 'NoSuchKey', 'NotFound')
+
+    def publish(self, key):
+        self.client.upload_file(self.local_path(key), self.bucket, self._object_key(key))
+
+    def put(self, key, stream):
+        # Объект сразу выгружается из потока; локальная копия появится при fetch
+        self.client.upload_fileobj(stream, self.bucket, self._object_key(key))
+
+    def fetch(self, key):
+        path = self.local_path(key)
+        if os.path.isfile(path):
+            return path
+        tmp_path = self._tmp_path(key)
+        try:
+            self.client.download_file(self.bucket, self._object_key(key), tmp_path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if self._is_missing(e):
+                return None
+            raise
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return path
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except Exception as e:
+            if self._is_missing(e):
+                return False
+            raise
+
+    def open(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))['Body']
+        except Exception as e:
+            if self._is_missing(e):
+                raise StorageError(f"Объект не найден: {key}") from None
+            raise
+
+    def stream(self, key, chunk_size=_STREAM_CHUNK_SIZE):
+        body = self.open(key)
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def delete(self, key):
+        existed = self.exists(key)
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+        self._remove_local(key)
+        return existed
+
+    def delete_prefix(self, prefix):
+        prefix = prefix.rstrip('/') + '/'
+        count = 0
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._object_key(prefix)):
+            objects = [{'Key': item['Key']} for item in page.get('Contents', [])]
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': objects, 'Quiet': True})
+                count += len(objects)
+        local_dir = self.local_path(prefix.rstrip('/'))
+        shutil.rmtree(local_dir, ignore_errors=True)
+        self._prune_dirs(os.path.dirname(local_dir), prefix.split('/', 1)[0])
+        return count
+
+    def iter_objects(self, prefix):
+        prefix = prefix.rstrip('/') + '/'
+        skip = len(self._object_key(''))
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._object_key(prefix)):
+            for item in page.get('Contents', []):
+                key = item['Key'][skip:]
+                if '.tmp/' in key or key.endswith('.tmp'):
+                    continue
+                yield key, item['LastModified'].timestamp(), item['Size']
+
+    def url(self, key, expires=None):
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self._object_key(key)},
+            ExpiresIn=expires or self.url_expires)
+
+
+class UploadStorage:
+    """
+    Хранилище загрузок уровня процесса: делегирует вызовы реализации,
+    выбранной конфигурацией (STORAGE_BACKEND) при создании приложения
+    """
+
+    def __init__(self):
+        self.backend = None
+
+    def configure(self, config):
+        """Выбор реализации хранилища по конфигурации приложения"""
+        root = config['UPLOAD_FOLDER']
+        backend = config.get('STORAGE_BACKEND', 'local')
+        if backend == 'local':
+            self.backend = LocalStorage(root)
+        elif backend == 's3':
+            self.backend = S3Storage(
+                root,
+                bucket=config['STORAGE_S3_BUCKET'],
+                prefix=config.get('STORAGE_S3_PREFIX', ''),
+                endpoint_url=config.get('STORAGE_S3_ENDPOINT_URL'),
+                region=config.get('STORAGE_S3_REGION'),
+                access_key=config.get('STORAGE_S3_ACCESS_KEY'),
+                secret_key=config.get('STORAGE_S3_SECRET_KEY'),
+                url_expires=config.get('STORAGE_URL_EXPIRES', 3600))
+        else:
+            raise StorageError(f"Неизвестная реализация хранилища: {backend}")
+
+    @property
+    def is_local(self):
+        return isinstance(self.backend, LocalStorage)
+
+    def __getattr__(self, name):
+        if self.backend is None:
+            raise StorageError("Хранилище не настроено (UploadStorage.configure)")
+        return getattr(self.backend, name)
+
+
+# Хранилище уровня процесса (настраивается в create_app)
+storage = UploadStorage()
+
+
+def storage_key(folder, filename):
+    """Ключ объекта: папка и относительное имя файла"""
+    return f"{folder}/{filename}"
@@ -0,0 +1,277 @@
+# app/utils/upload_gc.py
+"""
+Сборка мусора в хранилище загрузок
+Маршруты удаления только ставят в очередь освобождение файлов удалённых
+аннотаций (задача upload_release); периодическая задача upload_gc сверяет
+содержимое папок хранилища с записями ImageAnnotation и удаляет файлы, на
+которые никто не ссылается, — в том числе оставшиеся после ошибок. Перечень
+объектов читается потоково и сверяется с БД порциями; свежие файлы (моложе
+периода отсрочки) не трогаются, режим dry-run только формирует отчёт
+"""
+import logging
+import os
+import time
+
+from flask import current_app
+
+from app import db
+from app.models.annotation import ImageAnnotation
+from app.models.background_job import BackgroundJob
+from app.models.upload_session import UploadSession
+from app.utils.background_jobs import create_job, submit_job, job_handler, update_job
+from app.utils.image_derivatives import remove_image_derivatives
+from app.utils.image_tiles import remove_image_tiles
+from app.utils.storage import storage, storage_key
+from app.utils.upload_storage import release_image
+
+logger = logging.getLogger(__name__)
+
+# Папки хранилища в порядке сверки: производные и тайлы — после исходников
+GC_FOLDERS = ('images', 'annotations', 'derived', 'tiles')
+
+# Размер образца ключей в отчёте
+_REPORT_SAMPLE = 50
+
+
+def enqueue_file_release(files, creator_id=None):
+    """
+    Постановка в очередь освобождения файлов удалённых аннотаций
+    (вызывается после коммита удаления; при ошибке файлы соберёт upload_gc)
+
+    Args:
+        files (list): [(имя изображения, имя файла аннотаций), ...]
+        creator_id (int): ID пользователя
+
+    Returns:
+        BackgroundJob: Задача или None, если освобождать нечего или постановка не удалась
+    """
+    files = [[image_file, annotation_file] for image_file, annotation_file in files
+             if image_file or annotation_file]
+    if not files:
+        return None
+    try:
+        job = create_job('upload_release', params={'files': files}, creator_id=creator_id, total=len(files))
+        submit_job(job)
+        return job
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Не удалось поставить в очередь освобождение файлов {files}: {e}")
+        return None
+
+
+@job_handler('upload_release')
+def run_upload_release(job):
+    """
+    Удаление файлов аннотаций и изображений (с производными и тайлами),
+    на которые больше не ссылается ни одна аннотация
+
+    Returns:
+        dict: {'annotations': удалено файлов аннотаций, 'images': удалено изображений}
+    """
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    removed_annotations = removed_images = 0
+    for processed, (image_file, annotation_file) in enumerate(job.params.get('files', []), start=1):
+        if annotation_file and not ImageAnnotation.query.filter_by(annotation_file=annotation_file).count():
+            if storage.delete(storage_key('annotations', annotation_file)):
+                removed_annotations += 1
+        if image_file and release_unused_image(upload_folder, image_file):
+            removed_images += 1
+        update_job(job, processed=processed)
+    return {'annotations': removed_annotations, 'images': removed_images}
+
+
+def start_upload_gc(dry_run=True, grace_hours=None, creator_id=None):
+    """
+    Постановка задачи сборки мусора в хранилище загрузок
+
+    Args:
+        dry_run (bool): Только отчёт, без удаления
+        grace_hours (float): Период отсрочки (по умолчанию UPLOAD_GC_GRACE_HOURS)
+        creator_id (int): ID пользователя
+
+    Returns:
+        BackgroundJob: Задача
+    """
+    if grace_hours is None:
+        grace_hours = current_app.config.get('UPLOAD_GC_GRACE_HOURS', 24)
+    job = create_job('upload_gc', params={'dry_run': bool(dry_run), 'grace_hours': float(grace_hours)},
+                     creator_id=creator_id)
+    submit_job(job)
+    return job
+
+
+def _protected_files(exclude_job_id=None, exclude_session_id=None):
+    """
+    Файлы, ещё не привязанные к ImageAnnotation, но используемые: активные
+    задачи приёма, незавершённые импорты и собранные поблочные загрузки
+
+    Args:
+        exclude_job_id (int): Задача, которая не учитывается (освобождающая свои файлы)
+        exclude_session_id (str): Сессия загрузки, которая не учитывается
+
+    Returns:
+        tuple: (имена изображений, имена файлов аннотаций, токены импортов)
+    """
+    images, annotations, tokens = set(), set(), set()
+    active = BackgroundJob.query.filter(BackgroundJob.kind.in_(('ingest', 'dataset_import')),
+                                        BackgroundJob.status != 'done')
+    if exclude_job_id is not None:
+        active = active.filter(BackgroundJob.id != exclude_job_id)
+    for job in active:
+        params = job.params
+        if job.kind == 'ingest' and job.status in ('pending', 'running'):
+            images.add(params.get('image_file'))
+            annotations.add(params.get('annotation_file'))
+        elif job.kind == 'dataset_import' and os.path.exists(params.get('archive', '')):
+            # Прерванный импорт можно возобновить — его файлы аннотаций нужны
+            tokens.add(params.get('token'))
+    sessions = db.session.query(UploadSession.kind, UploadSession.stored_file) \
+        .filter(UploadSession.stored_file.isnot(None), UploadSession.kind.in_(('image', 'annotation')))
+    if exclude_session_id is not None:
+        sessions = sessions.filter(UploadSession.id != exclude_session_id)
+    for kind, stored_file in sessions:
+        (images if kind == 'image' else annotations).add(stored_file)
+    return images, annotations, tokens
+
+
+def release_unused_image(upload_folder, filename, exclude_job_id=None, exclude_session_id=None):
+    """
+    Удаление изображения (с производными и тайлами), если на него не ссылаются
+    ни аннотации, ни другие активные задачи приёма, ни сессии загрузки —
+    одинаковые изображения хранятся одним файлом
+
+    Returns:
+        bool: True, если файл был удалён
+    """
+    if not filename or filename in _protected_files(exclude_job_id, exclude_session_id)[0]:
+        return False
+    if not release_image(upload_folder, filename):
+        return False
+    remove_image_derivatives(upload_folder, filename)
+    remove_image_tiles(upload_folder, filename)
+    return True
+
+
+def _image_candidates(stem):
+    """Возможные имена исходника производной или пирамиды (расширение в ключе не сохраняется)"""
+    extensions = current_app.config.get('ALLOWED_IMAGE_EXTENSIONS', {'png', 'jpg', 'jpeg'})
+    return [f"{stem}.{ext}" for ext in extensions] + [f"{stem}.{ext.upper()}" for ext in extensions]
+
+
+def _object_name(folder, key):
+    """
+    Имя, по которому объект сверяется с БД: имя файла для images/annotations,
+    имя исходника без расширения для derived/<размер>/... и tiles/<имя>/...
+    """
+    name = key[len(folder) + 1:]
+    if folder == 'derived':
+        return os.path.splitext(name.split('/', 1)[1])[0] if '/' in name else None
+    if folder == 'tiles':
+        parts = name.split('/')
+        stem_parts = parts[:-1] if parts[-1] == 'info.json' else parts[:-2]
+        return '/'.join(stem_parts) or None
+    return name
+
+
+def _referenced(folder, names):
+    """Подмножество имён, на которые ссылаются записи ImageAnnotation (или используемые файлы)"""
+    protected_images, protected_annotations, tokens = _protected_files()
+    if folder == 'annotations':
+        found = {row[0] for row in db.session.query(ImageAnnotation.annotation_file)
+                 .filter(ImageAnnotation.annotation_file.in_(names))}
+        return {name for name in names if name in found or name in protected_annotations or
+                any(os.path.splitext(name)[0].endswith(f"_{token}") for token in tokens)}
+    if folder == 'images':
+        found = {row[0] for row in db.session.query(ImageAnnotation.image_file)
+                 .filter(ImageAnnotation.image_file.in_(names))}
+        return {name for name in names if name in found or name in protected_images}
+
+    candidates = {candidate: stem for stem in names for candidate in _image_candidates(stem)}
+    found = {candidates[row[0]] for row in db.session.query(ImageAnnotation.image_file)
+             .filter(ImageAnnotation.image_file.in_(list(candidates)))}
+    protected = {os.path.splitext(name)[0] for name in protected_images if name}
+    return {stem for stem in names if stem in found or stem in protected}
+
+
+def _iter_candidates(folder, cutoff):
+    """
+    Объекты папки старше cutoff, сгруппированные по имени сверки
+
+    Тайлы пирамиды одного изображения идут в перечне подряд и дают одного
+    кандидата (удаляется вся пирамида); время изменения — самое позднее.
+
+    Yields:
+        tuple: (имя сверки, [ключи], суммарный размер)
+    """
+    current, keys, size, newest = None, [], 0, 0.0
+    for key, mtime, obj_size in storage.iter_objects(folder):
+        name = _object_name(folder, key)
+        if name is None:
+            continue
+        if name != current:
+            if current is not None and newest < cutoff:
+                yield current, keys, size
+            current, keys, size, newest = name, [], 0, 0.0
+        keys.append(key)
+        size += obj_size
+        newest = max(newest, mtime)
+    if current is not None and newest < cutoff:
+        yield current, keys, size
+
+
+@job_handler('upload_gc')
+def run_upload_gc(job):
+    """
+    Сверка папок хранилища с записями ImageAnnotation и удаление
+    неиспользуемых файлов старше периода отсрочки
+
+    Returns:
+        dict: {'dry_run', 'grace_hours', 'scanned', 'orphans': {папка: число},
+               'bytes', 'deleted', 'sample': [ключи]}
+    """
+    params = job.params
+    dry_run = params.get('dry_run', True)
+    grace_hours = params.get('grace_hours', current_app.config.get('UPLOAD_GC_GRACE_HOURS', 24))
+    batch_size = current_app.config.get('UPLOAD_GC_BATCH_SIZE', 500)
+    cutoff = time.time() - grace_hours * 3600
+    report = {'dry_run': dry_run, 'grace_hours': grace_hours, 'scanned': 0,
+              'orphans': {folder: 0 for folder in GC_FOLDERS}, 'bytes': 0, 'deleted': 0, 'sample': []}
+
+    def collect(folder, batch):
+        referenced = _referenced(folder, [name for name, _keys, _size in batch])
+        for name, keys, size in batch:
+            if name in referenced:
+                continue
+            report['orphans'][folder] += 1
+            report['bytes'] += size
+            if len(report['sample']) < _REPORT_SAMPLE:
+                report['sample'].append(keys[0] if folder != 'tiles' else storage_key('tiles', name))
+            if dry_run:
+                continue
+            try:
+                if folder == 'tiles':
+                    storage.delete_prefix(storage_key('tiles', name))
+                else:
+                    for key in keys:
+                        storage.delete(key)
+                report['deleted'] += 1
+            except Exception as e:
+                logger.warning(f"Сборка мусора: не удалось удалить '{keys[0]}': {e}")
+        report['scanned'] += len(batch)
+
+    for folder in GC_FOLDERS:
+        update_job(job, stage=folder)
+        batch = []
+        for candidate in _iter_candidates(folder, cutoff):
+            batch.append(candidate)
+            if len(batch) >= batch_size:
+                collect(folder, batch)
+                batch = []
+                update_job(job, processed=report['scanned'])
+        if batch:
+            collect(folder, batch)
+        update_job(job, processed=report['scanned'])
+
+    logger.info(f"Сборка мусора в хранилище загрузок ({'dry-run' if dry_run else 'удаление'}): "
+                f"{sum(report['orphans'].values())} неиспользуемых объектов, {report['bytes']} байт")
+    return report
@@ -0,0 +1,168 @@
+# app/utils/upload_storage.py
+"""
+Контентно-адресуемое хранение загруженных изображений
+Файл хешируется (SHA-256) во время потоковой записи на диск и сохраняется
+под именем своего хеша в шардированных подкаталогах (ab/cd/abcd....jpg);
+одинаковые загрузки разделяют один файл, число ссылок считается по ImageAnnotation.
+Готовый файл передаётся в хранилище загрузок (app.utils.storage)
+"""
+import hashlib
+import logging
+import os
+import re
+import uuid
+
+from app import db
+from app.models.annotation import ImageAnnotation
+from app.utils.storage import storage, storage_key
+
+logger = logging.getLogger(__name__)
+
+# Размер блока потокового копирования загрузки
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+# Имя контентно-адресуемого файла: ab/cd/<64 hex>.<ext>
+_CONTENT_NAME_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[A-Za-z0-9]+)?$')
+
+
+def content_filename(digest, ext):
+    """Относительное имя файла по хешу содержимого: два уровня шардирования"""
+    ext = ext.lower().lstrip('.')
+    name = f"{digest}.{ext}" if ext else digest
+    return f"{digest[:2]}/{digest[2:4]}/{name}"
+
+
+def is_content_addressed(filename):
+    """Проверка, что имя файла является контентно-адресуемым (неизменяемым)"""
+    return bool(filename and _CONTENT_NAME_RE.match(filename))
+
+
+def store_upload(file_storage, upload_folder, folder='images', ext=None):
+    """
+    Потоковое сохранение загрузки с вычислением хеша и дедупликацией
+
+    Args:
+        file_storage (FileStorage): Загруженный файл (werkzeug)
+        upload_folder (str): Корневая папка загрузок
+        folder (str): Подпапка ('images')
+        ext (str): Расширение (по умолчанию — из имени загружаемого файла)
+
+    Returns:
+        tuple: (относительное имя файла, True если файл уже существовал)
+    """
+    if ext is None:
+        ext = os.path.splitext(file_storage.filename or '')[1]
+    return store_stream(file_storage.stream, upload_folder, folder, ext)
+
+
+def store_stream(stream, upload_folder, folder='images', ext=''):
+    """
+    Потоковое сохранение содержимого файлового объекта по хешу
+
+    Содержимое пишется во временный файл блоками, одновременно считается
+    SHA-256; затем файл атомарно переносится на место по хешу. Если такой
+    файл уже есть, временная копия удаляется.
+
+    Args:
+        stream: Файловый объект, открытый на чтение в двоичном режиме
+        upload_folder (str): Корневая папка загрузок
+        folder (str): Подпапка ('images')
+        ext (str): Расширение файла
+
+    Returns:
+        tuple: (относительное имя файла, True если файл уже существовал)
+    """
+    base_dir = os.path.join(upload_folder, folder)
+    tmp_dir = os.path.join(base_dir, '.tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+
+    digest = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = stream.read(_COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+
+        return _move_into_place(tmp_path, digest.hexdigest(), folder, ext)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def store_file(path, upload_folder, folder='images', ext=''):
+    """
+    Перенос уже записанного файла (например, собранного из блоков) в хранилище
+    по хешу содержимого. Файл должен находиться на той же файловой системе,
+    что и хранилище (папка <folder>/.tmp), — перенос выполняется без копирования
+
+    Args:
+        path (str): Путь к файлу
+        upload_folder (str): Корневая папка загрузок
+        folder (str): Подпапка ('images')
+        ext (str): Расширение файла
+
+    Returns:
+        tuple: (относительное имя файла, True если файл уже существовал)
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(_COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return _move_into_place(path, digest.hexdigest(), folder, ext)
+
+
+def _move_into_place(tmp_path, hexdigest, folder, ext):
+    """Перенос временного файла в хранилище под ключом по хешу (дубликат удаляется)"""
+    filename = content_filename(hexdigest, ext)
+    key = storage_key(folder, filename)
+    if storage.exists(key):
+        os.remove(tmp_path)
+        return filename, True
+
+    storage.put_file(key, tmp_path)
+    return filename, False
+
+
+def image_reference_count(filename, exclude_annotation_id=None):
+    """
+    Количество аннотаций, ссылающихся на файл изображения
+
+    Args:
+        filename (str): Относительное имя файла в папке images
+        exclude_annotation_id (int): ID аннотации, которая не учитывается (удаляемая)
+
+    Returns:
+        int: Число ссылок
+    """
+    query = db.session.query(db.func.count(ImageAnnotation.id)) \
+        .filter(ImageAnnotation.image_file == filename)
+    if exclude_annotation_id is not None:
+        query = query.filter(ImageAnnotation.id != exclude_annotation_id)
+    return query.scalar()
+
+
+def release_image(upload_folder, filename, exclude_annotation_id=None):
+    """
+    Удаление файла изображения, если на него больше не ссылается ни одна аннотация
+
+    Args:
+        upload_folder (str): Корневая папка загрузок
+        filename (str): Относительное имя файла в папке images
+        exclude_annotation_id (int): ID удаляемой аннотации
+
+    Returns:
+        bool: True, если файл был удалён
+    """
+    if not filename or image_reference_count(filename, exclude_annotation_id) > 0:
+        return False
+
+    # Пустые каталоги шардов хранилище удаляет само
+    return storage.delete(storage_key('images', filename))
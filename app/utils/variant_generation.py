@@ -0,0 +1,457 @@
+# app/utils/variant_generation.py
+"""
+Генерация вариантов тестов
+Пулы вопросов для элементов структуры теста (тема, тип вопроса, область
+видимости создателя) загружаются одним запросом только по ID, после чего
+варианты собираются выборкой в памяти — число запросов не зависит от
+количества вариантов и элементов структуры.
+
+Внутри варианта вопросы одного пула выбираются без повторений; уникальность
+наборов проверяется по хеш-индексу канонических кортежей ID (отсортированных),
+куда входят и уже сохранённые варианты теста. Вопросы пула раздаются «колодой»:
+следующая перетасовка начинается, только когда розданы все вопросы, поэтому
+вопросы используются равномерно, а пересечение вариантов минимально.
+Время генерации линейно по числу вариантов.
+
+Большие партии генерируются фоновой задачей variant_generation: варианты
+собираются порциями и записываются пакетными вставками, каждая порция —
+отдельная транзакция вместе с отметкой прогресса.
+
+Состав варианта записывается одновременно в question_id_list и в таблицу
+variant_questions (вариант, позиция, вопрос): выборки «какие варианты
+используют вопрос» и состав варианта — индексные запросы без разбора JSON
+"""
+import itertools
+import json
+import logging
+import math
+import random
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import func, insert, or_, select, tuple_
+
+from app import db
+from app.models.background_job import BackgroundJob
+from app.models.question import Question
+from app.models.test_variant import Test, Variant, VariantQuestion
+from app.utils.background_jobs import (create_job, submit_job, job_handler, update_job, fail_stale_jobs,
+                                      job_is_stale, requeue_job)
+
+logger = logging.getLogger(__name__)
+
+# Полный перебор наборов, если их не больше чем в столько раз превышает потребность
+_EXHAUSTIVE_FACTOR = 4
+
+
+class VariantGenerationError(Exception):
+    """Ошибка генерации вариантов с сообщением для пользователя"""
+
+
+def pool_key(item):
+    """
+    Ключ пула вопросов для элемента структуры теста
+
+    Returns:
+        tuple: (ID темы, тип вопроса) или None для некорректного элемента
+    """
+    topic_id = item.get('topic_id') if isinstance(item, dict) else None
+    q_type = item.get('question_type') if isinstance(item, dict) else None
+    if not topic_id or not q_type:
+        return None
+    try:
+        return int(topic_id), q_type
+    except (TypeError, ValueError):
+        return None
+
+
+def load_question_pools(structure, creator_id=None):
+    """
+    ID вопросов для всех различных пар (тема, тип) структуры одним запросом
+
+    Args:
+        structure (list): Структура теста [{'topic_id', 'question_type'}, ...]
+        creator_id (int): Только вопросы этого создателя (None — все вопросы)
+
+    Returns:
+        dict: {(ID темы, тип вопроса): [ID вопросов по возрастанию]}
+    """
+    keys = {key for key in map(pool_key, structure) if key is not None}
+    if not keys:
+        return {}
+
+    # Графические вопросы без аннотации (изображение не обработано) в варианты не попадают
+    query = db.session.query(Question.topic_id, Question.question_type, Question.id) \
+        .filter(tuple_(Question.topic_id, Question.question_type).in_(sorted(keys))) \
+        .filter(or_(Question.question_type != 'graphic', Question.image_annotation_id.isnot(None)))
+    if creator_id is not None:
+        query = query.filter(Question.creator_id == creator_id)
+
+    pools = {key: [] for key in keys}
+    for topic_id, q_type, question_id in query.order_by(Question.id):
+        pools[(topic_id, q_type)].append(question_id)
+    return pools
+
+
+def variant_key(question_ids):
+    """Канонический ключ набора вопросов варианта (порядок не важен)"""
+    return tuple(sorted(question_ids))
+
+
+def pool_demand(structure):
+    """
+    Сколько вопросов каждого пула нужно на один вариант
+
+    Returns:
+        Counter: {(ID темы, тип вопроса): число элементов структуры}
+        или None, если в структуре есть некорректный элемент
+    """
+    keys = [pool_key(item) for item in structure]
+    if None in keys:
+        return None
+    return Counter(keys)
+
+
+def pool_shortages(demand, pools):
+    """
+    Пулы, в которых вопросов меньше, чем элементов структуры
+
+    Returns:
+        list: [(ключ пула, нужно, доступно), ...]
+    """
+    return [(key, needed, len(pools.get(key, ()))) for key, needed in demand.items()
+            if len(pools.get(key, ())) < needed]
+
+
+def variant_capacity(demand, pools, limit=None):
+    """
+    Число различных наборов вопросов, которые допускают пулы
+
+    Args:
+        demand (Counter): Результат pool_demand
+        pools (dict): Результат load_question_pools
+        limit (int): Подсчёт останавливается, как только произведение превысит limit
+
+    Returns:
+        int: Произведение C(размер пула, нужно) по всем пулам
+    """
+    capacity = 1
+    for key, needed in demand.items():
+        capacity *= math.comb(len(pools.get(key, ())), needed)
+        if limit is not None and capacity > limit:
+            break
+    return capacity
+
+
+def load_variant_index(test_id):
+    """
+    Хеш-индекс наборов вопросов уже сохранённых вариантов теста
+
+    Returns:
+        set: {канонический ключ, ...}
+    """
+    rows = db.session.query(VariantQuestion.variant_id, VariantQuestion.question_id) \
+        .join(Variant, Variant.id == VariantQuestion.variant_id) \
+        .filter(Variant.test_id == test_id) \
+        .order_by(VariantQuestion.variant_id)
+    return {variant_key(question_id for _variant_id, question_id in group)
+            for _key, group in itertools.groupby(rows, key=lambda row: row[0])}
+
+
+def build_variant(test_id, question_ids):
+    """Новый вариант с позициями вопросов (для добавления через сессию)"""
+    return Variant(test_id=test_id,
+                   question_id_list=json.dumps(question_ids, ensure_ascii=False),
+                   items=[VariantQuestion(position=position, question_id=question_id)
+                          for position, question_id in enumerate(question_ids)])
+
+
+def insert_variants(test_id, question_lists):
+    """
+    Пакетная вставка вариантов и их позиций (без коммита)
+
+    Args:
+        test_id (int): ID теста
+        question_lists (list): [[ID вопросов], ...]
+
+    Returns:
+        list: ID созданных вариантов в порядке question_lists
+    """
+    if not question_lists:
+        return []
+    statement = insert(Variant).returning(Variant.id, sort_by_parameter_order=True)
+    variant_ids = db.session.execute(statement, [
+        {'test_id': test_id, 'question_id_list': json.dumps(question_ids, ensure_ascii=False)}
+        for question_ids in question_lists
+    ]).scalars().all()
+    db.session.execute(insert(VariantQuestion), [
+        {'variant_id': variant_id, 'position': position, 'question_id': question_id}
+        for variant_id, question_ids in zip(variant_ids, question_lists)
+        for position, question_id in enumerate(question_ids)
+    ])
+    return variant_ids
+
+
+def backfill_variant_questions(batch_size=1000):
+    """
+    Заполнение variant_questions по question_id_list вариантов, созданных до
+    появления таблицы (ID удалённых вопросов пропускаются, позиции сохраняются)
+
+    Returns:
+        int: Количество обработанных вариантов
+    """
+    filled = select(VariantQuestion.variant_id).where(VariantQuestion.variant_id == Variant.id).exists()
+    pending = db.session.query(Variant.id, Variant.question_id_list).filter(~filled).order_by(Variant.id).all()
+    existing = {question_id for (question_id,) in db.session.query(Question.id)}
+    for start in range(0, len(pending), batch_size):
+        rows = []
+        for variant_id, question_id_list in pending[start:start + batch_size]:
+            try:
+                question_ids = json.loads(question_id_list or '[]')
+            except (TypeError, ValueError):
+                logger.warning(f"Некорректный список вопросов варианта {variant_id}")
+                continue
+            rows.extend({'variant_id': variant_id, 'position': position, 'question_id': int(question_id)}
+                        for position, question_id in enumerate(question_ids)
+                        if isinstance(question_id, int) and question_id in existing)
+        if rows:
+            db.session.execute(insert(VariantQuestion), rows)
+        db.session.commit()
+    return len(pending)
+
+
+def question_usage(question_ids):
+    """
+    Количество вариантов, использующих вопросы
+
+    Returns:
+        dict: {ID вопроса: число вариантов} (только для используемых вопросов)
+    """
+    if not question_ids:
+        return {}
+    return dict(db.session.query(VariantQuestion.question_id, func.count(func.distinct(VariantQuestion.variant_id)))
+                .filter(VariantQuestion.question_id.in_(list(question_ids)))
+                .group_by(VariantQuestion.question_id))
+
+
+def question_impact(question_id):
+    """
+    Что затронет удаление вопроса
+
+    Returns:
+        tuple: (число вариантов, число тестов), использующих вопрос
+    """
+    return db.session.query(func.count(func.distinct(Variant.id)), func.count(func.distinct(Variant.test_id))) \
+        .join(VariantQuestion, VariantQuestion.variant_id == Variant.id) \
+        .filter(VariantQuestion.question_id == question_id).one()
+
+
+def _enumerate_variants(keys, demand, pools, count, index):
+    """Случайные наборы из полного перечня ещё не использованных (для малых пулов)"""
+    pool_keys = list(demand)
+    free = []
+    for combination in itertools.product(*(itertools.combinations(pools[key], demand[key]) for key in pool_keys)):
+        drawn = dict(zip(pool_keys, combination))
+        canonical = variant_key(qid for key in pool_keys for qid in drawn[key])
+        if canonical not in index:
+            free.append(drawn)
+
+    variants = []
+    for drawn in random.sample(free, min(count, len(free))):
+        drawn = {key: random.sample(ids, len(ids)) for key, ids in drawn.items()}
+        question_ids = [drawn[key].pop() for key in keys]
+        index.add(variant_key(question_ids))
+        variants.append(question_ids)
+    return variants
+
+
+class _QuestionDeck:
+    """Перетасованная колода ID вопросов одного пула"""
+
+    def __init__(self, pool):
+        self.pool = list(pool)
+        self.cards = []
+
+    def draw(self, count):
+        """count различных вопросов; колода пополняется без повторения остатка"""
+        if len(self.cards) < count:
+            rest = set(self.cards)
+            fresh = [qid for qid in self.pool if qid not in rest]
+            random.shuffle(fresh)
+            # Остаток прошлой колоды раздаётся первым (вынимается с конца)
+            self.cards = fresh + self.cards
+        drawn = self.cards[-count:]
+        del self.cards[-count:]
+        return drawn
+
+
+def generate_unique_variants(structure, pools, count, index=None, max_attempts=None):
+    """
+    Генерация наборов вопросов с различными составами
+
+    Пулы должны покрывать структуру (см. pool_shortages). Если различных наборов
+    немногим больше, чем нужно, они перебираются полностью; иначе при коллизии
+    делается до max_attempts случайных попыток, после чего генерация
+    останавливается — вызывающий код сравнивает длину результата с count.
+
+    Args:
+        structure (list): Структура теста
+        pools (dict): Результат load_question_pools
+        count (int): Число вариантов
+        index (set): Хеш-индекс существующих наборов (дополняется новыми)
+        max_attempts (int): Попыток на вариант (по умолчанию VARIANT_GENERATION_MAX_ATTEMPTS)
+
+    Returns:
+        list: [[ID вопросов в порядке структуры], ...]
+    """
+    if max_attempts is None:
+        max_attempts = current_app.config.get('VARIANT_GENERATION_MAX_ATTEMPTS', 50)
+    index = set() if index is None else index
+    keys = [pool_key(item) for item in structure]
+    demand = Counter(keys)
+
+    # Пулы почти исчерпаны: случайные попытки неэффективны, наборы перебираются
+    limit = _EXHAUSTIVE_FACTOR * (len(index) + count)
+    if variant_capacity(demand, pools, limit=limit) <= limit:
+        return _enumerate_variants(keys, demand, pools, count, index)
+
+    decks = {key: _QuestionDeck(pools[key]) for key in demand}
+    variants = []
+    for _i in range(count):
+        for attempt in range(max_attempts):
+            if attempt == 0:
+                drawn = {key: decks[key].draw(needed) for key, needed in demand.items()}
+            else:
+                # Коллизия с существующим набором: случайная выборка без колоды
+                drawn = {key: random.sample(pools[key], needed) for key, needed in demand.items()}
+            question_ids = [drawn[key].pop() for key in keys]
+            canonical = variant_key(question_ids)
+            if canonical not in index:
+                index.add(canonical)
+                variants.append(question_ids)
+                break
+        else:
+            logger.info(f"Уникальный набор вопросов не найден за {max_attempts} попыток "
+                        f"(сгенерировано {len(variants)} из {count})")
+            break
+    return variants
+
+
+def active_variant_generation(test_id):
+    """Незавершённая задача генерации вариантов теста или None"""
+    jobs = BackgroundJob.query.filter(BackgroundJob.kind == 'variant_generation',
+                                      BackgroundJob.status.in_(('pending', 'running')))
+    return next((job for job in jobs if job.params.get('test_id') == test_id), None)
+
+
+def latest_variant_generation(test_id):
+    """Последняя задача генерации вариантов теста или None"""
+    jobs = BackgroundJob.query.filter(BackgroundJob.kind == 'variant_generation') \
+        .order_by(BackgroundJob.id.desc())
+    return next((job for job in jobs if job.params.get('test_id') == test_id), None)
+
+
+def variant_generation_resumable(job):
+    """Генерацию можно продолжить: задача завершилась ошибкой или зависла, не всё создано"""
+    return job.kind == 'variant_generation' and (job.status == 'failed' or job_is_stale(job)) and \
+        (job.processed or 0) < job.params.get('count', 0)
+
+
+def resume_variant_generation(job):
+    """
+    Повторная постановка прерванной генерации (продолжается с job.processed)
+
+    Returns:
+        bool: True, если задача поставлена в очередь
+    """
+    if not variant_generation_resumable(job):
+        return False
+    fail_stale_jobs()
+    if active_variant_generation(job.params.get('test_id')) is not None:
+        return False
+    return requeue_job(job, message='Генерация возобновлена')
+
+
+def start_variant_generation(test, count, creator_id, pool_creator_id=None):
+    """
+    Постановка фоновой генерации большой партии вариантов
+
+    Args:
+        test (Test): Тест
+        count (int): Число вариантов (до VARIANT_BULK_MAX_COUNT)
+        creator_id (int): ID пользователя
+        pool_creator_id (int): Брать только вопросы этого создателя (None — все вопросы)
+
+    Returns:
+        BackgroundJob: Задача
+
+    Raises:
+        VariantGenerationError: Некорректное количество или генерация для теста уже идёт
+    """
+    max_count = current_app.config.get('VARIANT_BULK_MAX_COUNT', 10000)
+    if count < 1 or count > max_count:
+        raise VariantGenerationError(f'Количество должно быть от 1 до {max_count}')
+    fail_stale_jobs()  # задача, прерванная сбоем процесса, не блокирует генерацию
+    if active_variant_generation(test.id) is not None:
+        # Параллельные задачи не видят наборы друг друга и могли бы их повторить
+        raise VariantGenerationError('Генерация вариантов для этого теста уже выполняется')
+
+    job = create_job('variant_generation',
+                     params={'test_id': test.id, 'count': count, 'pool_creator_id': pool_creator_id},
+                     creator_id=creator_id, total=count)
+    submit_job(job)
+    return job
+
+
+@job_handler('variant_generation')
+def run_variant_generation(job):
+    """
+    Генерация вариантов порциями по VARIANT_BULK_CHUNK_SIZE с пакетной
+    вставкой; прерванная задача продолжается с job.processed
+
+    Returns:
+        dict: {'created': создано вариантов, 'requested': запрошено}
+    """
+    params = job.params
+    count = params['count']
+    created = job.processed or 0
+    chunk_size = current_app.config.get('VARIANT_BULK_CHUNK_SIZE', 500)
+
+    test = db.session.get(Test, params['test_id'])
+    if test is None:
+        raise VariantGenerationError('Тест не найден')
+    try:
+        structure = json.loads(test.structure) if test.structure else []
+    except (TypeError, ValueError):
+        raise VariantGenerationError('Некорректная структура теста')
+    demand = pool_demand(structure) if structure else None
+    if demand is None:
+        raise VariantGenerationError('Структура теста пуста или содержит пустой элемент')
+
+    update_job(job, stage='prepare')
+    pools = load_question_pools(structure, creator_id=params.get('pool_creator_id'))
+    shortages = pool_shortages(demand, pools)
+    if shortages:
+        raise VariantGenerationError('Недостаточно вопросов: ' + '; '.join(
+            f'тема {key[0]}, тип {key[1]} — нужно {needed}, доступно {available}'
+            for key, needed, available in shortages))
+    index = load_variant_index(test.id)
+    capacity = variant_capacity(demand, pools, limit=len(index) + count - created)
+    if capacity < len(index) + count - created:
+        raise VariantGenerationError(f'Пулы вопросов допускают не более {capacity} различных вариантов '
+                                     f'(уже создано {len(index)})')
+
+    update_job(job, stage='generate', processed=created, total=count)
+    while created < count:
+        needed = min(chunk_size, count - created)
+        question_lists = generate_unique_variants(structure, pools, needed, index=index)
+        insert_variants(test.id, question_lists)
+        created += len(question_lists)
+        job.result = {'created': created, 'requested': count}
+        update_job(job, processed=created)  # commit порции
+        if len(question_lists) < needed:
+            update_job(job, message=f'Удалось подобрать только {created} различных вариантов из {count}')
+            break
+
+    logger.info(f"Тест {test.id}: сгенерировано {created} вариантов из {count}")
+    return {'created': created, 'requested': count}
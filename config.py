@@ -19,8 +19,31 @@ class Config:
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
     IMAGES_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, 'images')
     ANNOTATIONS_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, 'annotations')
+    CONTOUR_STORE_FOLDER = os.path.join(UPLOAD_FOLDER, 'geometry')  # Общее mmap-хранилище контуров
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
 
+    # Хранилище загрузок: 'local' (UPLOAD_FOLDER) или 's3' (S3-совместимое, нужен boto3).
+    # При 's3' UPLOAD_FOLDER служит локальным кэшем узла, а загрузки общие для всех узлов
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+    STORAGE_S3_BUCKET = os.environ.get('STORAGE_S3_BUCKET')
+    STORAGE_S3_PREFIX = os.environ.get('STORAGE_S3_PREFIX', '')
+    STORAGE_S3_ENDPOINT_URL = os.environ.get('STORAGE_S3_ENDPOINT_URL')  # MinIO, moto_server
+    STORAGE_S3_REGION = os.environ.get('STORAGE_S3_REGION')
+    STORAGE_S3_ACCESS_KEY = os.environ.get('STORAGE_S3_ACCESS_KEY')
+    STORAGE_S3_SECRET_KEY = os.environ.get('STORAGE_S3_SECRET_KEY')
+    STORAGE_URL_EXPIRES = 3600  # Срок действия подписанных ссылок на объекты, сек
+
+    # Сборка мусора в хранилище загрузок (задача upload_gc, команда flask gc-uploads)
+    UPLOAD_GC_GRACE_HOURS = 24  # Файлы моложе периода отсрочки не удаляются
+    UPLOAD_GC_BATCH_SIZE = 500  # Порция ключей при сверке с БД
+
+    # Настройки разбора COCO: файлы больше порога читаются потоково
+    COCO_STREAMING_THRESHOLD = 8 * 1024 * 1024  # 8MB
+    COCO_STREAM_CHUNK_SIZE = 64 * 1024  # Размер блока чтения
+
+    # Бюджет памяти кэша разобранных аннотаций (на процесс)
+    ANNOTATION_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 64MB
+
     # Указываем путь к каталогу с переводами
     BABEL_TRANSLATION_DIRECTORIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'translations')
     BABEL_DEFAULT_LOCALE = 'ru'  # Язык по умолчанию
@@ -41,6 +64,13 @@ class Config:
     # Константы приложения
     ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg'}
     ALLOWED_ANNOTATION_EXTENSIONS = {'json', 'txt'}
+    ALLOWED_ARCHIVE_EXTENSIONS = {'zip'}
+
+    # Поблочная загрузка больших файлов (блок должен быть меньше MAX_CONTENT_LENGTH)
+    CHUNKED_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+    CHUNKED_UPLOAD_MAX_BYTES = 2 * 1024 * 1024 * 1024
+    CHUNKED_UPLOAD_TTL_HOURS = 24  # Незавершённые и невостребованные сессии удаляются
+
     CONTOUR_THRESHOLD = 0.5
     LABEL_THRESHOLD = {
         'overlap_ratio': 0.9,
@@ -53,4 +83,48 @@ class Config:
         'boundary_match': 0.3,
         'presence': 0.2,
         'label_match': 0.1
-    }
\ No newline at end of file
+    }
+
+    # Размер холста для рисования контуров (ширина, высота)
+    CANVAS_SIZE = (600, 400)
+
+    # Пул фоновых воркеров (приём загрузок); False — выполнение задач в запросе
+    BACKGROUND_JOBS_ASYNC = True
+    BACKGROUND_WORKERS = 2
+    BACKGROUND_SIDE_WORKERS = 2  # Параллельные этапы задач (производные изображений)
+    BACKGROUND_JOB_STALE_MINUTES = 30  # Задача без обновлений дольше считается прерванной
+
+    # Порог расстояния Хэмминга между перцептивными хешами для предупреждения о дубликатах (< 8 — точный поиск)
+    PHASH_DUPLICATE_DISTANCE = 6
+
+    # Массовый импорт наборов данных (ZIP + COCO)
+    DATASET_IMPORT_BATCH_SIZE = 50  # Изображений в одной транзакции
+    DATASET_IMPORT_MAX_IMAGE_BYTES = 64 * 1024 * 1024
+    DATASET_IMPORT_QUESTION_TEMPLATE = 'Обведите на изображении: {labels}'
+
+    # Генерация вариантов: попыток подобрать уникальный набор вопросов для одного варианта
+    VARIANT_GENERATION_MAX_ATTEMPTS = 50
+    # Партии больше 50 вариантов генерируются фоновой задачей порциями
+    VARIANT_BULK_MAX_COUNT = 10000
+    VARIANT_BULK_CHUNK_SIZE = 500  # Вариантов в одной транзакции
+
+    # Производные изображений, создаваемые при загрузке (?size=<имя> в main.uploaded_file)
+    IMAGE_DERIVATIVES = {
+        'canvas': {'size': CANVAS_SIZE},
+        'canvas2x': {'size': (CANVAS_SIZE[0] * 2, CANVAS_SIZE[1] * 2)},
+        'thumb': {'size': (160, 120), 'keep_aspect': True}
+    }
+    IMAGE_DERIVATIVE_FORMAT = 'webp'
+    IMAGE_DERIVATIVE_QUALITY = 80
+    IMAGE_DERIVATIVE_CACHE_SECONDS = 7 * 24 * 3600
+
+    # Тайловая пирамида изображений для масштабирования холста (main.image_tile)
+    IMAGE_TILE_SIZE = 256
+    IMAGE_TILE_CACHE_SECONDS = 365 * 24 * 3600  # Тайлы изображений по хешу содержимого неизменяемы
+
+    # Настройки поиска похожих графических ответов
+    SIMILARITY_GRID_SIZE = (48, 32)  # Размер уменьшенной маски (ширина, высота)
+    SIMILARITY_NUM_PERM = 64  # Длина MinHash-сигнатуры
+    SIMILARITY_LSH_BANDS = 16  # Количество LSH-полос
+    SIMILARITY_THRESHOLD = 0.9  # Минимальная схожесть для отчёта
+    SIMILARITY_REPORT_MAX_ROWS = 1000  # Пар в сохранённом отчёте (самые похожие)